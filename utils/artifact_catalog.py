@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+# Usage: artifact_catalog.py [--catalog DB] scan DIR ... [--no-hash]
+#        artifact_catalog.py [--catalog DB] find [--kind KIND] [--under DIR]
+#                                           [--json]
+#        artifact_catalog.py [--catalog DB] show PATH
+#        artifact_catalog.py [--catalog DB] prune
+#
+# SQLite catalog of profiles and analysis outputs: the BasicBlocks*, KOIPerf.*
+# directories, t.* SimPoint files, region CSVs and slice traces, with their
+# size, mtime, SHA-1, the parameters they were made with and key summary
+# numbers.  Stages register what they write, so tools can look artifacts up
+# instead of walking directory trees.  The catalog is used when --catalog is
+# given or $XPUPOINT_CATALOG is set.
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import namedtuple
+
+CATALOG_ENV = 'XPUPOINT_CATALOG'
+
+# Kind of an artifact from its name, first match wins.
+KINDS = [
+  ('BasicBlocksCPU', 'cpu-profile'),
+  ('BasicBlocks.*', 'gpu-profile'),
+  ('KOIPerf.*', 'timer'),
+  ('xpuregions.csv', 'regions'),
+  ('gpuregions.csv', 'regions'),
+  ('t.simpoints', 'simpoint'),
+  ('t.weights', 'simpoint'),
+  ('t.labels', 'simpoint'),
+  ('t.iweights', 'simpoint'),
+  ('T.global.hv', 'bbv'),
+  ('global.bbv', 'bbv'),
+  ('slice.trace.txt', 'slice-trace'),
+  ('slice.trace.npz', 'slice-trace'),
+]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS artifacts (
+  path TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  stage TEXT,
+  size INTEGER,
+  mtime_ns INTEGER,
+  sha1 TEXT,
+  params TEXT,
+  summary TEXT,
+  registered REAL
+);
+CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind, path);
+'''
+
+COLUMNS = ('path', 'kind', 'stage', 'size', 'mtime_ns', 'sha1', 'params',
+           'summary', 'registered')
+
+Artifact = namedtuple('Artifact', COLUMNS)
+
+
+def classify(path):
+  """@return kind of an artifact from its name, or None"""
+  name = os.path.basename(os.path.normpath(path))
+  for pattern, kind in KINDS:
+    if fnmatch.fnmatchcase(name, pattern):
+      return kind
+  return None
+
+
+def file_sha1(path):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def _stat(path):
+  """@return (size, mtime_ns) of a file, or of the files in a directory"""
+  st = os.stat(path)
+  if not os.path.isdir(path):
+    return st.st_size, st.st_mtime_ns
+  size = 0
+  with os.scandir(path) as it:
+    for entry in it:
+      if entry.is_file():
+        size += entry.stat().st_size
+  return size, st.st_mtime_ns
+
+
+def _row(row):
+  a = Artifact(*row)
+  return a._replace(params=json.loads(a.params or '{}'),
+                    summary=json.loads(a.summary or '{}'))
+
+
+def _under(prefix):
+  """@return SQL condition and arguments for paths inside 'prefix'"""
+  prefix = os.path.abspath(prefix).rstrip(os.sep) + os.sep
+  # Every path starting with 'prefix' sorts between it and the same string
+  # with the separator incremented, so the primary key index is used.
+  end = prefix[:-1] + chr(ord(os.sep) + 1)
+  return 'path >= ? AND path < ?', [prefix, end]
+
+
+class Catalog:
+  """
+  Catalog of artifacts keyed by absolute path.  Safe to share between the
+  threads of a process; processes sharing a catalog are serialized by
+  SQLite.
+  """
+
+  def __init__(self, path):
+    self.path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+    try:
+      self.db.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.DatabaseError:
+      # Not supported on some network file systems.
+      pass
+    with self.db:
+      self.db.executescript(SCHEMA)
+
+  def close(self):
+    self.db.close()
+
+  def register(self, path, kind=None, stage=None, params=None, summary=None,
+               hash=True):
+    """
+    Add or refresh the entry of a file or directory.  The hash is only
+    computed again when the size or mtime changed.  'summary' is merged into
+    the summary already recorded for the same content.
+
+    @return Artifact as recorded
+    """
+    path = os.path.abspath(path)
+    size, mtime_ns = _stat(path)
+    old = self.get(path, current=False)
+    same = old is not None and (old.size, old.mtime_ns) == (size, mtime_ns)
+    sha1 = None
+    if os.path.isfile(path):
+      if same and old.sha1:
+        sha1 = old.sha1
+      elif hash:
+        sha1 = file_sha1(path)
+    merged = dict(old.summary) if same else {}
+    merged.update(summary or {})
+    if params is None and same:
+      params = old.params
+    a = Artifact(path, kind or classify(path) or (old.kind if old else 'file'),
+                 stage or (old.stage if old else None), size, mtime_ns, sha1,
+                 params or {}, merged, time.time())
+    with self.lock, self.db:
+      self.db.execute(
+          'INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+          a._replace(params=json.dumps(a.params, sort_keys=True, default=str),
+                     summary=json.dumps(a.summary, sort_keys=True)))
+    return a
+
+  def add_summary(self, path, **summary):
+    """Merge key numbers into the summary of a registered artifact."""
+    return self.register(path, summary=summary)
+
+  @staticmethod
+  def is_current(a):
+    """@return True if the artifact is still there, unchanged"""
+    try:
+      st = os.stat(a.path)
+    except OSError:
+      return False
+    # A directory changes whenever one of its files is replaced; only its
+    # existence is checked.
+    return os.path.isdir(a.path) or \
+        (st.st_size, st.st_mtime_ns) == (a.size, a.mtime_ns)
+
+  def get(self, path, current=True):
+    """@return Artifact of a path, or None if unknown (or changed)"""
+    with self.lock:
+      row = self.db.execute(
+          'SELECT * FROM artifacts WHERE path = ?',
+          (os.path.abspath(path),)).fetchone()
+    if row is None:
+      return None
+    a = _row(row)
+    if current and not self.is_current(a):
+      return None
+    return a
+
+  def find(self, kind=None, under=None, name=None, current=True):
+    """
+    Query artifacts by kind, directory and base name pattern.
+
+    @return list of Artifact sorted by path
+    """
+    cond = []
+    args = []
+    if kind:
+      cond.append('kind = ?')
+      args.append(kind)
+    if under:
+      c, a = _under(under)
+      cond.append(c)
+      args += a
+    sql = 'SELECT * FROM artifacts'
+    if cond:
+      sql += ' WHERE ' + ' AND '.join(cond)
+    with self.lock:
+      rows = self.db.execute(sql + ' ORDER BY path', args).fetchall()
+    res = [_row(r) for r in rows]
+    if name:
+      res = [a for a in res
+             if fnmatch.fnmatchcase(os.path.basename(a.path), name)]
+    if current:
+      res = [a for a in res if self.is_current(a)]
+    return res
+
+  def prune(self):
+    """
+    Drop the entries of artifacts which were removed.
+
+    @return number of entries dropped
+    """
+    gone = [a.path for a in self.find(current=False)
+            if not os.path.exists(a.path)]
+    with self.lock, self.db:
+      self.db.executemany('DELETE FROM artifacts WHERE path = ?',
+                          [(p,) for p in gone])
+    return len(gone)
+
+  def scan(self, root, hash=True):
+    """
+    Register every known kind of artifact below 'root', e.g. to start a
+    catalog for results made before it existed.
+
+    @return number of artifacts registered
+    """
+    n = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+      for name in dirnames + filenames:
+        if classify(name):
+          self.register(os.path.join(dirpath, name), hash=hash)
+          n += 1
+    return n
+
+
+def open_catalog(path=None):
+  """
+  Open the catalog given, or the one named by $XPUPOINT_CATALOG.
+
+  @return Catalog, or None if no catalog is configured
+  """
+  path = path or os.environ.get(CATALOG_ENV)
+  return Catalog(path) if path else None
+
+
+def print_artifacts(artifacts, as_json=False):
+  if as_json:
+    json.dump([a._asdict() for a in artifacts], sys.stdout, indent=2)
+    print()
+    return
+  for a in artifacts:
+    summary = ' '.join(f'{k}={v}' for k, v in sorted(a.summary.items()))
+    print(f'{a.kind:12s} {a.size:>12d} {a.path} {summary}'.rstrip())
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Catalog of profiles and analysis outputs')
+  parser.add_argument('--catalog',
+                      help=f'catalog file (default: ${CATALOG_ENV})')
+  sub = parser.add_subparsers(dest='cmd', required=True)
+  p = sub.add_parser('scan', help='register the artifacts below directories')
+  p.add_argument('dirs', nargs='+')
+  p.add_argument('--no-hash', action='store_true',
+                 help='do not compute SHA-1 of the files')
+  p = sub.add_parser('find', help='list artifacts')
+  p.add_argument('--kind', help='one of: %s' % ', '.join(
+      sorted(set(k for _, k in KINDS))))
+  p.add_argument('--under', help='only artifacts inside this directory')
+  p.add_argument('--name', help='base name pattern, e.g. "perf.*"')
+  p.add_argument('--all', action='store_true',
+                 help='include artifacts which changed or were removed')
+  p.add_argument('--json', action='store_true', help='print JSON')
+  p = sub.add_parser('show', help='print the entry of a path')
+  p.add_argument('path')
+  sub.add_parser('prune', help='drop the entries of removed artifacts')
+  args = parser.parse_args()
+
+  catalog = open_catalog(args.catalog)
+  if catalog is None:
+    parser.error(f'no catalog: use --catalog or set ${CATALOG_ENV}')
+
+  if args.cmd == 'scan':
+    for d in args.dirs:
+      n = catalog.scan(d, hash=not args.no_hash)
+      print(f'{d}: {n} artifacts registered')
+  elif args.cmd == 'find':
+    print_artifacts(catalog.find(args.kind, args.under, args.name,
+                                 current=not args.all), args.json)
+  elif args.cmd == 'show':
+    a = catalog.get(args.path, current=False)
+    if a is None:
+      print(f'{args.path}: not in the catalog')
+      return 1
+    json.dump(a._asdict(), sys.stdout, indent=2)
+    print()
+    if not Catalog.is_current(a):
+      print(f'{args.path}: changed since it was registered')
+  else:
+    print(f'{catalog.prune()} entries dropped')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
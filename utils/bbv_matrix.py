@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# Usage: bbv_matrix.py T.global.hv [...]
+#
+# Sparse matrix of a concatenated vector file (T.global.hv, global.bbv):
+# one CSR row per 'T' line, with the 'M:' markers around it, saved once as
+# '<vector file>.csr.npz' next to it.  gen_insweights.py and xpu_regions.py
+# read the slices from it instead of parsing the text again, so per-slice
+# sums, normalization and projection are single numpy operations.
+#
+# The arrays of the cache are stored uncompressed and load memory-mapped.
+# The cache records the size and mtime of the vector file it was built from
+# and is rebuilt when they change.  Vector files with 'S:' markers or
+# 'Block id:' sections, which only the text readers understand, get no
+# cache: open_matrix() returns None and the callers read the text.
+#
+# Command line: build the caches of the given vector files.
+
+import os
+import sys
+import logging
+from array import array
+
+import numpy as np
+
+CACHE_SUFFIX = '.csr.npz'
+CACHE_VERSION = 1
+
+# Compressed vector files are left to util.OpenCompressFile().
+COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'PK\x03\x04')
+
+log = logging.getLogger(__name__)
+
+
+class BBVMatrix:
+  """
+  Slices x basic blocks counts in CSR form.
+
+  Row i spans blocks[indptr[i]:indptr[i + 1]] and counts[...].  Slice i
+  starts at marker i and ends at marker i + 1 (markers are kernel names,
+  or 'M:' pcs, and their counts).
+  """
+
+  def __init__(self, arrays):
+    self.indptr = arrays['indptr']
+    self.blocks = arrays['blocks']
+    self.counts = arrays['counts']
+    self.marker_pcs = arrays['marker_pcs']
+    self.marker_counts = arrays['marker_counts']
+
+  @property
+  def num_slices(self):
+    return len(self.indptr) - 1
+
+  def row_lengths(self):
+    return np.diff(self.indptr)
+
+  def row_sums(self):
+    """@return the instruction count of every slice"""
+    return np.add.reduceat(np.append(self.counts, 0),
+                           self.indptr[:-1]) * (self.row_lengths() > 0)
+
+  def row_ids(self):
+    """@return the slice of every entry"""
+    return np.repeat(np.arange(self.num_slices), self.row_lengths())
+
+  def normalized(self):
+    """@return the counts divided by the sum of their slice (0 if empty)"""
+    sums = self.row_sums().astype(np.float64)
+    sums[sums == 0] = 1
+    return self.counts / np.repeat(sums, self.row_lengths())
+
+  def project(self, proj_dim=15, rng=None):
+    """
+    Project the normalized slices on 'proj_dim' dimensions with a random
+    matrix of values in [-1, 1), one row per basic block.
+
+    @return array of shape (num_slices, proj_dim)
+    """
+    rng = rng or np.random.default_rng()
+    uniq, col = np.unique(self.blocks, return_inverse=True)
+    proj = rng.uniform(-1, 1, size=(len(uniq), proj_dim))
+    rows = self.row_ids()
+    weights = self.normalized()
+    result = np.empty((self.num_slices, proj_dim))
+    # One pass per dimension keeps the memory at one value per entry.
+    for d in range(proj_dim):
+      result[:, d] = np.bincount(rows, weights=weights * proj[col, d],
+                                 minlength=self.num_slices)
+    return result
+
+  def marker(self, i):
+    """@return marker 'i' as the dict xpu_regions.GetMarker() returns"""
+    return {'pc': str(self.marker_pcs[i]),
+            'count': int(self.marker_counts[i]),
+            'imagename': 'no_image',
+            'offset': '0x0',
+            'sourceinfo': 'Unknown:0'}
+
+
+def cache_path(bbv_file):
+  return bbv_file + CACHE_SUFFIX
+
+
+def parse(bbv_file):
+  """
+  Parse a vector file the way xpu_regions.py reads it: the first 'M:' line
+  is the start marker, then each 'T' line is a slice and the first 'M:' line
+  after it its end marker.
+
+  @return dict of the arrays, or None for files using what the matrix does
+          not represent
+  """
+  # Entries go straight into 8-byte buffers, not lists of Python objects.
+  indptr = array('q', [0])
+  blocks = array('q')
+  counts = array('q')
+  pcs = []
+  marker_counts = []
+  in_slice = False
+
+  with open(bbv_file, 'rb') as f:
+    if f.read(4).startswith(COMPRESSED_MAGIC):
+      return None
+  with open(bbv_file, 'r') as f:
+    for line in f:
+      c = line[:1]
+      if c == 'M':
+        fields = line.split()
+        if fields[0] != 'M:' or len(fields) < 3:
+          return None
+        if in_slice or not pcs:
+          pcs.append(fields[1])
+          marker_counts.append(int(fields[2]))
+          in_slice = False
+      elif c == 'T':
+        if not pcs:
+          # Skipped while looking for the first marker.
+          return None
+        if in_slice:
+          # A slice with no end marker of its own.
+          return None
+        if line != 'T\n':
+          vals = line[1:].replace(':', ' ').split()
+          if not vals or len(vals) % 2 or not line.startswith('T:'):
+            return None
+          try:
+            blocks.extend(map(int, vals[0::2]))
+            counts.extend(map(int, vals[1::2]))
+          except (ValueError, OverflowError):
+            return None
+        indptr.append(len(blocks))
+        in_slice = True
+      elif c == 'S' or line.startswith('Block id:'):
+        return None
+
+  if not pcs:
+    return None
+  if in_slice:
+    # The last slice ends at the end of the file.
+    pcs.append('0')
+    marker_counts.append(0)
+  blocks = np.frombuffer(blocks, dtype=np.int64)
+  if not blocks.size or (blocks.min() >= 0 and
+                         blocks.max() <= np.iinfo(np.int32).max):
+    blocks = blocks.astype(np.int32)
+  return {
+      'indptr': np.frombuffer(indptr, dtype=np.int64),
+      'blocks': blocks,
+      'counts': np.frombuffer(counts, dtype=np.int64),
+      'marker_pcs': np.array(pcs, dtype=str),
+      'marker_counts': np.array(marker_counts, dtype=np.int64),
+  }
+
+
+def _source_key(bbv_file):
+  st = os.stat(bbv_file)
+  return np.array([CACHE_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def save(arrays, bbv_file):
+  """Write the cache of 'bbv_file' atomically; @return its path"""
+  path = cache_path(bbv_file)
+  tmp = '%s.%d.tmp.npz' % (path, os.getpid())
+  np.savez(tmp, source=_source_key(bbv_file), **arrays)
+  os.replace(tmp, path)
+  return path
+
+
+def _mmap_member(path, info):
+  """@return the .npy member 'info' of an uncompressed .npz, memory-mapped"""
+  with open(path, 'rb') as f:
+    f.seek(info.header_offset)
+    local = f.read(30)
+    name_len = int.from_bytes(local[26:28], 'little')
+    extra_len = int.from_bytes(local[28:30], 'little')
+    f.seek(info.header_offset + 30 + name_len + extra_len)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+      header = np.lib.format.read_array_header_1_0(f)
+    else:
+      header = np.lib.format.read_array_header_2_0(f)
+    shape, fortran, dtype = header
+    offset = f.tell()
+  if dtype.hasobject:
+    raise ValueError('object arrays cannot be memory-mapped')
+  if not shape or 0 in shape:
+    return np.zeros(shape, dtype=dtype)
+  return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                   order='F' if fortran else 'C')
+
+
+def load(path, mmap=True):
+  """
+  Load a cache file, its arrays memory-mapped when 'mmap' and stored
+  uncompressed.
+
+  @return dict of the arrays
+  """
+  import zipfile
+
+  arrays = {}
+  with zipfile.ZipFile(path) as z:
+    infos = {os.path.splitext(i.filename)[0]: i for i in z.infolist()}
+  with np.load(path) as data:
+    for name, info in infos.items():
+      if mmap and info.compress_type == zipfile.ZIP_STORED:
+        try:
+          arrays[name] = _mmap_member(path, info)
+          continue
+        except ValueError:
+          pass
+      arrays[name] = data[name]
+  return arrays
+
+
+def open_matrix(bbv_file, build=True):
+  """
+  Get the matrix of 'bbv_file' from its cache, building the cache first if
+  it is missing or stale and 'build' is set.
+
+  @return BBVMatrix, or None if the file has no matrix form (or no cache and
+          'build' is not set)
+  """
+  path = cache_path(bbv_file)
+  key = _source_key(bbv_file)
+  if os.path.exists(path):
+    try:
+      arrays = load(path)
+      if np.array_equal(arrays.get('source'), key):
+        return BBVMatrix(arrays)
+    except (IOError, ValueError, KeyError) as e:
+      log.warning(f'Ignoring unreadable BBV matrix {path}: {e}')
+  if not build:
+    return None
+
+  arrays = parse(bbv_file)
+  if arrays is None:
+    return None
+  try:
+    save(arrays, bbv_file)
+  except OSError as e:
+    log.warning(f'Unable to write BBV matrix {path}: {e}')
+  return BBVMatrix(arrays)
+
+
+def build_cache(bbv_file):
+  """
+  Write the cache of 'bbv_file' unless it is current.
+
+  @return its path, or None if the file has no matrix form
+  """
+  if open_matrix(bbv_file) is None:
+    log.info(f'{bbv_file} has no matrix form, its readers parse the text')
+    return None
+  return cache_path(bbv_file)
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO,
+                      format='%(asctime)s - %(levelname)s - %(message)s')
+  if len(sys.argv) < 2:
+    print('Usage: bbv_matrix.py T.global.hv [...]')
+    sys.exit(1)
+  for f in sys.argv[1:]:
+    path = build_cache(f)
+    if path:
+      log.info(f'BBV matrix of {f}: {path}')
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+# Usage: bench_stages.py [--scales 1,10,100] [--threads 4,8,16] [-r 3]
+#                        [--recorded DIR ...] [--stages threadsplit,...]
+#                        [--save results.json] [--baseline baseline.json]
+#
+# Time each post-processing stage on its own, at several input scales and
+# thread counts, on synthetic profiles written by synth_profile.py and on
+# recorded ones (--recorded, a testcase directory with BasicBlocksCPU/,
+# BasicBlocks.*/ and KOIPerf.*/).  Recorded profiles are only read; every
+# output goes to the work directory.
+#
+# Each stage runs in its own Python process, so its peak RSS is its own.  The
+# time is that of the stage's entry point alone, without interpreter start-up
+# and numpy import.  Throughput is reported in slices/s and in MB/s of input.
+#
+# With --baseline, the results are compared to a previous --save file and the
+# exit status is 1 if a stage lost more than --max-slowdown percent of its
+# throughput or grew its peak RSS by more than --max-rss-growth percent.  The
+# baseline is read before anything runs and must not be the --save file.
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import logging
+import platform
+import statistics
+import subprocess
+
+import stage_metrics
+
+UTILS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+RESULTS_VERSION = 1
+
+STAGES = ['threadsplit', 'gpu-concat', 'xpu-concat', 'bbv-matrix',
+          'regions-csv', 'regions-project', 'weights', 'slice-rdtsc',
+          'extrapolate']
+
+# Stages reading the SimPoint clustering.
+CLUSTERED = {'regions-csv', 'regions-project', 'weights', 'slice-rdtsc',
+             'extrapolate'}
+
+CLUSTER_FILES = ('t.simpoints', 't.weights', 't.labels')
+
+PERF_REPEATS = 3
+
+log = logging.getLogger(__name__)
+
+
+def find_dir(testcase_dir, pattern):
+  for match in sorted(glob.glob(os.path.join(testcase_dir, pattern))):
+    if os.path.isdir(match):
+      return match
+  return None
+
+
+def count_slices(gpudir):
+  """@return the number of slices of the GPU global.bbv of a profile"""
+  n = 0
+  with open(os.path.join(gpudir, 'global.bbv')) as f:
+    for line in f:
+      if line.startswith('T'):
+        n += 1
+  return n
+
+
+class Case:
+  """One profile to benchmark and the directory its outputs go to."""
+
+  def __init__(self, name, testcase_dir, outdir, scale=None, model=None):
+    import threadsplit
+
+    self.name = name
+    self.scale = scale
+    self.model = model
+    self.out = os.path.abspath(outdir)
+    self.cpudir = find_dir(testcase_dir, 'BasicBlocksCPU')
+    self.gpudir = find_dir(testcase_dir, 'BasicBlocks.*')
+    self.koidir = find_dir(testcase_dir, 'KOIPerf.*')
+    if not self.cpudir or not self.gpudir:
+      raise ValueError(f'No XPU-Profiler results in {testcase_dir}')
+    self.cpudir = os.path.abspath(self.cpudir)
+    self.gpudir = os.path.abspath(self.gpudir)
+    self.cpu_threads = len(glob.glob(os.path.join(self.cpudir, 'T.*.bb')))
+    self.gpu_threads = threadsplit.get_num_threads(self.gpudir)
+    self.slices = model.num_slices if model else count_slices(self.gpudir)
+    if model:
+      self.perfdir = os.path.join(self.out, 'perf')
+    else:
+      self.perfdir = os.path.join(os.path.abspath(testcase_dir), 'perf')
+    os.makedirs(self.out, exist_ok=True)
+
+  def path(self, *names):
+    return os.path.join(self.out, *names)
+
+  def stages(self):
+    """
+    @return dict {stage: spec} of how to run each stage on this case: the
+            function or script to run, its arguments, inputs and outputs
+    """
+    gpu_out = self.path('gpu-perthread')
+    cpu_bb = [os.path.join(self.cpudir, f'T.{i}.bb')
+              for i in range(self.cpu_threads)]
+    hv = self.path('T.global.hv')
+    tfiles = [self.path(f) for f in CLUSTER_FILES]
+    csv = self.path('xpuregions.csv')
+    s = {}
+    s['threadsplit'] = {
+        'call': 'threadsplit.main',
+        'args': [self.gpu_threads, self.gpudir, gpu_out],
+        'inputs': [os.path.join(self.gpudir, 'thread.bbv')],
+        'outputs': [os.path.join(gpu_out, f'T.{i}.bb')
+                    for i in range(self.gpu_threads)]}
+    s['gpu-concat'] = {
+        'call': 'concat_xpu_vectors.main',
+        'args': [self.gpu_threads, self.cpudir, gpu_out, gpu_out, 'gpu'],
+        'inputs': s['threadsplit']['outputs'],
+        'outputs': [os.path.join(gpu_out, 'global.bbv')]}
+    s['xpu-concat'] = {
+        'call': 'concat_xpu_vectors.main',
+        'args': [self.cpu_threads + 1, self.cpudir, gpu_out, self.out, 'xpu'],
+        'inputs': cpu_bb + [os.path.join(gpu_out, 'global.bbv')],
+        'outputs': [hv]}
+    s['bbv-matrix'] = {
+        'call': 'bbv_matrix.build_cache',
+        'args': [hv],
+        'inputs': [hv],
+        'outputs': [hv + '.csr.npz']}
+    s['regions-csv'] = {
+        'script': 'xpu_regions.py',
+        'argv': ['--csv_region', '--bbv_file', hv, '--region_file', tfiles[0],
+                 '--weight_file', tfiles[1], '--label_file', tfiles[2],
+                 '--csv_file', csv],
+        'inputs': [hv] + tfiles,
+        'outputs': [csv]}
+    s['regions-project'] = {
+        'script': 'xpu_regions.py',
+        'argv': ['--project_bbv', '--bbv_file', hv, '--dimensions', '15'],
+        'stdout': self.path('T.global.proj'),
+        'inputs': [hv]}
+    s['weights'] = {
+        'call': 'gen_insweights.main',
+        'args': [self.out, 'T.global.hv'],
+        'inputs': [hv, tfiles[0], tfiles[2]],
+        'outputs': [self.path('t.iweights')]}
+    if self.koidir:
+      rdtsc = os.path.join(self.koidir, 'gpu.onkernelperf.out')
+      s['slice-rdtsc'] = {
+          'script': 'report.slice-rdtsc.py',
+          'argv': ['--rdtsc_file', rdtsc, '--region_file', tfiles[0],
+                   '--label_file', tfiles[2], '--weights_file', tfiles[1]],
+          'stdout': self.path('slice.trace.txt'),
+          'inputs': [rdtsc] + tfiles}
+    s['extrapolate'] = {
+        'script': 'extrapolate.py',
+        'argv': ['-w', self.perfdir, '-r', self.perfdir, '-c', csv],
+        'stdout': self.path('extrapolate.txt'),
+        'inputs': [csv] + glob.glob(os.path.join(self.perfdir, 'perf.*'))}
+    return s
+
+  def prepare(self, stage, simpoint_bin=None):
+    """
+    Provide what 'stage' needs besides the outputs of the stages before it:
+    the clustering, and the region timer files of extrapolate.
+
+    @return False if it cannot be provided
+    """
+    if stage in CLUSTERED and not self._clusters(simpoint_bin):
+      return False
+    if stage == 'extrapolate':
+      if self.model and not glob.glob(os.path.join(self.perfdir, 'perf.*')):
+        import synth_profile
+        synth_profile.write_perf(self.model, self.path('xpuregions.csv'),
+                                 self.perfdir, PERF_REPEATS)
+      return (os.path.exists(self.path('xpuregions.csv')) and
+              bool(glob.glob(os.path.join(self.perfdir, 'perf.wp.txt*'))))
+    return True
+
+  def _clusters(self, simpoint_bin):
+    import shutil
+
+    if all(os.path.exists(self.path(f)) for f in CLUSTER_FILES):
+      return True
+    if self.model:
+      import synth_profile
+      synth_profile.write_clusters(self.model, self.out)
+      return True
+    if all(os.path.exists(os.path.join(self.cpudir, f))
+           for f in CLUSTER_FILES):
+      for f in CLUSTER_FILES:
+        shutil.copy(os.path.join(self.cpudir, f), self.out)
+      return True
+    if simpoint_bin and os.path.exists(self.path('T.global.hv')):
+      import run_simpoint
+      run_simpoint.main(20, 128, self.path('T.global.hv'), self.out,
+                        no_regions=True, simpoint_bin=simpoint_bin)
+      return True
+    return False
+
+
+def synthetic_case(workdir, scale, threads, gpu_threads):
+  """
+  @return the Case of a synthetic profile, written by synth_profile.py
+          unless the work directory has one with the same parameters
+  """
+  import synth_profile
+
+  name = f'x{scale:g}-t{threads}'
+  params = dict(synth_profile.DEFAULTS, scale=scale, cpu_threads=threads,
+                gpu_threads=gpu_threads)
+  profile_dir = os.path.join(workdir, 'profiles', name)
+  try:
+    with open(os.path.join(profile_dir, synth_profile.PARAMS_FILE)) as f:
+      current = json.load(f) == params
+  except (IOError, ValueError):
+    current = False
+  if current:
+    model = synth_profile.load_model(profile_dir)
+  else:
+    log.info(f'Writing synthetic profile {name}')
+    model = synth_profile.generate(profile_dir, params)
+  return Case(name, profile_dir, os.path.join(workdir, name), scale, model)
+
+
+def peak_rss_kb():
+  """
+  @return the peak RSS of this process since it was started, or None
+
+  ru_maxrss of a child carries the peak of the process it was forked from
+  over exec, while VmHWM starts again with the new program.
+  """
+  try:
+    with open('/proc/self/status') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except (OSError, ValueError):
+    pass
+  return None
+
+
+def run_child(spec_file, result_file):
+  """Run one stage in this process and write its time to 'result_file'."""
+  import runpy
+  import importlib
+
+  # Imported here, to leave it out of the timed region.
+  importlib.import_module('numpy')
+  with open(spec_file) as f:
+    spec = json.load(f)
+  sys.path.insert(0, UTILS_DIR)
+  logging.basicConfig(level=logging.WARNING)
+
+  if 'call' in spec:
+    module, func = spec['call'].rsplit('.', 1)
+    func = getattr(importlib.import_module(module), func)
+
+    def run():
+      func(*spec['args'])
+  else:
+    script = os.path.join(UTILS_DIR, spec['script'])
+
+    def run():
+      sys.argv = [script] + spec['argv']
+      try:
+        runpy.run_path(script, run_name='__main__')
+      except SystemExit as e:
+        if e.code not in (None, 0):
+          raise
+
+  import resource
+  ru0 = resource.getrusage(resource.RUSAGE_SELF)
+  t0 = time.perf_counter()
+  run()
+  sys.stdout.flush()
+  wall = time.perf_counter() - t0
+  ru1 = resource.getrusage(resource.RUSAGE_SELF)
+  with open(result_file, 'w') as f:
+    json.dump({'wall': wall,
+               'cpu': (ru1.ru_utime - ru0.ru_utime +
+                       ru1.ru_stime - ru0.ru_stime),
+               'maxrss_kb': peak_rss_kb()}, f)
+
+
+def run_stage(case, stage, spec, repeats):
+  """
+  Run a stage 'repeats' times in a child process.
+
+  @return its result record: median time, peak RSS and throughput
+  """
+  spec_file = case.path(f'.bench-{stage}.json')
+  result_file = case.path(f'.bench-{stage}.result')
+  with open(spec_file, 'w') as f:
+    json.dump(spec, f)
+  cmd = [sys.executable, os.path.realpath(__file__), '--child', spec_file,
+         result_file]
+
+  walls = []
+  cpus = []
+  rss_kb = 0
+  for _ in range(repeats):
+    with stage_metrics.StageRecorder(stage, spec['inputs'],
+                                     spec.get('outputs', ())) as rec:
+      if 'stdout' in spec:
+        with open(spec['stdout'], 'w') as out:
+          stage_metrics.run_cmd(cmd, stdout=out)
+      else:
+        stage_metrics.run_cmd(cmd)
+    with open(result_file) as f:
+      t = json.load(f)
+    walls.append(t['wall'])
+    cpus.append(t['cpu'])
+    rss_kb = max(rss_kb, t['maxrss_kb'] or rec.m['child_maxrss_kb'])
+  for f in (spec_file, result_file):
+    os.remove(f)
+
+  wall = statistics.median(walls)
+  output_bytes = rec.m['output_bytes']
+  if 'stdout' in spec:
+    output_bytes += os.path.getsize(spec['stdout'])
+  return {
+      'case': case.name,
+      'scale': case.scale,
+      'cpu_threads': case.cpu_threads,
+      'gpu_threads': case.gpu_threads,
+      'slices': case.slices,
+      'stage': stage,
+      'repeats': repeats,
+      'wall': round(wall, 6),
+      'cpu': round(statistics.median(cpus), 6),
+      'slices_per_s': round(case.slices / wall, 3) if wall else None,
+      'mb_per_s': round(rec.m['input_bytes'] / 1e6 / wall, 3) if wall else None,
+      'input_mb': round(rec.m['input_bytes'] / 1e6, 3),
+      'output_mb': round(output_bytes / 1e6, 3),
+      'peak_rss_mb': round(rss_kb / 1024.0, 1),
+  }
+
+
+def run_case(case, stages, repeats, simpoint_bin=None):
+  results = []
+  for stage in stages:
+    # Built after prepare(), as the inputs of extrapolate are the timer
+    # files it may write.
+    spec = case.prepare(stage, simpoint_bin) and case.stages().get(stage)
+    if not spec:
+      log.warning(f'{case.name}: skipping {stage}, its inputs are missing')
+      continue
+    try:
+      r = run_stage(case, stage, spec, repeats)
+    except subprocess.CalledProcessError as e:
+      err = (e.stderr or '').strip().splitlines()
+      log.error(f'{case.name}: {stage} failed: {err[-1] if err else e}')
+      continue
+    log.info(f'{case.name}: {stage} {r["wall"]:.3f}s')
+    results.append(r)
+  return results
+
+
+def compare(results, baseline, max_slowdown, max_rss_growth, min_wall):
+  """
+  Compare 'results' to the records of 'baseline' for the same case and
+  stage.  Stages faster than 'min_wall' seconds in both are only compared
+  for memory, their times being mostly noise.
+
+  @return dict {(case, stage): (throughput change %, RSS change %)} and
+          list of regression messages
+  """
+  base = {(b['case'], b['stage']): b for b in baseline}
+  changes = {}
+  regressions = []
+  for r in results:
+    b = base.get((r['case'], r['stage']))
+    if not b:
+      continue
+    speed = (b['wall'] / r['wall'] - 1) * 100 if r['wall'] else 0.0
+    rss = (r['peak_rss_mb'] / b['peak_rss_mb'] - 1) * 100 \
+        if b['peak_rss_mb'] else 0.0
+    changes[(r['case'], r['stage'])] = (speed, rss)
+    name = f'{r["case"]} {r["stage"]}'
+    if max(r['wall'], b['wall']) >= min_wall and -speed > max_slowdown:
+      regressions.append(f'{name}: throughput {speed:+.1f}% '
+                         f'({b["wall"]:.3f}s -> {r["wall"]:.3f}s)')
+    if rss > max_rss_growth:
+      regressions.append(f'{name}: peak RSS {rss:+.1f}% '
+                         f'({b["peak_rss_mb"]:.1f}MB -> '
+                         f'{r["peak_rss_mb"]:.1f}MB)')
+  return changes, regressions
+
+
+def summary_table(results, changes=None):
+  lines = []
+  hdr = '%-12s %-16s %9s %8s %12s %9s %9s' % (
+      'case', 'stage', 'slices', 'wall(s)', 'slices/s', 'MB/s', 'rss(MB)')
+  if changes is not None:
+    hdr += ' %9s %9s' % ('speed', 'rss')
+  lines.append(hdr)
+  lines.append('-' * len(hdr))
+  for r in results:
+    line = '%-12s %-16s %9d %8.3f %12.1f %9.1f %9.1f' % (
+        r['case'], r['stage'], r['slices'], r['wall'],
+        r['slices_per_s'] or 0, r['mb_per_s'] or 0, r['peak_rss_mb'])
+    if changes is not None:
+      c = changes.get((r['case'], r['stage']))
+      line += ' %+8.1f%% %+8.1f%%' % c if c else ' %9s %9s' % ('-', '-')
+    lines.append(line)
+  return lines
+
+
+def int_list(s):
+  return [int(x) for x in s.split(',') if x]
+
+
+def float_list(s):
+  return [float(x) for x in s.split(',') if x]
+
+
+def get_args():
+  parser = argparse.ArgumentParser(
+      description='Benchmark the XPU-Point post-processing stages')
+  parser.add_argument('--scales', type=float_list, default=[1.0],
+                      help='synthetic profile scales, comma separated; 1 is '
+                           'a GROMACS-sized run (default: 1)')
+  parser.add_argument('--threads', type=int_list, default=[8],
+                      help='CPU threads of the synthetic profiles, comma '
+                           'separated (default: 8)')
+  parser.add_argument('--gpu-threads', type=int, default=32,
+                      help='GPU threads of the synthetic profiles '
+                           '(default: 32)')
+  parser.add_argument('--recorded', metavar='DIR', action='append', default=[],
+                      help='recorded testcase directory to benchmark as well; '
+                           'may be repeated')
+  parser.add_argument('--no-synthetic', action='store_true',
+                      help='benchmark only the --recorded testcases')
+  parser.add_argument('--stages', default=','.join(STAGES),
+                      help='stages to run, comma separated (default: all)')
+  parser.add_argument('-r', '--repeats', type=int, default=1,
+                      help='runs per stage; the median time is kept '
+                           '(default: 1)')
+  parser.add_argument('--workdir', default='bench-work',
+                      help='where profiles are generated and outputs written; '
+                           'generated profiles are reused (default: '
+                           'bench-work)')
+  parser.add_argument('--simpoint-bin',
+                      help='SimPoint binary, to cluster recorded profiles '
+                           'that have no t.simpoints')
+  parser.add_argument('--save', default='bench-results.json',
+                      help='results file (default: bench-results.json)')
+  parser.add_argument('--baseline', help='results file to compare against')
+  parser.add_argument('--max-slowdown', type=float, default=20.0,
+                      help='throughput loss in %% counted as a regression '
+                           '(default: 20)')
+  parser.add_argument('--max-rss-growth', type=float, default=20.0,
+                      help='peak RSS growth in %% counted as a regression '
+                           '(default: 20)')
+  parser.add_argument('--min-wall', type=float, default=0.05,
+                      help='stages faster than this many seconds are not '
+                           'checked for slowdowns (default: 0.05)')
+  return parser.parse_args()
+
+
+def main():
+  logging.basicConfig(level=logging.INFO,
+                      format='%(asctime)s - %(levelname)s - %(message)s')
+  args = get_args()
+  stages = [s for s in args.stages.split(',') if s]
+  unknown = [s for s in stages if s not in STAGES]
+  if unknown:
+    log.error(f'Unknown stages: {", ".join(unknown)} '
+              f'(known: {", ".join(STAGES)})')
+    return 1
+  if args.repeats < 1:
+    log.error('--repeats must be at least 1')
+    return 1
+
+  # Read the baseline before the results can overwrite it.
+  baseline = None
+  if args.baseline:
+    if os.path.realpath(args.baseline) == os.path.realpath(args.save):
+      log.error(f'--save and --baseline are both {args.baseline}; save the '
+                'results elsewhere')
+      return 1
+    try:
+      with open(args.baseline) as f:
+        baseline = json.load(f)
+    except (IOError, ValueError) as e:
+      log.error(f'Unable to read {args.baseline}: {e}')
+      return 1
+    if not isinstance(baseline, dict) or \
+        baseline.get('version') != RESULTS_VERSION:
+      log.error(f'{args.baseline} is not a version {RESULTS_VERSION} '
+                'results file')
+      return 1
+
+  workdir = os.path.abspath(args.workdir)
+  cases = []
+  if not args.no_synthetic:
+    for scale in args.scales:
+      for threads in args.threads:
+        cases.append(synthetic_case(workdir, scale, threads, args.gpu_threads))
+  for d in args.recorded:
+    name = os.path.basename(os.path.abspath(d))
+    cases.append(Case(name, d, os.path.join(workdir, 'recorded', name)))
+  if not cases:
+    log.error('Nothing to benchmark')
+    return 1
+
+  results = []
+  for case in cases:
+    log.info(f'{case.name}: {case.slices} slices, {case.cpu_threads} CPU and '
+             f'{case.gpu_threads} GPU threads')
+    results += run_case(case, stages, args.repeats, args.simpoint_bin)
+
+  with open(args.save, 'w') as f:
+    json.dump({'version': RESULTS_VERSION,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'host': platform.node(),
+               'python': platform.python_version(),
+               'results': results}, f, indent=2)
+  log.info(f'Results written to {args.save}')
+
+  changes = None
+  regressions = []
+  if baseline:
+    changes, regressions = compare(results, baseline['results'],
+                                   args.max_slowdown, args.max_rss_growth,
+                                   args.min_wall)
+  for line in summary_table(results, changes):
+    print(line)
+  for r in regressions:
+    log.error(f'Regression: {r}')
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  if len(sys.argv) == 4 and sys.argv[1] == '--child':
+    run_child(sys.argv[2], sys.argv[3])
+  else:
+    sys.exit(main())
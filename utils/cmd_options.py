@@ -1517,10 +1517,35 @@ def trace_basename(parser):
                       help="Basename of the trace.")
 
 
+def CallbackLevel(option, opt_str, value, parser):
+    """
+    Call back used for --quiet and --verbose.  Set the option and the level
+    of the diagnostics msg prints.
+
+    @return no return
+    """
+
+    import msg
+
+    setattr(parser.values, option.dest, True)
+    msg.SetLevel(msg.QUIET if option.dest == 'quiet' else msg.VERBOSE)
+
+
+def quiet(parser, group):
+    method = GetMethod(parser, group)
+    method("--quiet",
+           dest="quiet",
+           action="callback",
+           callback=CallbackLevel,
+           default=False,
+           help="Only print errors.")
+
+
 def verbose(parser):
     parser.add_option("--verbose",
                       dest="verbose",
-                      action="store_true",
+                      action="callback",
+                      callback=CallbackLevel,
                       default=False,
                       help="Print out command line used and other information.")
 
@@ -1739,6 +1764,64 @@ def label_file(parser, group):
             default=None,
             help="Name of the file containing Simpoint labels")
 
+
+def csv_prefix(parser, group):
+    method = GetMethod(parser, group)
+    method("--csv_prefix",
+            dest="csv_prefix",
+            default=None,
+            help="Write each regions CSV file to CSV_PREFIX.<tid>.csv instead of stdout.  "
+            "Required when more than one focus thread is given")
+
+
+def csv_file(parser, group):
+    method = GetMethod(parser, group)
+    method("--csv_file",
+            dest="csv_file",
+            default=None,
+            help="Write the regions CSV file to CSV_FILE instead of stdout.")
+
+
+def CallbackProfile(option, opt_str, value, parser):
+    """
+    Call back used for --profile, whose mode is optional: '--profile' alone
+    profiles with cProfile, '--profile=MODE' (or '--profile MODE') with MODE.
+
+    @return no return
+    """
+
+    import profiling
+
+    mode = 'cprofile'
+    if parser.rargs and not parser.rargs[0].startswith('-'):
+        mode = parser.rargs.pop(0)
+        if mode not in profiling.MODES:
+            raise optparse.OptionValueError(
+                "option %s: invalid choice: %r (choose from %s)" %
+                (opt_str, mode, ", ".join(map(repr, profiling.MODES))))
+    setattr(parser.values, option.dest, mode)
+
+
+def profile(parser, group):
+    import profiling
+
+    # nargs=0: optparse leaves an explicit '=MODE' at the front of the
+    # remaining arguments and does not require a value.
+    method = GetMethod(parser, group)
+    method("--profile",
+            dest="profile",
+            action="callback",
+            callback=CallbackProfile,
+            type="string",
+            nargs=0,
+            metavar="MODE",
+            default=None,
+            help="Profile the script with MODE, one of: %s (default: "
+            "cprofile when only --profile is given).  The profile dump and a "
+            "summary of the hottest functions are written to 'profile' in "
+            "the directory of the output file." %
+            ", ".join(profiling.MODES))
+
 #########################################################################
 #
 # Options for DrDebug scripts
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+# Seekable reader for gzip and bzip2 files which decompresses ahead of the
+# reader.
+#
+#
+
+import bisect
+import bz2
+import collections
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+@package compress_reader
+
+Read compressed simulator/BBV files as if they were not compressed.
+
+Files made of independent pieces (BGZF gzip files written by bgzip, and
+bzip2 files, whose blocks of 100-900 kB are compressed on their own) are
+decompressed in parallel, piece by piece.  bzip2 blocks are found by their
+bit-aligned magic numbers and each group of blocks is decompressed as a
+stream of its own.  Other gzip files are decompressed by one background
+thread ahead of the reader.  Either way the decompressed data is read in
+blocks and the reader keeps an index of access points, so seeking within
+the recently read blocks is free and seeking elsewhere restarts from the
+nearest access point rather than from the start of the file.
+"""
+
+# Compressed bytes decompressed at a time.
+#
+BLOCK_SIZE = 1 << 20
+
+# Decompressed blocks to read ahead, and blocks kept for seeking back.
+#
+PREFETCH = 8
+CACHE_BLOCKS = 4
+
+# Decompressed bytes between two gzip access points in a single stream.
+#
+ACCESS_SPAN = 16 << 20
+
+# 48-bit magic numbers starting each bzip2 block and ending each stream,
+# at any bit offset.
+#
+BZ2_BLOCK_MAGIC = 0x314159265359
+BZ2_EOS_MAGIC = 0x177245385090
+
+
+def _GzipDecompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _NewDecompressor(ftype):
+    if ftype == 'gz':
+        return _GzipDecompressor()
+    return bz2.BZ2Decompressor()
+
+
+def _Decompress(dec, data, ftype):
+    """
+    Decompress 'data', continuing with a new decompressor at the start of
+    each following gzip member/bzip2 stream.
+
+    @return (decompressed bytes, decompressor to use for the next data)
+    """
+
+    out = [dec.decompress(data)]
+    while dec.eof:
+        rest = dec.unused_data
+        if not rest:
+            # The member/stream ended with 'data': the next data starts
+            # another one, which a finished bzip2 decompressor refuses.
+            #
+            dec = _NewDecompressor(ftype)
+            break
+        # Some tools pad the file with zeros after the last member.
+        #
+        if not rest.strip(b'\0'):
+            break
+        dec = _NewDecompressor(ftype)
+        out.append(dec.decompress(rest))
+    return b''.join(out), dec
+
+
+def _BgzfMembers(f, size):
+    """
+    Get the offsets of the members of a BGZF file from their headers.
+
+    @return list of member offsets, or None if the file is not BGZF
+    """
+
+    offsets = []
+    pos = 0
+    while pos < size:
+        f.seek(pos)
+        hdr = f.read(18)
+        # ID1 ID2 CM FLG ... XLEN, then the 'BC' subfield with BSIZE.
+        #
+        if len(hdr) < 18 or hdr[:4] != b'\x1f\x8b\x08\x04' or \
+           hdr[12:14] != b'BC':
+            return None
+        offsets.append(pos)
+        pos += struct.unpack('<H', hdr[16:18])[0] + 1
+    return offsets
+
+
+def _BitPatterns(magic):
+    """
+    Get, for each bit offset of a 48-bit magic number in a byte string, the
+    bytes it fully covers.
+
+    @return list of (bit shift, index of those bytes, bytes)
+    """
+
+    patterns = []
+    for shift in range(8):
+        if shift == 0:
+            patterns.append((0, 0, magic.to_bytes(6, 'big')))
+        else:
+            full = (magic << (8 - shift)).to_bytes(7, 'big')
+            patterns.append((shift, 1, full[1:6]))
+    return patterns
+
+
+def _FindMagic(buf, magic, patterns):
+    """
+    Find a 48-bit magic number at any bit offset in 'buf'.
+
+    @return list of bit offsets
+    """
+
+    found = []
+    mask = (1 << 48) - 1
+    for shift, skip, pat in patterns:
+        i = buf.find(pat)
+        while i >= 0:
+            pos = i - skip
+            if pos >= 0 and pos + (7 if shift else 6) <= len(buf):
+                word = int.from_bytes(buf[pos:pos + 7].ljust(7, b'\0'),
+                                      'big')
+                if (word >> (8 - shift)) & mask == magic:
+                    found.append(pos * 8 + shift)
+            i = buf.find(pat, i + 1)
+    return found
+
+
+def _Bz2Blocks(f):
+    """
+    Get the blocks of a bzip2 file, which may hold several streams.
+
+    @return list of (first bit, bit after the block, block CRC), or None if
+            the blocks cannot be told apart
+    """
+
+    block_pat = _BitPatterns(BZ2_BLOCK_MAGIC)
+    eos_pat = _BitPatterns(BZ2_EOS_MAGIC)
+    starts = []
+    ends = []
+    base = 0
+    tail = b''
+    while True:
+        data = f.read(BLOCK_SIZE)
+        if not data:
+            break
+        buf = tail + data
+        off = (base - len(tail)) * 8
+        # Each magic number is seen once: in the chunk it ends in.
+        #
+        lim = len(tail) * 8 - 47
+        starts += [off + b for b in _FindMagic(buf, BZ2_BLOCK_MAGIC, block_pat)
+                   if b >= lim]
+        ends += [off + b for b in _FindMagic(buf, BZ2_EOS_MAGIC, eos_pat)
+                 if b >= lim]
+        tail = buf[-7:]
+        base += len(data)
+
+    starts = sorted(set(starts))
+    ends = sorted(set(ends))
+    bounds = sorted(starts + ends)
+    if not starts or not ends or ends[-1] < starts[-1]:
+        return None
+    blocks = []
+    for b in starts:
+        # The 32-bit block CRC follows the magic number.
+        #
+        f.seek((b + 48) // 8)
+        word = int.from_bytes(f.read(5), 'big')
+        crc = (word >> (8 - (b + 48) % 8)) & 0xffffffff
+        blocks.append((b, bounds[bisect.bisect_right(bounds, b)], crc))
+    return blocks
+
+
+def _Bz2Stream(f, blocks):
+    """
+    Make a bzip2 stream of its own out of consecutive blocks of a file.
+
+    @return compressed bytes
+    """
+
+    bits = 0
+    nbits = 0
+    crc = 0
+    for start, end, block_crc in blocks:
+        f.seek(start // 8)
+        raw = f.read((end + 7) // 8 - start // 8)
+        n = end - start
+        word = int.from_bytes(raw, 'big') >> (len(raw) * 8 - start % 8 - n)
+        bits = (bits << n) | (word & ((1 << n) - 1))
+        nbits += n
+        crc = (((crc << 1) | (crc >> 31)) & 0xffffffff) ^ block_crc
+    # End of stream: magic number, combined CRC, padding to a byte.
+    #
+    bits = (bits << 80) | (BZ2_EOS_MAGIC << 32) | crc
+    nbits += 80
+    pad = -nbits % 8
+    return b'BZh9' + (bits << pad).to_bytes((nbits + pad) // 8, 'big')
+
+
+def _Groups(offsets, size):
+    """
+    Merge independent pieces into groups of about BLOCK_SIZE bytes.
+
+    @return list of (start, end) offsets of the groups
+    """
+
+    groups = []
+    start = offsets[0]
+    for off in offsets[1:]:
+        if off - start >= BLOCK_SIZE:
+            groups.append((start, off))
+            start = off
+    groups.append((start, size))
+    return groups
+
+
+def _Bz2Groups(blocks):
+    """
+    Merge bzip2 blocks into groups of about BLOCK_SIZE compressed bytes.
+
+    @return list of groups, each a list of blocks
+    """
+
+    groups = [[]]
+    nbits = 0
+    for block in blocks:
+        if nbits >= BLOCK_SIZE * 8:
+            groups.append([])
+            nbits = 0
+        groups[-1].append(block)
+        nbits += block[1] - block[0]
+    return groups
+
+
+class CompressedReader(io.RawIOBase):
+    """
+    Raw binary reader of a gzip or bzip2 file.  Wrap it in an
+    io.BufferedReader for readline() and iteration.
+    """
+
+    def __init__(self, path, ftype, jobs=None):
+        self.path = path
+        self.ftype = ftype
+        self.jobs = jobs or os.cpu_count() or 1
+        self.size = os.path.getsize(path)
+        self.pos = 0
+        self.cache = collections.OrderedDict()
+        self.last_end = 0
+        self.eof_pos = None
+        self.thread = None
+        self.stop = None
+        self.queue = None
+
+        # Access points: decompressed offset -> where to restart from.  A
+        # group index for files with independent pieces, a (compressed
+        # offset, decompressor) pair for a single stream.
+        #
+        self.groups = None
+        with open(path, 'rb') as f:
+            if ftype == 'gz':
+                offsets = _BgzfMembers(f, self.size)
+                if offsets and len(offsets) > 1:
+                    self.groups = _Groups(offsets, self.size)
+            else:
+                blocks = _Bz2Blocks(f)
+                if blocks and len(blocks) > 1:
+                    self.groups = _Bz2Groups(blocks)
+        if self.groups is not None:
+            self.access = {0: 0}
+        else:
+            self.access = {0: (0, None)}
+        self._Restart(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            while self.eof_pos is None:
+                self._NextBlock()
+            offset += self.eof_pos
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        block = self._Locate(self.pos)
+        if block is None:
+            return 0
+        start, data = block
+        n = min(len(b), start + len(data) - self.pos)
+        b[:n] = data[self.pos - start:self.pos - start + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        self._StopProducer()
+        super().close()
+
+    def _Locate(self, pos):
+        """
+        Get the decompressed block holding 'pos', reading forward or
+        restarting from an access point as needed.
+
+        @return (decompressed offset, data), or None at end of file
+        """
+
+        for start, data in reversed(self.cache.items()):
+            if start <= pos < start + len(data):
+                self.cache.move_to_end(start)
+                return start, data
+        if self.eof_pos is not None and pos >= self.eof_pos:
+            return None
+        if pos < self.last_end:
+            self._Restart(pos)
+        while True:
+            block = self._NextBlock()
+            if block is None:
+                return None
+            start, data = block
+            if pos < start + len(data):
+                return block
+
+    def _NextBlock(self):
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        if item is None:
+            self.eof_pos = self.last_end
+            return None
+        start, data = item
+        self.last_end = start + len(data)
+        if data:
+            self.cache[start] = data
+            while len(self.cache) > CACHE_BLOCKS:
+                self.cache.popitem(last=False)
+        return item
+
+    def _Restart(self, pos):
+        """Restart decompressing from the last access point before 'pos'."""
+
+        self._StopProducer()
+        upos = max(p for p in self.access if p <= pos)
+        if self.groups is not None:
+            gen = self._GroupBlocks(self.access[upos], upos)
+        else:
+            cpos, dec = self.access[upos]
+            dec = dec.copy() if dec else _NewDecompressor(self.ftype)
+            gen = self._StreamBlocks(cpos, upos, dec)
+        self.last_end = upos
+        self.stop = threading.Event()
+        self.queue = queue.Queue(PREFETCH)
+        self.thread = threading.Thread(target=self._Produce,
+                                       args=(gen, self.queue, self.stop),
+                                       daemon=True)
+        self.thread.start()
+
+    def _StopProducer(self):
+        if self.thread:
+            self.stop.set()
+            # Unblock a producer waiting for room in the queue.
+            #
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.thread.join()
+            self.thread = None
+
+    @staticmethod
+    def _Produce(gen, q, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for item in gen:
+                if not put(item):
+                    gen.close()
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    def _StreamBlocks(self, cpos, upos, dec):
+        next_access = upos + ACCESS_SPAN
+        with open(self.path, 'rb') as f:
+            f.seek(cpos)
+            while True:
+                # A gzip decompressor which has consumed all of its input
+                # can be copied to restart from this point later.
+                #
+                if self.ftype == 'gz' and upos >= next_access:
+                    self.access[upos] = (cpos, dec.copy())
+                    next_access = upos + ACCESS_SPAN
+                data = f.read(BLOCK_SIZE)
+                if not data:
+                    break
+                cpos += len(data)
+                out, dec = _Decompress(dec, data, self.ftype)
+                yield upos, out
+                upos += len(out)
+
+    def _DecodeGroup(self, k):
+        with open(self.path, 'rb') as f:
+            if self.ftype == 'bz2':
+                return bz2.decompress(_Bz2Stream(f, self.groups[k]))
+            start, end = self.groups[k]
+            f.seek(start)
+            data = f.read(end - start)
+        return _Decompress(_NewDecompressor(self.ftype), data, self.ftype)[0]
+
+    def _GroupBlocks(self, k, upos):
+        pool = ThreadPoolExecutor(max_workers=self.jobs)
+        pending = collections.deque()
+        nxt = k
+        try:
+            while pending or nxt < len(self.groups):
+                while nxt < len(self.groups) and \
+                      len(pending) < max(PREFETCH, self.jobs):
+                    pending.append(pool.submit(self._DecodeGroup, nxt))
+                    nxt += 1
+                self.access[upos] = k
+                out = pending.popleft().result()
+                yield upos, out
+                upos += len(out)
+                k += 1
+        finally:
+            for fut in pending:
+                fut.cancel()
+            pool.shutdown(wait=True)
+
+
+def Open(path, ftype, jobs=None):
+    """
+    Open a gzip ('gz') or bzip2 ('bz2') file for reading.
+
+    @return buffered binary file object
+    """
+
+    return io.BufferedReader(CompressedReader(path, ftype, jobs),
+                             buffer_size=1 << 16)
@@ -31,17 +31,118 @@ from functools import reduce
 import numpy as np
 import argparse
 import logging
+import multiprocessing
+import resource
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import profiling
+import stage_metrics
+
+# Buffer size of the concatenated vector file.
+OUTPUT_BUFFER = 1 << 20
+
+
+def parse_bb_file(bb_path):
+  """
+  Parse one per-thread BBV file into flat arrays.
+
+  Each 'T' line becomes one row, tagged with the most recent
+  '# Slice ending' marker seen in the same file.  The block ids and counts of
+  all rows are stored back to back; row i spans indptr[i]:indptr[i + 1].
+  Every '# Slice ending at' marker, with or without a row, is also kept so
+  the event ordering can be taken from the index.
+  """
+  markers = []
+  kernels = []
+  counts = []
+  indptr = [0]
+  bbs = []
+  icounts = []
+  max_bb = -1
+  kernel = ''
+  kernel_count = 0
+
+  with open(bb_path, 'r') as f:
+    for line in f:
+      if line.startswith('# Slice ending'):
+        fields = line.split()
+        kernel = fields[-3]
+        kernel_count = int(fields[-1])
+        if line.startswith('# Slice ending at '):
+          markers.append((kernel, kernel_count))
+      elif line and line[0] == 'T':
+        for el in line[1:].split():
+          fields = el.split(':')
+          bbs.append(int(fields[1]))
+          icounts.append(int(fields[2]))
+        if line.startswith('T:') and len(bbs) > indptr[-1]:
+          max_bb = max(max_bb, max(bbs[indptr[-1]:]))
+        kernels.append(kernel)
+        counts.append(kernel_count)
+        indptr.append(len(bbs))
+
+  return {
+      'marker_kernels': np.array([m[0] for m in markers], dtype=str),
+      'marker_counts': np.array([m[1] for m in markers], dtype=np.int64),
+      'kernels': np.array(kernels, dtype=str),
+      'counts': np.array(counts, dtype=np.int64),
+      'indptr': np.array(indptr, dtype=np.int64),
+      'bbs': np.array(bbs, dtype=np.int64),
+      'icounts': np.array(icounts, dtype=np.int64),
+      'max_bb': np.int64(max_bb),
+  }
+
+
+def index_bb_file(bb_path, index_path):
+  parsed = parse_bb_file(bb_path)
+  tmp = '%s.tmp.npz' % index_path
+  np.savez(tmp, **parsed)
+  os.replace(tmp, index_path)
+  return index_path
+
+
+def load_bb_index(index_path):
+  with np.load(index_path) as data:
+    return {k: data[k] for k in data.files}
+
+
+def index_bb_files(bb_dir, num_files, index_dir, jobs=None):
+  """
+  Parse T.<n>.bb files from 'bb_dir' in parallel worker processes and save
+  one index file T.<n>.npz per thread in 'index_dir'.
+  """
+  Path(index_dir).mkdir(parents=True, exist_ok=True)
+  bb_paths = []
+  for f in range(num_files):
+    bb_path = Path(bb_dir) / f"T.{f}.bb"
+    if not bb_path.exists():
+      raise FileNotFoundError(f"Basic block file not found: {bb_path}")
+    bb_paths.append(str(bb_path))
+  index_paths = [str(Path(index_dir) / f"T.{f}.npz") for f in range(num_files)]
+
+  # Callers may run this from a worker thread, so avoid forking a process
+  # which has other threads running.
+  #
+  ctx = multiprocessing.get_context('spawn')
+  ru0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+  with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+    done = list(pool.map(index_bb_file, bb_paths, index_paths))
+  stage_metrics.charge_children('index_bb_file', ru0)
+  stage_metrics.add_counts(threads=num_files)
+  return done
+
 
 class BBVConcat:
 
-  def __init__(self, num_threads, cpu_basedir, gpu_basedir, out_basedir, mode):
+  def __init__(self, num_threads, cpu_basedir, gpu_basedir, out_basedir, mode,
+               cpu_index_dir=None):
     self.num_threads = num_threads
     self.cpu_basedir = cpu_basedir
     self.gpu_basedir = gpu_basedir
     self.out_basedir = out_basedir
     self.mode = mode
+    self.cpu_index_dir = cpu_index_dir
     self.max_bb = -1
     self.bb_pieces = {}
     self.marker_list = []
@@ -174,9 +275,51 @@ class BBVConcat:
       if reduce(lambda x, y: x and y, end_of_file):
         break
 
+  def _get_parsed(self):
+    """Load the CPU index files and parse the GPU BBV for XPU mode."""
+    parsed = []
+    for f in range(self.num_threads - 1):
+      index_path = Path(self.cpu_index_dir) / f"T.{f}.npz"
+      if not index_path.exists():
+        raise FileNotFoundError(f"Basic block index not found: {index_path}")
+      parsed.append(load_bb_index(index_path))
+
+    gpu_bbv = Path(self.gpu_basedir) / "global.bbv"
+    if not gpu_bbv.exists():
+      raise FileNotFoundError(f"GPU BBV file not found: {gpu_bbv}")
+    parsed.append(parse_bb_file(gpu_bbv))
+    return parsed
+
+  def _process_parsed(self, parsed):
+    self.log.info("Processing indexed basic block vectors...")
+    self.max_bb = max(int(p['max_bb']) for p in parsed)
+    self.log.info(f'max_bb: {self.max_bb}')
+
+    for f, p in enumerate(parsed):
+      indptr = p['indptr']
+      bbs = p['bbs'] + self.max_bb * f
+      icounts = p['icounts']
+      for i, (kernel, count) in enumerate(zip(p['kernels'], p['counts'])):
+        key = (str(kernel), int(count))
+        if key not in self.bb_pieces:
+          self.bb_pieces[key] = {}
+        lo, hi = indptr[i], indptr[i + 1]
+        self.bb_pieces[key][f] = np.array(
+            [':%d:%d' % x for x in zip(bbs[lo:hi].tolist(),
+                                         icounts[lo:hi].tolist())])
+
   def _get_markers(self):
     self.log.info('Using Thread 0 BBV for event ordering.')
 
+    if self.mode == "xpu" and self.cpu_index_dir:
+      p = load_bb_index(Path(self.cpu_index_dir) / "T.0.npz")
+      self.marker_list = [
+          (str(k), int(c))
+          for k, c in zip(p['marker_kernels'], p['marker_counts'])
+      ]
+      self.log.info(f"Found {len(self.marker_list)} markers")
+      return
+
     global_fn = '%s/T.0.bb' % (self.cpu_basedir)
     if self.mode == "gpu":
       global_fn = '%s/T.0.bb' % (self.gpu_basedir)
@@ -201,18 +344,20 @@ class BBVConcat:
 
     out = []
     if self.mode == "xpu":
-      out.append(open("%s/T.global.hv" % (self.out_basedir,), "w"))
+      out.append(open("%s/T.global.hv" % (self.out_basedir,), "w",
+                      buffering=OUTPUT_BUFFER))
     elif self.mode == "cpu":
-      out.append(open("%s/T.global.cv" % (self.out_basedir,), "w"))
+      out.append(open("%s/T.global.cv" % (self.out_basedir,), "w",
+                      buffering=OUTPUT_BUFFER))
     elif self.mode == "gpu":
-      out.append(open("%s/global.bbv" % (self.out_basedir,), "w"))
+      out.append(open("%s/global.bbv" % (self.out_basedir,), "w",
+                      buffering=OUTPUT_BUFFER))
 
     log = open("%s/concat-vectors.log" % (self.out_basedir,), "w")
 
     ordered_bb_pieces = collections.OrderedDict(sorted(self.bb_pieces.items()))
 
     for i, k in enumerate(self.marker_list):
-      print(k)
       if i > 0:
         out[0].write('M: %s %s\n' %
                      (self.marker_list[i - 1][0], self.marker_list[i - 1][1]))
@@ -241,8 +386,8 @@ class BBVConcat:
 
         if tot_ins == 0:
           err_str = 'Found slice without instructions, icounts: %s' % str(k)
-          print(err_str)
-          log.write(err_str)
+          self.log.warning(err_str)
+          log.write(err_str + '\n')
 
       out[0].write('\n')
 
@@ -256,15 +401,18 @@ class BBVConcat:
 
   def run(self):
     try:
-      bb_files = self._get_bb_files()
-      self._find_max_bb(bb_files)
-      for f in bb_files:
-        f.seek(0)
+      if self.mode == "xpu" and self.cpu_index_dir:
+        self._process_parsed(self._get_parsed())
+      else:
+        bb_files = self._get_bb_files()
+        self._find_max_bb(bb_files)
+        for f in bb_files:
+          f.seek(0)
 
-      self._process_vectors(bb_files)
+        self._process_vectors(bb_files)
 
-      for f in bb_files:
-        f.close()
+        for f in bb_files:
+          f.close()
 
       self._get_markers()
       self._write_output()
@@ -290,14 +438,19 @@ def get_args():
   parser.add_argument("-c", "--cpudir", type=str, help="CPU profile directory")
   parser.add_argument("-g", "--gpudir", type=str, help="GPU profile directory")
   parser.add_argument("-o", "--outdir", type=str, help="Output directory")
+  profiling.add_argument(parser)
   args = parser.parse_args()
   return args
 
 
-def main(num_threads, cpu_basedir, gpu_basedir, out_basedir, mode):
+def main(num_threads, cpu_basedir, gpu_basedir, out_basedir, mode,
+         cpu_index_dir=None):
   bbv_concat = BBVConcat(num_threads, cpu_basedir, gpu_basedir, out_basedir,
-                         mode)
+                         mode, cpu_index_dir)
   bbv_concat.run()
+  stage_metrics.add_counts(slices=len(bbv_concat.marker_list),
+                           max_bb=bbv_concat.max_bb,
+                           threads=num_threads)
 
 
 if __name__ == '__main__':
@@ -337,4 +490,5 @@ if __name__ == '__main__':
     print("Require either CPU or GPU profile directories to continue.")
     exit(1)
 
+  profiling.enable('concat_xpu_vectors', args.profile, out_basedir)
   main(num_threads, cpu_basedir, gpu_basedir, out_basedir, mode)
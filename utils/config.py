@@ -30,16 +30,7 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #END_LEGAL
-import configparser
-import optparse
 import os
-import pickle
-import platform
-import random
-import shutil
-import subprocess
-import tempfile
-import types
 # Local modules
 #
 import msg
@@ -510,6 +501,9 @@ class GlobalVar(object):
         @return pickle file name
         """
 
+        import pickle
+        import random
+
         global global_file_list
 
         # Add a random number to the pickle file name.  If the file already
@@ -596,6 +590,8 @@ class GlobalVar(object):
         @return no return
         """
 
+        import pickle
+
         global add_program_wp
         global archsim_config_dir
         global combine
@@ -795,6 +791,8 @@ class GlobalVar(object):
             options.slice_size = slice_size
         if hasattr(options, 'verbose') and options.verbose == False and verbose != False:
             options.verbose = verbose
+            if msg.level != msg.QUIET:
+                msg.SetLevel(msg.VERBOSE)
         if hasattr(options, 'warmup_length') and options.warmup_length == 0 and warmup_length > 0:
             options.warmup_length = warmup_length
 
@@ -1028,6 +1026,7 @@ class GlobalVar(object):
                 # changed to include deleting directories.
                 #
                 rm_cmd = 'del /q /s '
+            import subprocess
             for glob_file in global_file_list:
                 if os.path.isfile(glob_file.name):
                     cmd = rm_cmd + glob_file.name
@@ -1050,10 +1049,17 @@ class ConfigClass(object):
     """
 
     # File parser object used to parse all configuration files for a PinPlay tracing
-    # instance.
+    # instance.  It's created the first time it's used, as most scripts never
+    # read a configuration file.
     #
-    import configparser
-    parser = configparser.ConfigParser()
+    _parser = None
+
+    @property
+    def parser(self):
+        if ConfigClass._parser is None:
+            import configparser
+            ConfigClass._parser = configparser.ConfigParser()
+        return ConfigClass._parser
 
     def GetVarStr(self, section, name, parser):
         """
@@ -1372,6 +1378,7 @@ class ConfigClass(object):
         # import pdb ; pdb.set_trace()
         params = {}
         if os.path.isfile(cfg_file):
+            import configparser
             try:
                 parser.read(cfg_file)
             except configparser.MissingSectionHeaderError:
@@ -1543,6 +1550,7 @@ class ConfigClass(object):
 
         # Use the same object that optparse returns for 'options'
         #
+        import optparse
         values = optparse.Values()
 
         # Required parameters
@@ -1654,6 +1662,7 @@ class ConfigClass(object):
 
             # Get parameters for binary from all config files
             #
+            import configparser
             params = {}
             parser = configparser.ConfigParser()
             for c_file in cfg_files:
@@ -1918,6 +1927,7 @@ class ConfigClass(object):
                 # config file.  
                 #
                 #import pdb ; pdb.set_trace()
+                import tempfile
                 tmp_file = tempfile.mkstemp()
                 tmp_fp = os.fdopen(tmp_file[0], 'w')
                 tmp_name = tmp_file[1]
@@ -1972,6 +1982,7 @@ class ConfigClass(object):
                     os.remove(backup_name)
                 if os.path.isfile(config_file):
                     os.rename(config_file, backup_name)
+                import shutil
                 shutil.copy(tmp_name, config_file)
                 os.remove(tmp_name)
         else:
@@ -2001,6 +2012,7 @@ class ConfigClass(object):
         @return '' if the parameter is not found
         """
 
+        import configparser
         parser = configparser.ConfigParser()
         config_file = self.GetInstanceFileName(config_ext)
 
@@ -2036,6 +2048,8 @@ class ConfigClass(object):
 
 # import pdb ; pdb.set_trace()
 Config = ConfigClass()
-params = Config.GetCfgFile(default_config_file, Config.parser)
+params = {}
+if os.path.isfile(default_config_file):
+    params = Config.GetCfgFile(default_config_file, Config.parser)
 Config.SetGlobalAttr(params)
 
@@ -30,7 +30,8 @@ def usage(rc=0):
   \t %s
   \t -h | --help
   \t -s | --sim-dir=<path/to/sim-results>
-  \t -c | --csv=<path/to/xpuregions.csv>''' % sys.argv[0])
+  \t -c | --csv=<path/to/xpuregions.csv>
+  \t -v | --verbose  (print every region length)''' % sys.argv[0])
   exit(rc)
 
 
@@ -57,43 +58,63 @@ def read_pb_csv(data):
   return slice_multiplier
 
 
-def get_all_region_ticks(sim_dir):
-  kernel_len_ticks = []
-  kernel_ticks = []
-  region_end_ticks = []
+TICKS_CHUNK = 1 << 22
+
+
+def read_tick_line(_f, chunk=TICKS_CHUNK):
+  """
+  Parse a 'start, end, start, end, ..., exit' tick line of gpu_stats.txt,
+  reading it 'chunk' characters at a time; the line can be hundreds of MB.
+
+  @return (int64 array of kernel end ticks, exit tick)
+  """
+  import numpy as np
+  ends = []
+  nvals = 0
+  exit_tick = 0
+  carry = ''
+  while True:
+    piece = _f.readline(chunk)
+    eol = piece == '' or piece.endswith('\n')
+    text = carry + piece
+    carry = ''
+    if not eol:
+      # Keep a token cut by the chunk boundary for the next round.
+      cut = text.rfind(',')
+      text, carry = text[:max(cut, 0)], text[cut + 1:]
+    if text.strip():
+      vals = np.fromstring(text, dtype=np.int64, sep=',')
+      if len(vals):
+        # End ticks are at the odd positions of the whole line.
+        ends.append(vals[(nvals + 1) % 2::2])
+        nvals += len(vals)
+        exit_tick = int(vals[-1])
+    if eol:
+      break
+  if not ends:
+    return np.zeros(0, dtype=np.int64), exit_tick
+  return np.concatenate(ends), exit_tick
+
+
+def get_all_region_ticks(sim_dir, verbose=False):
+  import numpy as np
+  end_ticks = np.zeros(0, dtype=np.int64)
   exit_tick = 0
   gpu_res_file = glob.glob(os.path.join(sim_dir + '/gpu_stats.txt'))[0]
-  num_kernels = 0
-  read_flag = 0
   with open(gpu_res_file) as _f:
-    for line in _f:
+    while True:
+      line = _f.readline(TICKS_CHUNK)
+      if not line:
+        break
       if 'start' in line and 'end' in line and 'exit' in line:
-        if 'shader' in line:
-          read_flag = 0
-          continue
-        else:
-          read_flag = 1
-          continue
-      if read_flag:
-        ticks = line.split(', ')
-        kernel_len_ticks = [(int(ticks[i + 1]) - int(ticks[i]))
-                            for i in range(0,
-                                           len(ticks) - 1, 2)]
-        exit_tick = int(ticks[len(ticks) - 1])
-        kernel_ticks = [(int(ticks[i]), int(ticks[i + 1]))
-                        for i in range(0,
-                                       len(ticks) - 1, 2)]
-        read_flag = 0
-
-  end_ticks = [kernel_ticks[i][1] for i in range(0, len(kernel_ticks))]
-  region_end_ticks.extend([0])
-  region_end_ticks.extend(end_ticks)
-  region_end_ticks.extend([exit_tick])
-  region_len_ticks = [(int(region_end_ticks[i + 1]) - int(region_end_ticks[i]))
-                      for i in range(0,
-                                     len(region_end_ticks) - 1)]
-  print(region_len_ticks)
-  print(len(region_len_ticks))
+        if 'shader' not in line:
+          end_ticks, exit_tick = read_tick_line(_f)
+
+  region_end_ticks = np.concatenate(([0], end_ticks, [exit_tick]))
+  region_len_ticks = np.diff(region_end_ticks)
+  if verbose:
+    print(region_len_ticks.tolist())
+    print(len(region_len_ticks))
   return region_len_ticks
 
 
@@ -116,10 +137,11 @@ def extrapolate(scaling_factor, region_ticks):
 if __name__ == "__main__":
   data_dir = ''
   sim_dir = ''
+  verbose = False
 
   try:
-    opts, args = getopt.getopt(sys.argv[1:], 'hc:s:',
-                               ['help', 'csv=', 'sim-dir='])
+    opts, args = getopt.getopt(sys.argv[1:], 'hc:s:v',
+                               ['help', 'csv=', 'sim-dir=', 'verbose'])
   except getopt.GetoptError as e:
     print(e)
     usage(1)
@@ -130,6 +152,8 @@ if __name__ == "__main__":
       csv_f = a
     if o == '-s' or o == '--sim-dir':
       sim_dir = a
+    if o == '-v' or o == '--verbose':
+      verbose = True
 
   if not (os.path.exists(sim_dir) and os.listdir(sim_dir)):
     print('Error: Some directories do not exist or are empty.')
@@ -138,11 +162,11 @@ if __name__ == "__main__":
   csv_f = os.path.abspath(csv_f)
   scaling_factor = read_pb_csv(csv_f)
   sliceids = list(scaling_factor.keys())
-  region_ticks = get_all_region_ticks(sim_dir)
+  region_ticks = get_all_region_ticks(sim_dir, verbose)
   proj_ticks = extrapolate(scaling_factor, region_ticks)
   final_tick = get_final_tick(sim_dir)
   pred_err = round(((final_tick - proj_ticks) / final_tick) * 100, 2)
-  par_speedup = round(final_tick / max(region_ticks), 2)
-  print(max(region_ticks))
+  par_speedup = round(final_tick / int(region_ticks.max()), 2)
+  print(int(region_ticks.max()))
   print('wp_ticks,region_ticks,err%')
   print('%s,%s,%s' % (final_tick, proj_ticks, pred_err))
@@ -22,7 +22,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 # END_LEGAL
-import os, sys, getopt, glob
+import os, re, sys, getopt, glob
+from concurrent.futures import ThreadPoolExecutor
 
 
 def usage(rc=0):
@@ -31,7 +32,11 @@ def usage(rc=0):
   \t -h | --help
   \t -w | --wp-dir=<path/to/whole-program-stats>
   \t -r | --region-dir=<path/to/regions-stats>
-  \t -c | --csv=<path/to/xpuregions.csv>''' % sys.argv[0])
+  \t -c | --csv=<path/to/xpuregions.csv>
+  \t -j | --jobs=<number of perf files parsed in parallel>
+  \t -b | --bootstrap=<resamples>  (confidence intervals over the repeats)
+  \t      --ci=<confidence level in %%, default 95>
+  \t      --seed=<random seed for the bootstrap>''' % sys.argv[0])
   exit(rc)
 
 
@@ -55,44 +60,89 @@ def read_pb_csv(data):
   return region_multiplier
 
 
-def get_wp_rdtsc(wp_dir):
-  res_file = glob.glob(os.path.join(wp_dir + '/perf.wp.txt*'))
-  wp_moving_ave = 0
-  ctr = 0
-  for wp_res_file in res_file:
-    start_tsc = 0
-    end_tsc = 0
-    ctr += 1
-    with open(wp_res_file) as _f:
-      for line in _f:
-        if ('ROI start' in line or 'GPU_Init' in line) and 'TSC' in line:
-          start_tsc = int(line.split()[-1])
-        elif ('ROI end' in line or 'GPU_Fini' in line) and 'TSC' in line:
-          end_tsc = int(line.split()[-1])
-    wp_moving_ave = (wp_moving_ave * (ctr - 1) + (end_tsc - start_tsc)) / ctr
-  return wp_moving_ave
-
-
-def get_region_rdtsc(region_dir, regionids):
-  region_rdtsc_ave = {}
-  for _r in regionids:
-    res_file = glob.glob(os.path.join(region_dir, 'perf.r%s.txt*' % str(_r)))
-    region_moving_ave = 0
-    ctr = 0
-    for region_res_file in res_file:
-      warmup_end = 0
-      sim_end = 0
-      ctr += 1
-      with open(region_res_file) as _f:
-        for line in _f:
-          if 'Warmup end' in line and 'TSC' in line:
-            warmup_end = int(line.split()[-1])
-          elif 'Simulation end' in line and 'TSC' in line:
-            sim_end = int(line.split()[-1])
-      region_moving_ave = (region_moving_ave * (ctr - 1) +
-                           (sim_end - warmup_end)) / ctr
-    region_rdtsc_ave[_r] = region_moving_ave
-  return region_rdtsc_ave
+PERF_FILE_RE = re.compile(r'^perf\.(wp|r(\d+))\.txt(.*)$')
+
+# Fewest timer runs suggested for a region, to have a standard deviation.
+MIN_REPEATS = 2
+
+
+def index_perf_files(res_dir):
+  """
+  Scan 'res_dir' once for perf.r<id>.txt* and perf.wp.txt* files.
+
+  @return dict {region id (int) or 'wp': [(repeat suffix, path), ...]}
+  """
+  index = {}
+  with os.scandir(res_dir) as it:
+    for entry in it:
+      m = PERF_FILE_RE.match(entry.name)
+      if not m or not entry.is_file():
+        continue
+      region = 'wp' if m.group(1) == 'wp' else int(m.group(2))
+      index.setdefault(region, []).append((m.group(3), entry.path))
+  return index
+
+
+def parse_perf_file(path, wp=False):
+  """
+  Get the begin and end TSC of one timer run: 'Warmup end' and 'Simulation
+  end' for a region, 'ROI start'/'GPU_Init' and 'ROI end'/'GPU_Fini' for the
+  whole program.  Missing markers read as 0.
+  """
+  if wp:
+    begin_keys, end_keys = ('ROI start', 'GPU_Init'), ('ROI end', 'GPU_Fini')
+  else:
+    begin_keys, end_keys = ('Warmup end',), ('Simulation end',)
+  begin = 0
+  end = 0
+  with open(path) as _f:
+    for line in _f:
+      if 'TSC' not in line:
+        continue
+      if any(k in line for k in begin_keys):
+        begin = int(line.split()[-1])
+      elif any(k in line for k in end_keys):
+        end = int(line.split()[-1])
+  return begin, end
+
+
+def read_perf_table(res_dir, regions, jobs=1):
+  """
+  Parse the perf files of 'regions' (region ids and/or 'wp') found in
+  'res_dir', several files at a time.
+
+  @return list of (region, repeat, warmup_end, sim_end) tuples; for 'wp'
+          rows the last two columns hold the ROI start and end
+  """
+  index = index_perf_files(res_dir)
+  files = [(r, rep, path) for r in regions for rep, path in index.get(r, [])]
+  # The files are small and mostly waiting on the filesystem, so threads
+  # are enough to overlap them.
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+    tsc = pool.map(lambda f: parse_perf_file(f[2], f[0] == 'wp'), files)
+    return [(r, rep) + t for (r, rep, _), t in zip(files, tsc)]
+
+
+def mean_rdtsc(table):
+  """
+  @return dict {region: mean (sim_end - warmup_end) over its repeats}
+  """
+  ave = {}
+  ctr = {}
+  for region, _, warmup_end, sim_end in table:
+    ctr[region] = ctr.get(region, 0) + 1
+    ave[region] = (ave.get(region, 0) * (ctr[region] - 1) +
+                   (sim_end - warmup_end)) / ctr[region]
+  return ave
+
+
+def get_wp_rdtsc(wp_dir, jobs=1):
+  return mean_rdtsc(read_perf_table(wp_dir, ['wp'], jobs)).get('wp', 0)
+
+
+def get_region_rdtsc(region_dir, regionids, jobs=1):
+  region_ave = mean_rdtsc(read_perf_table(region_dir, regionids, jobs))
+  return {_r: region_ave.get(_r, 0) for _r in regionids}
 
 
 def extrapolate(scaling_factor, region_rdtsc):
@@ -102,14 +152,160 @@ def extrapolate(scaling_factor, region_rdtsc):
   return proj_rdtsc
 
 
+def repeat_arrays(table):
+  """
+  @return dict {region: NumPy array of (sim_end - warmup_end) per repeat}
+  """
+  import numpy as np
+  samples = {}
+  for region, _, warmup_end, sim_end in table:
+    samples.setdefault(region, []).append(sim_end - warmup_end)
+  return {r: np.array(v, dtype=np.float64) for r, v in samples.items()}
+
+
+def resample_means(groups, resamples, rng, max_elems=1 << 22):
+  """
+  Bootstrap the mean of every sample array in 'groups'.
+
+  Arrays of the same length are stacked and resampled together, so each
+  block of resamples is a single draw of indices.
+
+  @return dict {key: array of 'resamples' bootstrap means}
+  """
+  import numpy as np
+  by_len = {}
+  for key, a in groups.items():
+    by_len.setdefault(len(a), []).append(key)
+
+  means = {}
+  for n, keys in by_len.items():
+    data = np.stack([groups[k] for k in keys])
+    out = np.empty((resamples, len(keys)))
+    block = max(1, max_elems // (len(keys) * n))
+    for start in range(0, resamples, block):
+      stop = min(resamples, start + block)
+      idx = rng.integers(0, n, size=(stop - start, len(keys), n))
+      out[start:stop] = np.take_along_axis(data[None, :, :], idx,
+                                           axis=2).mean(axis=2)
+    for i, k in enumerate(keys):
+      means[k] = out[:, i]
+  return means
+
+
+def apportion(total, weights, minimum):
+  """
+  Split 'total' runs between regions in proportion to 'weights', after
+  giving each region 'minimum' runs, with the largest remainder method.
+  The total is kept unless it is below the minimum of every region.
+
+  @return list of runs per region
+  """
+  runs = [minimum] * len(weights)
+  left = total - minimum * len(weights)
+  weight_sum = sum(weights)
+  if left <= 0 or not weight_sum:
+    return runs
+  quotas = [left * w / weight_sum for w in weights]
+  for i, q in enumerate(quotas):
+    runs[i] += int(q)
+  left -= sum(int(q) for q in quotas)
+  by_remainder = sorted(range(len(weights)),
+                        key=lambda i: int(quotas[i]) - quotas[i])
+  for i in by_remainder[:left]:
+    runs[i] += 1
+  return runs
+
+
+def bootstrap(scaling_factor, region_samples, wp_samples, resamples=10000,
+              ci=95.0, seed=None):
+  """
+  Bootstrap confidence intervals of the projected and whole-program TSC and
+  of the projection error, resampling the repeats of every region and of
+  the whole program independently.
+
+  Regions without any timer run contribute 0, as in extrapolate().
+
+  @return dict of (low, high) intervals for 'wp', 'proj' and 'err', and
+          per-region rows with the variance each contributes to the
+          projection
+  """
+  import numpy as np
+  rng = np.random.default_rng(seed)
+  regions = [r for r in scaling_factor if len(region_samples.get(r, [])) > 0]
+  groups = {r: region_samples[r] for r in regions}
+  groups['wp'] = wp_samples
+  means = resample_means(groups, resamples, rng)
+
+  proj = np.zeros(resamples)
+  for r in regions:
+    proj += scaling_factor[r] * means[r]
+  wp = means['wp']
+  err = (wp - proj) / wp * 100
+
+  tail = (100.0 - ci) / 2
+  pct = lambda a: tuple(np.percentile(a, [tail, 100.0 - tail]))
+
+  # Variance of the projected mean from each region: m^2 * s^2 / n.  The
+  # repeats that minimise the total variance for the same number of timer
+  # runs are proportional to m * s (Neyman allocation), with MIN_REPEATS
+  # for every region.
+  rows = []
+  total_runs = sum(len(groups[r]) for r in regions)
+  for r in regions:
+    a = groups[r]
+    sd = a.std(ddof=1) if len(a) > 1 else 0.0
+    rows.append({
+        'region': r,
+        'multiplier': scaling_factor[r],
+        'repeats': len(a),
+        'mean': a.mean(),
+        'stdev': sd,
+        'variance': scaling_factor[r]**2 * sd**2 / len(a),
+        'weight': scaling_factor[r] * sd,
+    })
+  var_sum = sum(row['variance'] for row in rows)
+  weight_sum = sum(row['weight'] for row in rows)
+  if weight_sum:
+    suggested = apportion(total_runs, [row['weight'] for row in rows],
+                          MIN_REPEATS)
+  else:
+    suggested = [row['repeats'] for row in rows]
+  for row, n in zip(rows, suggested):
+    row['var_share'] = 100.0 * row['variance'] / var_sum if var_sum else 0.0
+    row['suggested_repeats'] = n
+
+  return {'wp': pct(wp), 'proj': pct(proj), 'err': pct(err), 'regions': rows}
+
+
+def print_bootstrap(res, wp_rdtsc, proj_rdtsc, pred_err, ci):
+  print()
+  print('stat,estimate,ci%g_low,ci%g_high' % (ci, ci))
+  print('wp_rdtsc,%s,%s,%s' % ((wp_rdtsc,) + res['wp']))
+  print('region_rdtsc,%s,%s,%s' % ((proj_rdtsc,) + res['proj']))
+  print('err%%,%s,%.2f,%.2f' % ((pred_err,) + res['err']))
+  print()
+  print('region,multiplier,repeats,mean_rdtsc,stdev,var_share%,'
+        'suggested_repeats')
+  for row in sorted(res['regions'], key=lambda x: -x['variance']):
+    print('%s,%s,%d,%s,%s,%.2f,%d' % (row['region'], row['multiplier'],
+                                      row['repeats'], row['mean'],
+                                      row['stdev'], row['var_share'],
+                                      row['suggested_repeats']))
+
+
 if __name__ == "__main__":
   region_dir = ''
   data_dir = ''
   wp_dir = ''
+  jobs = os.cpu_count() or 1
+  resamples = 0
+  ci = 95.0
+  seed = None
 
   try:
-    opts, args = getopt.getopt(sys.argv[1:], 'hr:c:w:',
-                               ['help', 'region-dir=', 'csv=', 'wp-dir='])
+    opts, args = getopt.getopt(sys.argv[1:], 'hr:c:w:j:b:',
+                               ['help', 'region-dir=', 'csv=', 'wp-dir=',
+                                'jobs=', 'bootstrap=', 'ci=', 'seed='])
   except getopt.GetoptError as e:
     print(e)
     usage(1)
@@ -122,6 +318,14 @@ if __name__ == "__main__":
       csv_f = a
     if o == '-w' or o == '--wp-dir':
       wp_dir = a
+    if o == '-j' or o == '--jobs':
+      jobs = int(a)
+    if o == '-b' or o == '--bootstrap':
+      resamples = int(a)
+    if o == '--ci':
+      ci = float(a)
+    if o == '--seed':
+      seed = int(a)
 
   if not (os.path.exists(region_dir) and os.path.exists(csv_f) and
           os.path.exists(wp_dir) and os.listdir(region_dir) and
@@ -133,9 +337,22 @@ if __name__ == "__main__":
   wp_dir = os.path.abspath(wp_dir)
   scaling_factor = read_pb_csv(csv_f)
   regionids = list(scaling_factor.keys())
-  wp_rdtsc = get_wp_rdtsc(wp_dir)
-  region_rdtsc = get_region_rdtsc(region_dir, regionids)
+  wp_table = read_perf_table(wp_dir, ['wp'], jobs)
+  region_table = read_perf_table(region_dir, regionids, jobs)
+  wp_rdtsc = mean_rdtsc(wp_table).get('wp', 0)
+  region_ave = mean_rdtsc(region_table)
+  region_rdtsc = {_r: region_ave.get(_r, 0) for _r in regionids}
   proj_rdtsc = extrapolate(scaling_factor, region_rdtsc)
   pred_err = round(((wp_rdtsc - proj_rdtsc) / wp_rdtsc) * 100, 2)
   print('wp_rdtsc,region_rdtsc,err%')
   print('%s,%s,%s%%' % (wp_rdtsc, proj_rdtsc, pred_err))
+  if resamples > 0:
+    if not wp_table:
+      print('Error: No whole-program runs to bootstrap.')
+      sys.exit(1)
+    if not 0 < ci < 100:
+      print('Error: --ci must be between 0 and 100.')
+      sys.exit(1)
+    res = bootstrap(scaling_factor, repeat_arrays(region_table),
+                    repeat_arrays(wp_table)['wp'], resamples, ci, seed)
+    print_bootstrap(res, wp_rdtsc, proj_rdtsc, pred_err, ci)
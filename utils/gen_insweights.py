@@ -5,6 +5,10 @@ import argparse
 import logging
 from pathlib import Path
 
+import bbv_matrix
+import profiling
+import stage_metrics
+
 
 def get_args():
   parser = argparse.ArgumentParser(
@@ -24,18 +28,33 @@ def get_args():
                       "--verbose",
                       action='store_true',
                       help="Enable verbose output")
+  profiling.add_argument(parser)
   args = parser.parse_args()
   return args
 
 
 def read_slice_counts(globalbbv):
-  allrcounts = []
-
   if not os.path.isfile(globalbbv):
     raise FileNotFoundError(f"Global BBV file not found: {globalbbv}")
 
   logging.info("Reading slice instruction counts...")
 
+  # Slices whose 'T' line is empty have no count, as in the text.
+  matrix = bbv_matrix.open_matrix(globalbbv)
+  if matrix is not None:
+    allrcounts = matrix.row_sums()[matrix.row_lengths() > 0].tolist()
+  else:
+    allrcounts = _read_text_counts(globalbbv)
+
+  if not allrcounts:
+    raise ValueError("No instruction counts found in BBV file")
+
+  logging.info(f"Found {len(allrcounts)} slices")
+  return allrcounts
+
+
+def _read_text_counts(globalbbv):
+  allrcounts = []
   with open(globalbbv, 'r') as f:
     for line in f:
       if line.startswith('T:'):
@@ -45,11 +64,6 @@ def read_slice_counts(globalbbv):
           if ':' in el:
             rcount += int(el.split(':')[-1])
         allrcounts.append(rcount)
-
-  if not allrcounts:
-    raise ValueError("No instruction counts found in BBV file")
-
-  logging.info(f"Found {len(allrcounts)} slices")
   return allrcounts
 
 
@@ -172,6 +186,7 @@ def main(datadir, globalbbv='T.global.hv'):
       globalbbv = os.path.join(datadir, globalbbv)
 
     allrcounts = read_slice_counts(globalbbv)
+    stage_metrics.add_counts(slices=len(allrcounts))
     slice_weights, sumtot = calc_slice_weights(allrcounts)
     region_slice_map = read_region_map(datadir)
     region_counts = count_regions(datadir)
@@ -209,6 +224,7 @@ if __name__ == '__main__':
       print("Error: --data-dir is required")
       exit(1)
 
+    profiling.enable('gen_insweights', args.profile, datadir)
     main(datadir, globalbbv)
 
   except Exception as e:
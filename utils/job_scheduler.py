@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+# Run background jobs with per-job resource hints, priorities and retries.
+#
+#
+
+import heapq
+import os
+import selectors
+import subprocess
+import time
+
+# Local modules
+#
+import msg
+
+"""
+@package job_scheduler
+
+Scheduler for the jobs util.RunCmd() runs in the background.
+"""
+
+
+def MemAvailableMB():
+    """
+    Get the memory available for new processes.
+
+    @return MB available, or None if unknown
+    """
+
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Job(object):
+    """
+    One command to run in the background.
+
+    'cores' and 'mem_mb' are what the job is expected to use; they only
+    decide when the job is admitted.  Jobs with a higher 'priority' start
+    first.  A job that exits with a non-zero code is run again up to
+    'retries' times.
+    """
+
+    def __init__(self, cmd, name='', cores=1, mem_mb=0, priority=0,
+                 retries=0, stdout=None, stderr=None):
+        self.cmd = cmd
+        self.name = name
+        self.cores = max(1, cores)
+        self.mem_mb = max(0, mem_mb)
+        self.priority = priority
+        self.retries = retries
+        self.stdout = stdout
+        self.stderr = stderr
+        self.attempts = 0
+        self.proc = None
+        self.pidfd = None
+        self.start = 0.0
+
+
+class JobResult(object):
+    """
+    How a job ended: its exit code after the last attempt, number of
+    attempts, wall time of the last attempt and its resource usage.  The
+    exit code is None for a job dropped after another one failed.
+    """
+
+    def __init__(self, job, returncode, wall, rusage):
+        self.name = job.name
+        self.cmd = job.cmd
+        self.pid = job.proc.pid if job.proc else None
+        self.returncode = returncode
+        self.attempts = job.attempts
+        self.wall = wall
+        self.utime = rusage.ru_utime if rusage else 0.0
+        self.stime = rusage.ru_stime if rusage else 0.0
+        self.maxrss_kb = rusage.ru_maxrss if rusage else 0
+
+    def __repr__(self):
+        return 'JobResult(%r, rc=%s, attempts=%d, wall=%.2f)' % (
+            self.name, self.returncode, self.attempts, self.wall)
+
+
+class Scheduler(object):
+    """
+    Start queued jobs as soon as cores and memory allow, highest priority
+    first, and wait for them without polling.
+
+    A job is admitted when the cores of the running jobs plus its own fit
+    in 'max_cores' and its memory hint fits both in what the running jobs
+    have not claimed of 'mem_limit_mb' and in the memory the system has
+    available.  A job that does not fit on its own is still run when
+    nothing else is running.
+
+    With 'fail_fast', once a job fails the queued jobs are dropped, and so
+    are the jobs submitted before the next Wait().  Each dropped
+    job is listed and has a JobResult without an exit code.
+    """
+
+    def __init__(self, max_cores, mem_limit_mb=None, fail_fast=True,
+                 verbose=False):
+        self.max_cores = max(1, max_cores)
+        self.mem_limit_mb = mem_limit_mb
+        self.fail_fast = fail_fast
+        self.verbose = verbose
+        self.failed = False
+        self.queue = []
+        self.running = {}
+        self.results = []
+        self.seq = 0
+        self.selector = None
+        if hasattr(os, 'pidfd_open') and hasattr(os, 'wait4'):
+            self.selector = selectors.DefaultSelector()
+
+    def NumJobs(self):
+        """@return number of jobs queued or running"""
+
+        return len(self.queue) + len(self.running)
+
+    def Submit(self, job):
+        """
+        Queue a job and start every queued job that can run now, after
+        handling the jobs that have exited in the meantime.
+
+        @return list of JobResult of the jobs that finished
+        """
+
+        results = self.Poll()
+        heapq.heappush(self.queue, (-job.priority, self.seq, job))
+        self.seq += 1
+        if self.failed:
+            self._Drop()
+        else:
+            self.Admit()
+        return results
+
+    def _Fits(self, job):
+        if not self.running:
+            return True
+        cores = sum(j.cores for j in self.running.values())
+        if cores + job.cores > self.max_cores:
+            return False
+        if job.mem_mb:
+            claimed = sum(j.mem_mb for j in self.running.values())
+            if self.mem_limit_mb and claimed + job.mem_mb > self.mem_limit_mb:
+                return False
+            avail = MemAvailableMB()
+            if avail is not None and job.mem_mb > avail:
+                return False
+        return True
+
+    def Admit(self):
+        """
+        Start the queued jobs that fit, in priority order.  Lower priority
+        jobs that fit may start ahead of a larger one that does not.
+        """
+
+        waiting = []
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            if self._Fits(entry[2]):
+                self._Start(entry[2])
+            else:
+                waiting.append(entry)
+        for entry in waiting:
+            heapq.heappush(self.queue, entry)
+
+    def _Drop(self):
+        """Drop the queued jobs after a failure, in priority order."""
+
+        while self.queue:
+            job = heapq.heappop(self.queue)[2]
+            msg.PrintMsgPlus('Not run after a failed job: ' +
+                             (job.name or str(job.cmd)))
+            self.results.append(JobResult(job, None, 0.0, None))
+
+    def _Start(self, job):
+        job.attempts += 1
+        job.start = time.time()
+        msg.Flush()
+        job.proc = subprocess.Popen(job.cmd, stdout=job.stdout,
+                                    stderr=job.stderr, shell=False)
+        if self.selector:
+            try:
+                fd = os.pidfd_open(job.proc.pid)
+            except OSError:
+                fd = None
+            if fd is not None:
+                self.selector.register(fd, selectors.EVENT_READ, job)
+            job.pidfd = fd
+        self.running[job.proc.pid] = job
+        if self.verbose:
+            msg.PrintMsg('Job PID: %d' % job.proc.pid)
+
+    def _Reap(self):
+        """
+        Block until a running job exits.
+
+        @return (job, exit code, rusage)
+        """
+
+        if self.selector and self.selector.get_map():
+            while True:
+                for key, _ in self.selector.select():
+                    job = key.data
+                    pid, status, ru = os.wait4(job.proc.pid, os.WNOHANG)
+                    if pid == 0:
+                        continue
+                    job.proc.returncode = os.waitstatus_to_exitcode(status)
+                    return job, job.proc.returncode, ru
+
+        if hasattr(os, 'wait4'):
+            while True:
+                pid, status, ru = os.wait4(-1, 0)
+                if pid in self.running:
+                    job = self.running[pid]
+                    job.proc.returncode = os.waitstatus_to_exitcode(status)
+                    return job, job.proc.returncode, ru
+                msg.PrintMsgPlus(
+                    'WARNING: job_scheduler unable to find running PID: %d' % pid)
+
+        # No wait4() on this platform: wait for the jobs in turn.
+        job = next(iter(self.running.values()))
+        return job, job.proc.wait(), None
+
+    def _Done(self, job, rc, ru):
+        """
+        Handle the exit of a job: queue it again if it failed and has
+        retries left.
+
+        @return JobResult of the job, or None if it was queued again
+        """
+
+        del self.running[job.proc.pid]
+        if job.pidfd is not None and self.selector:
+            self.selector.unregister(job.pidfd)
+            os.close(job.pidfd)
+            job.pidfd = None
+        wall = time.time() - job.start
+        if rc != 0 and job.attempts <= job.retries:
+            msg.PrintMsgPlus('Retrying (%d of %d): %s' % (
+                job.attempts, job.retries, job.name or job.cmd))
+            heapq.heappush(self.queue, (-job.priority, self.seq, job))
+            self.seq += 1
+            self.Admit()
+            return None
+        result = JobResult(job, rc, wall, ru)
+        self.results.append(result)
+        if job.name:
+            msg.PrintMsgPlus('Finished processing: ' + job.name)
+        if self.verbose:
+            msg.PrintMsg('Concurrent job finished, PID: %d' % result.pid)
+        if rc != 0 and self.fail_fast:
+            # Nothing more is started; jobs already running are left
+            # to a later Wait().
+            self.failed = True
+            self._Drop()
+        else:
+            self.Admit()
+        return result
+
+    def Poll(self):
+        """
+        Handle the jobs that have already exited, without blocking.
+
+        @return list of JobResult of the jobs that finished
+        """
+
+        results = []
+        if not hasattr(os, 'wait4'):
+            return results
+        for job in list(self.running.values()):
+            pid, status, ru = os.wait4(job.proc.pid, os.WNOHANG)
+            if pid == 0:
+                continue
+            job.proc.returncode = os.waitstatus_to_exitcode(status)
+            result = self._Done(job, job.proc.returncode, ru)
+            if result:
+                results.append(result)
+        return results
+
+    def WaitOne(self):
+        """
+        Wait for one job to finish, or to fail after all its retries.
+
+        @return JobResult of the job
+        """
+
+        while True:
+            result = self._Done(*self._Reap())
+            if result:
+                return result
+
+    def Wait(self, wait_all=True):
+        """
+        Wait for one job, or for every queued and running job.
+
+        @return exit code of the first job that failed, 0 if none did
+        """
+
+        result = 0
+        while self.running:
+            job = self.WaitOne()
+            if job.returncode != 0:
+                result = job.returncode
+                if self.fail_fast:
+                    msg.PrintMsg(
+                        'WaitJobs() unexpected error occurred: non-zero exit code')
+                    break
+            if not wait_all:
+                break
+        self.failed = False
+        return result
@@ -36,31 +36,102 @@
 #
 
 import os
-import string
 import sys
-import subprocess
+
+"""
+Diagnostics are buffered and flushed at phase boundaries (PrintMsgDate(),
+PrintMsgPlus(), errors and before starting a child process), not once per
+line.  Data outputs (region CSV files, vector files) are written through
+the file objects returned by OpenOutput().
+"""
+
+# Diagnostic levels.  Messages are printed when the level is at least the
+# one of the message; errors are always printed.  --quiet and --verbose
+# (cmd_options.quiet() and verbose()) set the level.
+#
+QUIET = 0
+NORMAL = 1
+VERBOSE = 2
+
+level = NORMAL
+
+# Buffer size of data outputs.
+#
+DATA_BUFFER = 1 << 20
+
+
+def SetLevel(new_level):
+    """Set the level of the diagnostics printed."""
+
+    global level
+    level = new_level
+
+
+def Flush():
+    """
+    Write out the buffered diagnostics.  Call it before anything else writes
+    to the same stdout, e.g. a child process.
+
+    """
+
+    sys.stdout.flush()
 
 
 def PrintMsg(msg):
     """
     Prints a message to stdout.
 
-    Use flush in order to ensure the strings printed are in order.
-
     """
 
-    print(msg, flush=True)
+    if level >= NORMAL:
+        print(msg)
 
 
 def PrintMsgNoCR(msg):
     """
     Prints a message to stdout, but don't add CR.
 
-    Use flush in order to ensure the strings printed are in order.
+    """
+
+    if level >= NORMAL:
+        print(msg, end='')
+
+
+def PrintVerbose(msg, end='\n'):
+    """
+    Prints a message to stdout only at level VERBOSE.
 
     """
 
-    print(msg, flush=True, end='')
+    if level >= VERBOSE:
+        print(msg, end=end)
+
+
+def OpenOutput(file_name=None):
+    """
+    Open a data output for writing, with a large buffer.  Use it in a 'with'
+    statement.
+
+    @param file_name File to write, stdout if None or '-'
+
+    @return file object
+    """
+
+    if file_name is not None and file_name != '-':
+        return open(file_name, 'w', buffering=DATA_BUFFER)
+
+    # Diagnostics already printed must come first.
+    #
+    Flush()
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, ValueError, OSError):
+        # Not a real file, e.g. captured output: write to it directly.
+        #
+        import contextlib
+        return contextlib.nullcontext(sys.stdout)
+    return open(fd, 'w', buffering=DATA_BUFFER, closefd=False,
+                encoding=sys.stdout.encoding, errors=sys.stdout.errors)
 
 
 def PrintAndExit(msg):
@@ -81,13 +152,15 @@ def PrintHelpAndExit(msg):
 
     string = os.path.basename(sys.argv[0]) + ' ERROR: ' + \
                 msg + '.\n' + 'Use --help to see valid argument options.\n'
+    Flush()
     sys.stderr.write(string)
     sys.exit(-1)
 
 
 def PrintMsgDate(string):
     """
-    Print out a msg with three '*' and a timestamp.
+    Print out a msg with three '*' and a timestamp.  This marks the start or
+    end of a phase, so the diagnostics are flushed.
 
     """
 
@@ -96,17 +169,19 @@ def PrintMsgDate(string):
     pr_str = '***  ' + string + '  ***    ' + time.strftime('%B %d, %Y %H:%M:%S')
     PrintMsg('')
     PrintMsg(pr_str)
+    Flush()
 
 
 def PrintMsgPlus(string):
     """
-    Print out a msg with three '+'.
+    Print out a msg with three '+'.  Also flushes the diagnostics.
 
     """
 
     pr_str = '+++  ' + string
     PrintMsg('')
     PrintMsg(pr_str)
+    Flush()
 
 
 def PrintStart(options, start_str):
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# Opt-in profiling of the utils entry points.
+#
+# Each entry point takes --profile[=cprofile|tracemalloc|sampling] (cprofile
+# when no mode is given) and calls enable(), which profiles the rest of the
+# process and writes, at exit, to <outdir>/profile/:
+#
+#   <name>.<pid>.prof        cProfile stats, for pstats or snakeviz
+#   <name>.<pid>.tracemalloc tracemalloc snapshot, for Snapshot.load()
+#   <name>.<pid>.folded      sampled stacks, for flamegraph.pl or speedscope
+#   <name>.<pid>.txt         the TOP hottest functions or allocation sites
+#
+# The mode and directory are exported in XPUPOINT_PROFILE and
+# XPUPOINT_PROFILE_DIR, so Python subprocesses started by a profiled entry
+# point (xpu_regions.py from run_simpoint.gen_regions) profile themselves
+# into the same directory.  The variables can also be set by hand to profile
+# an entry point without changing its command line.
+#
+# stage_graph.py profiles each stage of run-xpupoint-analysis.py on its own
+# with Profiler.
+
+import os
+import sys
+import atexit
+import logging
+import threading
+import collections
+
+MODES = ('cprofile', 'tracemalloc', 'sampling')
+
+MODE_ENV = 'XPUPOINT_PROFILE'
+DIR_ENV = 'XPUPOINT_PROFILE_DIR'
+
+PROFILE_DIR = 'profile'
+
+# Functions or allocation sites listed in the summaries.
+TOP = 25
+
+SAMPLE_INTERVAL = 0.005
+
+TRACEMALLOC_FRAMES = 10
+
+log = logging.getLogger(__name__)
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def add_argument(parser):
+  """Add --profile to an argparse parser or argument group."""
+  parser.add_argument('--profile', nargs='?', const='cprofile', choices=MODES,
+                      help='profile this run into <outdir>/profile/; the mode '
+                           'defaults to cprofile')
+
+
+class _Sampler(threading.Thread):
+  """Count the stacks of one thread every SAMPLE_INTERVAL seconds."""
+
+  def __init__(self, ident):
+    super().__init__(name='profiling-sampler', daemon=True)
+    self.target = ident
+    self.stacks = collections.Counter()
+    self.done = threading.Event()
+
+  def run(self):
+    while not self.done.wait(SAMPLE_INTERVAL):
+      frame = sys._current_frames().get(self.target)
+      stack = []
+      while frame is not None:
+        code = frame.f_code
+        stack.append('%s (%s:%d)' % (code.co_name,
+                                     os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+      if stack:
+        self.stacks[tuple(reversed(stack))] += 1
+
+  def stop(self):
+    self.done.set()
+    self.join()
+
+
+class Profiler:
+  """
+  Profile the calling thread with 'mode' between start() and stop(), or as a
+  context manager, and write the dump and summary of 'name' to 'outdir'.
+
+  cProfile and the sampler follow the calling thread only, so stages run
+  concurrently in other threads are profiled apart.  tracemalloc sees the
+  whole process: concurrent stages share it, and their summaries say so.
+  """
+
+  def __init__(self, name, mode, outdir):
+    if mode not in MODES:
+      raise ValueError(f'Unknown profiling mode: {mode}')
+    self.name = name
+    self.mode = mode
+    self.outdir = outdir
+    self.prof = None
+
+  def start(self):
+    global _tracemalloc_users
+
+    if self.mode == 'cprofile':
+      import cProfile
+      self.prof = cProfile.Profile()
+      try:
+        self.prof.enable()
+      except ValueError as e:
+        # Only one cProfile may be active at a time on newer Pythons.
+        log.warning(f'Not profiling {self.name}: {e}')
+        self.prof = None
+    elif self.mode == 'tracemalloc':
+      import tracemalloc
+      with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+          tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.shared = _tracemalloc_users > 0
+        _tracemalloc_users += 1
+      self.prof = tracemalloc
+    else:
+      self.prof = _Sampler(threading.get_ident())
+      self.prof.start()
+    return self
+
+  def stop(self):
+    """@return the summary file written, or None"""
+    global _tracemalloc_users
+
+    if self.prof is None:
+      return None
+    base = os.path.join(self.outdir, f'{self.name}.{os.getpid()}')
+    os.makedirs(self.outdir, exist_ok=True)
+
+    if self.mode == 'cprofile':
+      import io
+      import pstats
+      self.prof.disable()
+      self.prof.dump_stats(base + '.prof')
+      out = io.StringIO()
+      stats = pstats.Stats(self.prof, stream=out)
+      stats.strip_dirs().sort_stats('cumulative').print_stats(TOP)
+      stats.sort_stats('tottime').print_stats(TOP)
+      summary = out.getvalue()
+    elif self.mode == 'tracemalloc':
+      import tracemalloc
+      with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        shared = self.shared or _tracemalloc_users > 1
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+          tracemalloc.stop()
+      snapshot.dump(base + '.tracemalloc')
+      summary = self._memory_summary(snapshot, peak, shared)
+    else:
+      self.prof.stop()
+      with open(base + '.folded', 'w') as f:
+        for stack, n in self.prof.stacks.most_common():
+          f.write('%s %d\n' % (';'.join(stack), n))
+      summary = self._sample_summary(self.prof.stacks)
+
+    with open(base + '.txt', 'w') as f:
+      f.write(summary)
+    self.prof = None
+    return base + '.txt'
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc, tb):
+    self.stop()
+    return False
+
+  def _memory_summary(self, snapshot, peak, shared):
+    lines = [f'Profile of {self.name}: peak traced memory '
+             f'{peak / 1e6:.1f} MB']
+    if shared:
+      lines.append('Other stages ran at the same time and are included.')
+    lines.append('')
+    lines.append(f'Top {TOP} allocation sites still alive at the end:')
+    for stat in snapshot.statistics('lineno')[:TOP]:
+      frame = stat.traceback[0]
+      lines.append('%10.1f KB %8d blocks  %s:%d' % (
+          stat.size / 1024.0, stat.count, frame.filename, frame.lineno))
+    return '\n'.join(lines) + '\n'
+
+  def _sample_summary(self, stacks):
+    total = sum(stacks.values())
+    own = collections.Counter()
+    cumulative = collections.Counter()
+    for stack, n in stacks.items():
+      own[stack[-1]] += n
+      for func in set(stack):
+        cumulative[func] += n
+    lines = [f'Profile of {self.name}: {total} samples every '
+             f'{SAMPLE_INTERVAL * 1000:g} ms']
+    for title, counts in (('own', own), ('cumulative', cumulative)):
+      lines.append('')
+      lines.append(f'Top {TOP} functions by {title} samples:')
+      for func, n in counts.most_common(TOP):
+        lines.append('%8d %6.1f%%  %s' % (n, 100.0 * n / max(1, total), func))
+    return '\n'.join(lines) + '\n'
+
+
+def profile_dir(outdir=None):
+  """@return where profiles go: the inherited directory, or outdir/profile"""
+  return os.environ.get(DIR_ENV) or os.path.join(outdir or '.', PROFILE_DIR)
+
+
+def export(mode=None, outdir=None):
+  """
+  Resolve the profiling mode, given or inherited, and export it with its
+  directory for Python subprocesses.
+
+  @return (mode, directory), or (None, None) if profiling is off
+  """
+  mode = mode or os.environ.get(MODE_ENV)
+  if not mode:
+    return None, None
+  if mode not in MODES:
+    log.warning(f'Ignoring unknown profiling mode {mode!r} '
+                f'(known: {", ".join(MODES)})')
+    return None, None
+  directory = os.path.abspath(profile_dir(outdir))
+  os.environ[MODE_ENV] = mode
+  os.environ[DIR_ENV] = directory
+  return mode, directory
+
+
+def enable(name, mode=None, outdir=None):
+  """
+  Profile the rest of this process as 'name' if 'mode' is given or was
+  inherited, writing into 'outdir'/profile at exit.
+
+  @return the Profiler, or None if profiling is off
+  """
+  # Subprocesses profiled through the environment keep quiet, as their
+  # stderr is often checked by the caller.
+  announce = bool(mode)
+  mode, directory = export(mode, outdir)
+  if not mode:
+    return None
+  prof = Profiler(name, mode, directory).start()
+
+  def finish():
+    path = prof.stop()
+    if path and announce:
+      sys.stderr.write(f'Profile of {name} written to {path}\n')
+
+  atexit.register(finish)
+  return prof
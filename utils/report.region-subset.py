@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+# Error of the extrapolation when only a subset of the regions is timed.
+#
+# Reads a slice trace written by slice_report.py or report.slice-rdtsc.py:
+#   Slice, RDTSC, ClusterNumber, RegionNumber, Weight
+#   0 , 2846 , 0
+#   44 , 6739 , 0 , 1 , 1.0
+#   ...
+#   WholeProgram, 333567
+#
+# and, for every N, projects the whole-program RDTSC from N regions only:
+#   proj(S) = sum(w * nslices * rdtsc for S) / sum(w for S)
+# i.e. the regions that are not timed are assumed to behave like the timed
+# ones.  Two orders are evaluated: heaviest regions first, and a greedy
+# order that adds the region giving the smallest error at each step.  The
+# greedy order is fitted to this very trace, so its errors are a lower bound
+# for what the same regions give on another run.
+#
+# report.region-subset.py --trace_file KOIPerf.*/slice.trace.txt [--max_error 2]
+
+import os
+import sys
+import argparse
+
+import profiling
+
+
+def ReadSliceTrace(trace_file, metric=None):
+  """
+  Get the representative slices and the whole-program value of one metric
+  column of a trace; the first metric column by default.
+
+  @return (list of (region, cluster, value, weight), number of slices,
+           whole-program value)
+  """
+  regions = []
+  nslices = 0
+  whole = None
+  col = None
+  with open(trace_file, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      fields = [x.strip() for x in line.split(',')]
+      if fields[0] == 'Slice':
+        header = fields
+        metrics = header[1:header.index('ClusterNumber')]
+        if metric is None:
+          metric = metrics[0]
+        if metric not in metrics:
+          raise ValueError('No %s column in %s' % (metric, trace_file))
+        col = header.index(metric)
+        continue
+      if col is None:
+        raise ValueError('No header in %s' % trace_file)
+      if fields[0] == 'WholeProgram':
+        whole = int(fields[col])
+        continue
+      if not fields[0].isdigit():
+        continue
+      nslices += 1
+      if len(fields) == len(header):
+        cluster = len(metrics) + 1
+        regions.append((int(fields[cluster + 1]), int(fields[cluster]),
+                        float(fields[col]), float(fields[cluster + 2])))
+  if whole is None:
+    raise ValueError('No WholeProgram value in %s' % trace_file)
+  if not regions:
+    raise ValueError('No representative slices in %s' % trace_file)
+  return regions, nslices, whole
+
+
+def SubsetCurves(rdtsc, weight, nslices, whole):
+  """
+  Projection error for the N heaviest regions and for a greedy selection,
+  for every N.
+
+  @return dict of NumPy arrays indexed by N-1: 'weight_order' and
+          'greedy_order' (region indices), and '<order>_err',
+          '<order>_coverage', '<order>_cost' for both orders
+  """
+  import numpy as np
+  contrib = weight * nslices * rdtsc
+  res = {}
+
+  # Heaviest first: every N is one entry of a running sum.
+  order = np.argsort(-weight, kind='stable')
+  res['weight_order'] = order
+  proj = np.cumsum(contrib[order]) / np.cumsum(weight[order])
+  res['weight_err'] = (whole - proj) / whole * 100
+  res['weight_coverage'] = np.cumsum(weight[order]) / weight.sum() * 100
+  res['weight_cost'] = np.cumsum(rdtsc[order])
+
+  # Greedy: at each step every remaining region is tried at once.
+  k = len(weight)
+  left = np.ones(k, dtype=bool)
+  num = 0.0
+  den = 0.0
+  greedy = np.empty(k, dtype=np.int64)
+  err = np.empty(k)
+  for n in range(k):
+    cand = np.abs(whole - (num + contrib) / (den + weight))
+    cand[~left] = np.inf
+    best = int(np.argmin(cand))
+    left[best] = False
+    num += contrib[best]
+    den += weight[best]
+    greedy[n] = best
+    err[n] = (whole - num / den) / whole * 100
+  res['greedy_order'] = greedy
+  res['greedy_err'] = err
+  res['greedy_coverage'] = np.cumsum(weight[greedy]) / weight.sum() * 100
+  res['greedy_cost'] = np.cumsum(rdtsc[greedy])
+  return res
+
+
+def PrintCurves(region_ids, res):
+  print('N, WeightRegion, WeightCoverage%, WeightErr%, WeightCost, '
+        'GreedyRegion, GreedyCoverage%, GreedyErr%, GreedyCost')
+  for n in range(len(region_ids)):
+    print('%d, %d, %.2f, %.2f, %d, %d, %.2f, %.2f, %d' % (
+        n + 1, region_ids[res['weight_order'][n]], res['weight_coverage'][n],
+        res['weight_err'][n], res['weight_cost'][n],
+        region_ids[res['greedy_order'][n]], res['greedy_coverage'][n],
+        res['greedy_err'][n], res['greedy_cost'][n]))
+
+
+def SmallestN(err, max_error):
+  """@return the smallest N whose error is within max_error, or None"""
+  import numpy as np
+  ok = np.nonzero(np.abs(err) <= max_error)[0]
+  return int(ok[0]) + 1 if len(ok) else None
+
+
+def PlotCurves(res, plot_file):
+  try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+  except ImportError:
+    sys.stderr.write('matplotlib not available, no plot written\n')
+    return
+  n = range(1, len(res['weight_err']) + 1)
+  fig, ax = plt.subplots(figsize=(6, 3))
+  ax.plot(n, abs(res['weight_err']), label='heaviest first')
+  ax.plot(n, abs(res['greedy_err']), label='greedy')
+  ax.set_xlabel('Regions timed')
+  ax.set_ylabel('Sampling Error (%)')
+  ax.grid(True, linestyle='--', alpha=0.6)
+  ax.legend()
+  plt.tight_layout()
+  plt.savefig(plot_file)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Projection error when timing only N regions')
+  parser.add_argument('--trace_file', required=True,
+                      help='slice trace written by slice_report.py')
+  parser.add_argument('--metric',
+                      help='metric column to use (default: the first one)')
+  parser.add_argument('--max_error', type=float,
+                      help='report the smallest N within this error (%%)')
+  parser.add_argument('--plot', metavar='PNG',
+                      help='plot the error-vs-N curves to this file')
+  profiling.add_argument(parser)
+  args = parser.parse_args()
+  profiling.enable('report.region-subset', args.profile,
+                   os.path.dirname(args.trace_file) or '.')
+
+  import numpy as np
+  try:
+    regions, nslices, whole = ReadSliceTrace(args.trace_file, args.metric)
+  except (IOError, ValueError) as e:
+    sys.stderr.write('%s\n' % e)
+    sys.exit(-1)
+
+  region_ids = [r[0] for r in regions]
+  rdtsc = np.array([r[2] for r in regions])
+  weight = np.array([r[3] for r in regions])
+  res = SubsetCurves(rdtsc, weight, nslices, whole)
+  PrintCurves(region_ids, res)
+
+  if args.max_error is not None:
+    for name in ('weight', 'greedy'):
+      n = SmallestN(res[name + '_err'], args.max_error)
+      if n is None:
+        print('%s: no subset is within %.2f%%' % (name, args.max_error))
+      else:
+        order = res[name + '_order'][:n]
+        print('%s: %d regions within %.2f%%, cost %d: %s' % (
+            name, n, args.max_error, res[name + '_cost'][n - 1],
+            ' '.join(str(region_ids[i]) for i in order)))
+
+  if args.plot:
+    PlotCurves(res, args.plot)
+
+
+if __name__ == '__main__':
+  main()
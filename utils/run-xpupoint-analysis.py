@@ -12,6 +12,12 @@ try:
   import concat_xpu_vectors
   import run_simpoint
   import gen_insweights
+  import simpoint_sweep
+  import stage_metrics
+  import artifact_catalog
+  import bbv_matrix
+  import profiling
+  from stage_graph import Stage, StageGraph
 except ImportError as e:
   print(f"Error: Failed to import required module: {e}")
   sys.exit(1)
@@ -21,8 +27,11 @@ class Runner:
   
   def __init__(self, args):
     self.args = args
+    self.graph = None
+    self.sweep = None
     self.setup_log()
     self.validate()
+    self.catalog = artifact_catalog.open_catalog(self.args.catalog)
   
   def setup_log(self):
     lvl = logging.DEBUG if self.args.verbose else logging.INFO
@@ -48,12 +57,140 @@ class Runner:
       raise ValueError("maxK must be positive")
     if self.args.dim <= 0:
       raise ValueError("Dimensions must be positive")
+    if self.args.jobs <= 0:
+      raise ValueError("Jobs must be positive")
+
+    if self.args.sweep:
+      self.sweep = simpoint_sweep.parse_sweep(
+          self.args.sweep, {'maxk': self.args.maxk,
+                            'dim': self.args.dim,
+                            'fixed_length': self.args.fixed_length})
   
   def check_outdir(self):
     out = Path(self.args.outdir)
     out.mkdir(parents=True, exist_ok=True)
     self.log.info(f"Output directory: {out.absolute()}")
   
+  def add_gpu_stages(self, g, nthreads):
+    gpudir = Path(self.args.gpudir)
+    gpu_out = gpudir / 'gpu-perthread'
+    gpu_bb = [gpu_out / f'T.{i}.bb' for i in range(self.args.gputhreads)]
+
+    def split():
+      n = nthreads if nthreads else threadsplit.get_num_threads(
+          self.args.gpudir)
+      threadsplit.main(n, self.args.gpudir, str(gpu_out))
+
+    g.add(Stage('gpu-threadsplit', split,
+                inputs=[gpudir / 'thread.bbv'],
+                outputs=[gpu_out / 'T.0.bb'],
+                params={'nthreads': nthreads}))
+
+    g.add(Stage('gpu-concat',
+                lambda: concat_xpu_vectors.main(self.args.gputhreads,
+                                                self.args.cpudir,
+                                                str(gpu_out),
+                                                str(gpu_out),
+                                                "gpu"),
+                inputs=gpu_bb,
+                outputs=[gpu_out / 'global.bbv'],
+                params={'gputhreads': self.args.gputhreads},
+                deps=['gpu-threadsplit']))
+
+  def add_sweep_stage(self, g, bbv, dep):
+    sweepdir = Path(self.args.outdir) / 'sweep'
+    g.add(Stage('sweep',
+                lambda: simpoint_sweep.main(str(bbv), str(sweepdir),
+                                            self.sweep, self.args.jobs,
+                                            self.args.simpoint_bin),
+                inputs=[bbv],
+                outputs=[sweepdir / simpoint_sweep.SUMMARY_FILE],
+                params={'bbv': str(bbv),
+                        'grid': self.sweep,
+                        'simpoint_bin': self.args.simpoint_bin},
+                deps=[dep] if dep else []))
+
+  def add_simpoint_stages(self, g, bbv, dep, gpu_only=False):
+    if self.sweep:
+      self.add_sweep_stage(g, bbv, dep)
+      return
+
+    outdir = Path(self.args.outdir)
+    tfiles = [outdir / f for f in ('t.simpoints', 't.weights', 't.labels')]
+    regions = outdir / ('gpuregions.csv' if gpu_only else 'xpuregions.csv')
+
+    g.add(Stage('simpoint',
+                lambda: run_simpoint.main(self.args.maxk,
+                                          self.args.dim,
+                                          str(bbv),
+                                          self.args.outdir,
+                                          no_regions=True,
+                                          gpu_only=gpu_only,
+                                          fixed_length=self.args.fixed_length,
+                                          simpoint_bin=self.args.simpoint_bin),
+                inputs=[bbv],
+                outputs=tfiles,
+                params={'bbv': str(bbv),
+                        'maxk': self.args.maxk,
+                        'dim': self.args.dim,
+                        'fixed_length': self.args.fixed_length,
+                        'simpoint_bin': self.args.simpoint_bin},
+                deps=[dep] if dep else []))
+
+    # The slices are parsed into a sparse matrix once, while SimPoint runs,
+    # for the region and weight stages to share.
+    matrix = Path(bbv_matrix.cache_path(str(bbv)))
+    g.add(Stage('bbv-matrix',
+                lambda: bbv_matrix.build_cache(str(bbv)),
+                inputs=[bbv],
+                outputs=[matrix],
+                deps=[dep] if dep else []))
+
+    g.add(Stage('regions',
+                lambda: run_simpoint.gen_regions(str(bbv), *map(str, tfiles),
+                                                 self.args.outdir, gpu_only),
+                inputs=[bbv, matrix] + tfiles,
+                outputs=[regions],
+                params={'gpu_only': gpu_only},
+                deps=['simpoint', 'bbv-matrix']))
+
+    # gen_insweights joins a relative BBV path onto the data directory.
+    g.add(Stage('weights',
+                lambda: gen_insweights.main(self.args.outdir,
+                                            str(Path(bbv).resolve())),
+                inputs=[bbv, matrix, tfiles[0], tfiles[2]],
+                outputs=[outdir / 't.iweights'],
+                params={'bbv': str(bbv)},
+                deps=['simpoint', 'bbv-matrix']))
+
+  def new_graph(self):
+    # Stages are profiled one by one; the mode is exported for the Python
+    # subprocesses they start.
+    mode, profile_dir = profiling.export(self.args.profile, self.args.outdir)
+    self.graph = StageGraph(self.args.outdir, jobs=self.args.jobs,
+                            force=self.args.force, catalog=self.catalog,
+                            profile=mode, profile_dir=profile_dir)
+    return self.graph
+
+  def register_profiles(self):
+    """Record the profile directories the analysis was run on."""
+    if not self.catalog:
+      return
+    if not self.args.gpu_only:
+      self.catalog.register(self.args.cpudir, kind='cpu-profile',
+                            summary={'threads': self.args.cputhreads})
+    self.catalog.register(self.args.gpudir, kind='gpu-profile',
+                          summary={'threads': self.args.gputhreads})
+
+  def report_metrics(self):
+    if self.graph is None:
+      return
+    metrics = self.graph.get_metrics()
+    path = stage_metrics.write_metrics(self.args.outdir, metrics)
+    self.log.info(f"Stage metrics written to: {path}")
+    for line in stage_metrics.summary_table(metrics):
+      self.log.info(line)
+
   def run_gpu(self):
     self.log.info("Running GPU-only analysis")
     
@@ -62,76 +199,55 @@ class Runner:
       raise FileNotFoundError(f"Required file not found: {bbv}")
     
     gpu_out = Path(self.args.gpudir) / 'gpu-perthread'
-    
-    if not self.args.simpoint_only:
-      self.log.info("Running thread splitting for GPU")
-      threadsplit.main(self.args.gputhreads, self.args.gpudir, str(gpu_out))
-      
-      self.log.info("Concatenating GPU vectors")
-      concat_xpu_vectors.main(
-        self.args.gputhreads, 
-        self.args.cpudir, 
-        str(gpu_out), 
-        str(gpu_out), 
-        "gpu"
-      )
-    
-    self.log.info("Running SimPoint clustering")
-    run_simpoint.main(
-      self.args.maxk, 
-      self.args.dim, 
-      str(gpu_out / 'global.bbv'), 
-      self.args.outdir, 
-      gpu_only=True, 
-      fixed_length=self.args.fixed_length,
-      simpoint_bin=self.args.simpoint_bin
-    )
-    
-    self.log.info("Generating instruction weights")
-    gen_insweights.main(self.args.outdir, str(gpu_out / 'global.bbv'))
+
+    g = self.new_graph()
+    self.add_gpu_stages(g, self.args.gputhreads)
+    self.add_simpoint_stages(g, gpu_out / 'global.bbv', 'gpu-concat',
+                             gpu_only=True)
+    if self.args.simpoint_only:
+      g.freeze('gpu-threadsplit', 'gpu-concat')
+    g.run()
   
   def run_full(self):
     self.log.info("Running XPU analysis")
-    
-    if not self.args.simpoint_only:
-      gpu_out = Path(self.args.gpudir) / 'gpu-perthread'
-    
-      ngputhreads = threadsplit.get_num_threads(self.args.gpudir)
-      self.log.info("Running thread splitting for GPU")
-      #threadsplit.main(self.args.gputhreads, self.args.gpudir, str(gpu_out))
-      threadsplit.main(ngputhreads, self.args.gpudir, str(gpu_out))
-      
-      self.log.info("Concatenating GPU vectors")
-      concat_xpu_vectors.main(
-        self.args.gputhreads, 
-        self.args.cpudir, 
-        str(gpu_out), 
-        str(gpu_out), 
-        "gpu"
-      )
-      
-      self.log.info("Concatenating XPU vectors")
-      concat_xpu_vectors.main(
-        self.args.cputhreads + 1, 
-        self.args.cpudir, 
-        str(gpu_out), 
-        self.args.outdir, 
-        "xpu"
-      )
-    
+
+    gpu_out = Path(self.args.gpudir) / 'gpu-perthread'
     hv = Path(self.args.outdir) / 'T.global.hv'
-    self.log.info("Running SimPoint clustering")
-    run_simpoint.main(
-      self.args.maxk, 
-      self.args.dim, 
-      str(hv), 
-      self.args.outdir, 
-      fixed_length=self.args.fixed_length,
-      simpoint_bin=self.args.simpoint_bin
-    )
-    
-    self.log.info("Generating instruction weights")
-    gen_insweights.main(self.args.outdir)
+    cpu_bb = [Path(self.args.cpudir) / f'T.{i}.bb'
+              for i in range(self.args.cputhreads)]
+
+    g = self.new_graph()
+    self.add_gpu_stages(g, None)
+
+    # The CPU thread files do not depend on the GPU side, so they are parsed
+    # and indexed by worker processes while the GPU split/concat runs.
+    #
+    cpu_index = Path(self.args.outdir) / 'cpu-index'
+    cpu_idx = [cpu_index / f'T.{i}.npz' for i in range(self.args.cputhreads)]
+    g.add(Stage('cpu-index',
+                lambda: concat_xpu_vectors.index_bb_files(self.args.cpudir,
+                                                          self.args.cputhreads,
+                                                          str(cpu_index),
+                                                          self.args.jobs),
+                inputs=cpu_bb,
+                outputs=cpu_idx,
+                params={'cputhreads': self.args.cputhreads}))
+
+    g.add(Stage('xpu-concat',
+                lambda: concat_xpu_vectors.main(self.args.cputhreads + 1,
+                                                self.args.cpudir,
+                                                str(gpu_out),
+                                                self.args.outdir,
+                                                "xpu",
+                                                cpu_index_dir=str(cpu_index)),
+                inputs=cpu_idx + [gpu_out / 'global.bbv'],
+                outputs=[hv],
+                params={'cputhreads': self.args.cputhreads},
+                deps=['gpu-concat', 'cpu-index']))
+    self.add_simpoint_stages(g, hv, 'xpu-concat')
+    if self.args.simpoint_only:
+      g.freeze('gpu-threadsplit', 'gpu-concat', 'cpu-index', 'xpu-concat')
+    g.run()
   
   def run(self):
     try:
@@ -141,6 +257,7 @@ class Runner:
         self.run_gpu()
       else:
         self.run_full()
+      self.register_profiles()
       
       self.log.info("Analysis completed successfully")
       
@@ -149,6 +266,8 @@ class Runner:
       if self.args.verbose:
         raise
       sys.exit(1)
+    finally:
+      self.report_metrics()
 
 
 def get_args():
@@ -201,6 +320,33 @@ def get_args():
     action='store_true', 
     help="Run only SimPoint clustering (skip preprocessing)"
   )
+  pg.add_argument(
+    "--force",
+    action='store_true',
+    help="Rerun all stages, even those whose outputs are up to date"
+  )
+  pg.add_argument(
+    "-j", "--jobs",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="Maximum number of independent stages run concurrently"
+  )
+  pg.add_argument(
+    "--catalog",
+    type=str,
+    default=None,
+    help="Artifact catalog to register the outputs in "
+         f"(default: ${artifact_catalog.CATALOG_ENV} if set)"
+  )
+  pg.add_argument(
+    "--sweep",
+    nargs='+',
+    metavar="KEY=V1,V2",
+    help="Cluster every combination of the given maxk, dim and fixed_length "
+         "values into <outdir>/sweep/<config> instead of a single run, "
+         "e.g. --sweep maxk=10,20,40 dim=15,64,128"
+  )
+  profiling.add_argument(pg)
   
   sg = p.add_argument_group('SimPoint Parameters')
   sg.add_argument(
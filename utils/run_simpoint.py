@@ -6,6 +6,9 @@ import subprocess
 import logging
 from pathlib import Path
 
+import profiling
+import stage_metrics
+
 
 def get_args():
   parser = argparse.ArgumentParser(description="Run SimPoint clustering")
@@ -45,6 +48,7 @@ def get_args():
                       "--verbose",
                       action='store_true',
                       help="Enable verbose output")
+  profiling.add_argument(parser)
   args = parser.parse_args()
   return args
 
@@ -62,7 +66,14 @@ def get_simpoint_from_env():
   return simpoint
 
 
-def run_simpoint(simpoint_bin, globalbbv, maxk, dim, outdir, fixed_length):
+def run_simpoint(simpoint_bin,
+                 globalbbv,
+                 maxk,
+                 dim,
+                 outdir,
+                 fixed_length,
+                 projected=None,
+                 log_file=None):
   tsimpoints = os.path.join(outdir, 't.simpoints')
   tweights = os.path.join(outdir, 't.weights')
   tlabels = os.path.join(outdir, 't.labels')
@@ -73,10 +84,16 @@ def run_simpoint(simpoint_bin, globalbbv, maxk, dim, outdir, fixed_length):
   if fixed_length != "off":
     fixed_length = "on"
 
-  cmd = [
-      simpoint_bin, '-loadFVFile', globalbbv, '-maxK',
-      str(maxk), '-dim',
-      str(dim), '-coveragePct', '1.0', '-saveSimpoints', tsimpoints,
+  # Vectors projected by project_vectors() skip loading and projecting the
+  # frequency vector file; -dim must not be given with them.
+  if projected:
+    load = ['-loadVectorsBinFmt', projected]
+  else:
+    load = ['-loadFVFile', globalbbv, '-dim', str(dim)]
+
+  cmd = [simpoint_bin] + load + [
+      '-maxK',
+      str(maxk), '-coveragePct', '1.0', '-saveSimpoints', tsimpoints,
       '-saveSimpointWeights', tweights, '-saveLabels', tlabels, '-fixedLength',
       fixed_length, '-verbose', '1'
   ]
@@ -85,7 +102,10 @@ def run_simpoint(simpoint_bin, globalbbv, maxk, dim, outdir, fixed_length):
   logging.debug(f'Command: {" ".join(cmd)}')
 
   try:
-    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    result = stage_metrics.run_cmd(cmd)
+    if log_file:
+      with open(log_file, 'w') as f:
+        f.write(result.stdout)
     if result.stdout:
       logging.debug(f'SimPoint stdout: {result.stdout}')
     if result.stderr:
@@ -98,10 +118,49 @@ def run_simpoint(simpoint_bin, globalbbv, maxk, dim, outdir, fixed_length):
     if not os.path.isfile(f):
       raise RuntimeError(f'SimPoint failed to create: {f}')
 
+  with open(tlabels, 'r') as f:
+    nslices = sum(1 for _ in f)
+  with open(tsimpoints, 'r') as f:
+    nclusters = sum(1 for _ in f)
+  stage_metrics.add_counts(slices=nslices, clusters=nclusters)
+
   logging.info('SimPoint clustering completed successfully')
   return tsimpoints, tweights, tlabels
 
 
+def project_vectors(simpoint_bin, globalbbv, dim, vectors_file):
+  """
+  Project the frequency vectors once and save them for later SimPoint runs.
+
+  The vectors are saved with their real lengths as weights; SimPoint replaces
+  them with uniform weights when loaded with -fixedLength on, so one file
+  serves both settings.
+  """
+  if not os.path.isfile(globalbbv):
+    raise FileNotFoundError(f'BBV file not found: {globalbbv}')
+
+  # SimPoint always clusters after saving the vectors; one cluster, one
+  # seed and one iteration is the least work it accepts.
+  cmd = [
+      simpoint_bin, '-loadFVFile', globalbbv, '-dim',
+      str(dim), '-k', '1', '-numInitSeeds', '1', '-iters', '1',
+      '-fixedLength', 'off', '-saveVectorsBinFmt', vectors_file
+  ]
+
+  logging.info(f'Projecting frequency vectors to {dim} dimensions...')
+  logging.debug(f'Command: {" ".join(cmd)}')
+
+  try:
+    stage_metrics.run_cmd(cmd)
+  except subprocess.CalledProcessError as e:
+    raise RuntimeError(
+        f'SimPoint projection failed with exit code {e.returncode}: {e.stderr}')
+
+  if not os.path.isfile(vectors_file):
+    raise RuntimeError(f'SimPoint failed to create: {vectors_file}')
+  return vectors_file
+
+
 def gen_regions(globalbbv, tsimpoints, tweights, tlabels, outdir, gpu_only):
   utils_dir = os.path.dirname(os.path.abspath(__file__))
   xpu_regions_script = os.path.join(utils_dir, 'xpu_regions.py')
@@ -119,20 +178,15 @@ def gen_regions(globalbbv, tsimpoints, tweights, tlabels, outdir, gpu_only):
   cmd = [
       'python3', xpu_regions_script, f'--bbv_file={globalbbv}',
       f'--region_file={tsimpoints}', f'--weight_file={tweights}',
-      f'--label_file={tlabels}', '--csv_region'
+      f'--label_file={tlabels}', '--csv_region', f'--csv_file={regions_csv}'
   ]
 
   logging.debug(f'Command: {" ".join(cmd)}')
 
   try:
-    with open(regions_csv, 'w') as outfile:
-      result = subprocess.run(cmd,
-                              check=True,
-                              stdout=outfile,
-                              stderr=subprocess.PIPE,
-                              text=True)
-      if result.stderr:
-        logging.warning(f'xpu_regions.py stderr: {result.stderr}')
+    result = stage_metrics.run_cmd(cmd)
+    if result.stderr:
+      logging.warning(f'xpu_regions.py stderr: {result.stderr}')
   except subprocess.CalledProcessError as e:
     raise RuntimeError(
         f'Region generation failed with exit code {e.returncode}: {e.stderr}')
@@ -208,6 +262,7 @@ if __name__ == '__main__':
     else:
       outdir = bbv_path
 
+    profiling.enable('run_simpoint', args.profile, outdir)
     main(maxk, dim, globalbbv, outdir, args.no_regions, args.gpu_only,
          args.fixed_length, args.simpoint_bin)
 
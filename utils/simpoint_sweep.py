@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import re
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import run_simpoint
+import gen_insweights
+import stage_metrics
+
+SWEEP_KEYS = ('maxk', 'dim', 'fixed_length')
+SUMMARY_FILE = 'summary.csv'
+
+
+def parse_sweep(specs, defaults):
+  """
+  Parse sweep specifications such as ['maxk=10,20,40', 'dim=15,64'].
+
+  Parameters that are not swept keep the single value from 'defaults'.
+
+  @return dict mapping each of SWEEP_KEYS to a list of values
+  """
+  grid = {k: [defaults[k]] for k in SWEEP_KEYS}
+  for spec in specs:
+    if '=' not in spec:
+      raise ValueError(f"Invalid sweep parameter (expected KEY=V1,V2): {spec}")
+    key, values = spec.split('=', 1)
+    key = key.strip().replace('-', '_')
+    if key not in SWEEP_KEYS:
+      raise ValueError(f"Unknown sweep parameter: {key} "
+                       f"(expected one of {', '.join(SWEEP_KEYS)})")
+    values = [v.strip() for v in values.split(',') if v.strip()]
+    if not values:
+      raise ValueError(f"No values given for sweep parameter: {key}")
+    if key == 'fixed_length':
+      for v in values:
+        if v not in ('on', 'off'):
+          raise ValueError(f"fixed_length must be on or off, not {v}")
+    else:
+      try:
+        values = [int(v) for v in values]
+      except ValueError:
+        raise ValueError(f"Sweep values for {key} must be integers")
+      if any(v <= 0 for v in values):
+        raise ValueError(f"Sweep values for {key} must be positive")
+    grid[key] = list(dict.fromkeys(values))
+  return grid
+
+
+def config_name(maxk, dim, fixed_length):
+  return f'maxk{maxk}-dim{dim}-fl{fixed_length}'
+
+
+def parse_bic(simpoint_log):
+  """
+  Find the clustering SimPoint picked and its BIC score in its verbose output.
+
+  @return (k, bic), either may be None if not found
+  """
+  run_bic = {}
+  run_k = {}
+  scores = []
+  run = None
+  best_run = None
+  with open(simpoint_log, 'r') as f:
+    for line in f:
+      m = re.match(r'Run number (\d+) of .*, k = (\d+)', line)
+      if m:
+        run = int(m.group(1))
+        run_k[run] = int(m.group(2))
+        scores = []
+        continue
+      m = re.search(r'BIC score: (\S+)', line)
+      if m:
+        scores.append(float(m.group(1)))
+        continue
+      m = re.search(r'best initialization seed trial was #(\d+)', line)
+      if m and run is not None and scores:
+        run_bic[run] = scores[int(m.group(1)) - 1]
+        continue
+      m = re.search(r'best clustering was run (\d+)', line)
+      if m:
+        best_run = int(m.group(1))
+
+  if best_run is None:
+    return None, None
+  return run_k.get(best_run), run_bic.get(best_run)
+
+
+def cluster_config(simpoint_bin, globalbbv, projected, slice_weights,
+                   allrcounts, outdir, maxk, dim, fixed_length):
+  cfgdir = Path(outdir) / config_name(maxk, dim, fixed_length)
+  cfgdir.mkdir(parents=True, exist_ok=True)
+  log_file = str(cfgdir / 'simpoint.log')
+
+  run_simpoint.run_simpoint(simpoint_bin, globalbbv, maxk, dim, str(cfgdir),
+                            fixed_length, projected=projected,
+                            log_file=log_file)
+
+  region_slice_map = gen_insweights.read_region_map(str(cfgdir))
+  region_counts = gen_insweights.count_regions(str(cfgdir))
+  cluster_weight, weight_sum = gen_insweights.calc_cluster_weights(
+      slice_weights, region_slice_map, region_counts)
+  gen_insweights.write_weights(str(cfgdir), cluster_weight, weight_sum)
+
+  k, bic = parse_bic(log_file)
+  # Share of the whole-program instructions executed by the representative
+  # slices, i.e. what simulating this configuration costs.
+  sampled = sum(allrcounts[s] for s in region_slice_map.values())
+  return {
+      'config': cfgdir.name,
+      'maxk': maxk,
+      'dim': dim,
+      'fixed_length': fixed_length,
+      'k': k,
+      'bic': bic,
+      'regions': len(region_slice_map),
+      'coverage': 100.0 * sampled / sum(allrcounts),
+  }
+
+
+def write_summary(outdir, results):
+  path = Path(outdir) / SUMMARY_FILE
+  cols = ['config', 'maxk', 'dim', 'fixed_length', 'k', 'bic', 'regions',
+          'coverage']
+  with open(path, 'w') as f:
+    f.write(','.join(cols) + '\n')
+    for r in results:
+      f.write(','.join('' if r[c] is None else str(r[c]) for c in cols) + '\n')
+  return path
+
+
+def summary_table(results):
+  lines = []
+  hdr = '%-28s %6s %9s %8s %12s' % ('config', 'k', 'regions', 'bic',
+                                     'coverage(%)')
+  lines.append(hdr)
+  lines.append('-' * len(hdr))
+  for r in results:
+    bic = '-' if r['bic'] is None else '%.4f' % r['bic']
+    k = '-' if r['k'] is None else str(r['k'])
+    lines.append('%-28s %6s %9d %8s %12.3f' % (r['config'], k, r['regions'],
+                                               bic, r['coverage']))
+  return lines
+
+
+def main(globalbbv, outdir, grid, jobs=1, simpoint_bin=""):
+  """
+  Cluster 'globalbbv' once for every combination in 'grid'.
+
+  The BBV file is read once for the instruction weights, and SimPoint
+  projects it once per dimension; every clustering of that dimension then
+  starts from the saved projection.  Each configuration writes its
+  t.simpoints/t.weights/t.labels/t.iweights to its own subdirectory of
+  'outdir'.
+  """
+  logging.basicConfig(level=logging.INFO,
+                      format='%(asctime)s - %(levelname)s - %(message)s')
+
+  if not simpoint_bin:
+    simpoint_bin = run_simpoint.get_simpoint_from_env()
+
+  outdir = Path(outdir)
+  projdir = outdir / 'projections'
+  projdir.mkdir(parents=True, exist_ok=True)
+
+  allrcounts = gen_insweights.read_slice_counts(globalbbv)
+  slice_weights, _ = gen_insweights.calc_slice_weights(allrcounts)
+
+  configs = list(itertools.product(grid['maxk'], grid['dim'],
+                                   grid['fixed_length']))
+  logging.info(f"Sweeping {len(configs)} SimPoint configurations")
+
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+    projected = {}
+    for dim in grid['dim']:
+      vectors = str(projdir / f'vectors.dim{dim}.bin')
+      projected[dim] = pool.submit(
+          stage_metrics.bind(run_simpoint.project_vectors), simpoint_bin,
+          globalbbv, dim, vectors)
+    projected = {dim: fut.result() for dim, fut in projected.items()}
+
+    futures = [
+        pool.submit(stage_metrics.bind(cluster_config), simpoint_bin,
+                    globalbbv, projected[dim], slice_weights, allrcounts,
+                    outdir, maxk, dim, fixed_length)
+        for maxk, dim, fixed_length in configs
+    ]
+    results = [fut.result() for fut in futures]
+
+  path = write_summary(outdir, results)
+  for line in summary_table(results):
+    logging.info(line)
+  logging.info(f"Sweep summary written to: {path}")
+
+  stage_metrics.add_counts(slices=len(allrcounts), configs=len(configs))
+  return results
@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+#
+# Per-slice metric report engine.
+#
+# Each metric trace is read once by its parser into a per-slice array, then
+# all requested metrics are joined with the slice labels, the simpoints and
+# the cluster weights into one table:
+#
+#   Slice, RDTSC, HWicount, ClusterNumber, RegionNumber, Weight
+#   0 , 2846 , 1134988259 , 0
+#   44 , 6739 , 2706116754 , 0 , 1 , 1.0
+#   ...
+#   WholeProgram, 333567, 463536757174
+#
+# With a single metric the table is the one the report.slice-<metric>.py
+# scripts always wrote.  --npz_file also writes the joined columns as NumPy
+# arrays (see JoinColumns()) for readers such as make-graphs.
+#
+# --follow tails an RDTSC trace while XPU-Timer is still appending to it and
+# reports the projected whole-program RDTSC as slices complete (see Follow()).
+#
+# slice_report.py --rdtsc_file KOIPerf/gpu.onkernelperf.out \
+#   --hwicount_file KOIPerf/cpu.onkernelperf.txt --region_file t.simpoints \
+#   --label_file t.labels --weights_file t.weights > slice.trace.txt
+
+import os
+import re
+import sys
+import time
+import argparse
+
+import numpy as np
+
+import profiling
+
+
+class SliceMetric(object):
+    """
+    Per-slice values of one metric.
+
+    'whole' is the whole-program value, or None when it is the sum of the
+    slices reported.  'strict' metrics stop the report at the first slice
+    that has neither a label nor a simpoint.
+    """
+
+    def __init__(self, name, values, whole, strict):
+        self.name = name
+        self.values = np.asarray(values, dtype=np.int64)
+        self.whole = whole
+        self.strict = strict
+
+
+class RDTSCParser(object):
+    """
+    Incremental reader of a timer trace with the following format
+    slicenumber OnRun/OnComplete Kernel TSC tscvalue
+    e.g.
+    0 GPU_Init : TSC 1343417934170000
+    0 OnRun Kernel1 TSC 1343417934171039
+    0 OnComplete Kernel1 TSC 1343417940232647
+    1 OnRun Kernel1 TSC 1343...
+    ...
+    N GPU_Fini : TSC 134...
+
+    The delta of a slice is between its on-complete-rdtsc and the last
+    on-complete-rdtsc (init-rdtsc for slice 0, and fini-rdtsc for the last
+    slice).  With 'gpu_only' it is OnComplete - OnRun of the kernel.
+
+    Lines are fed one at a time, so a trace still being written can be read
+    as it grows.
+    """
+
+    def __init__(self, gpu_only=False):
+        self.gpu_only = gpu_only
+        self.init = self.fini = self.run = self.comp = self.lastcomp = 0
+        self.sum_run = 0
+        self.values = []
+        self.delta = 0
+        self.pending = False
+        self.finished = False
+
+    def _Close(self):
+        self.values.append(self.delta)
+        self.delta = 0
+        self.pending = False
+
+    def Feed(self, line):
+        # A line of another slice, or a blank one, ends the current slice
+        # and is dropped.
+        tokens = line.split()
+        if not tokens or int(tokens[0]) != len(self.values):
+            self._Close()
+            return
+        self.pending = True
+        if tokens[1] == "GPU_Init":
+            self.init = int(tokens[4])
+        elif tokens[1] == "GPU_Fini":
+            self.fini = int(tokens[4])
+            # Last record, does not have any complete/run, use last comp
+            self.delta = self.fini - self.comp
+            self.finished = True
+            self._Close()
+        elif tokens[1] == "OnRun":
+            self.run = int(tokens[4])
+        elif tokens[1] == "OnComplete":
+            self.comp = int(tokens[4])
+            if self.gpu_only:
+                if self.run == 0:
+                    raise ValueError('OnComplete without OnRun')
+                self.delta = self.comp - self.run
+                self.sum_run += self.delta
+                self.run = 0
+            else:
+                slicenum = len(self.values)
+                self.delta = self.comp - (self.init if slicenum == 0
+                                          else self.lastcomp)
+                self.lastcomp = self.comp
+            self._Close()
+
+    def Finish(self):
+        """End of the trace: a slice cut short counts with what it has."""
+        if self.pending:
+            self._Close()
+
+    def Elapsed(self):
+        """Whole-program value of the slices read so far."""
+        if self.gpu_only:
+            return self.sum_run
+        return (self.fini if self.finished else self.comp) - self.init
+
+    def Metric(self):
+        whole = self.sum_run if self.gpu_only else self.fini - self.init
+        return SliceMetric('RDTSC', self.values, whole, strict=False)
+
+
+def ParseRDTSC(fp, gpu_only=False):
+    """
+    Read a complete timer trace, see RDTSCParser.
+
+    @return SliceMetric
+    """
+    parser = RDTSCParser(gpu_only)
+    for line in fp:
+        parser.Feed(line)
+    parser.Finish()
+    return parser.Metric()
+
+
+def _NextHWInstructions(fp):
+    tokens = fp.readline().split()
+    field = tokens[1].split(":") if len(tokens) > 1 else ['']
+    if field[0] != "hw_instructions":
+        return None
+    return int(field[1])
+
+
+def ParseHWicount(fp):
+    """
+    Read a CPU hardware counter trace
+    GPU_Init : TSC 1540689857970411
+    hw_cpu_cycles:1134988259 hw_instructions:2706116754
+    KOI_STOP: TSC 1540727986812317
+    hw_cpu_cycles:62364694566 hw_instructions:139820030247
+    ..
+    GPU_Fini : TSC 1541251542225627
+    hw_cpu_cycles:1093082035189 hw_instructions:463536757174
+
+    @return SliceMetric
+    """
+    init = fini = lastcomp = 0
+    values = []
+    for line in fp:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] in ("GPU_Init", "GPU_Fini", "KOI_STOP:"):
+            count = _NextHWInstructions(fp)
+            if count is None:
+                break
+            if tokens[0] == "GPU_Init":
+                init = count
+            elif tokens[0] == "GPU_Fini":
+                fini = count
+                values.append(fini - lastcomp)
+            else:
+                values.append(count - (init if not values else lastcomp))
+                lastcomp = count
+    return SliceMetric('HWicount', values, fini - init, strict=True)
+
+
+def ParseGPUicount(fp):
+    """
+    Read a GPU software instruction count trace
+    0 GPU_Init : TSC 1540689858017269
+    0 OnComplete __omp_offloading_800_74c00c7__Z18generate_new_beads_l184 TSC 1540727986769933
+     SliceGlobalCount:45541226038
+    ...
+    GPU_Fini : TSC 1541251542190197
+
+    @return SliceMetric
+    """
+    values = []
+    for line in fp:
+        tokens = line.split(":")
+        if tokens[0] == " SliceGlobalCount":
+            values.append(int(tokens[1]))
+    return SliceMetric('GPUicount', values, None, strict=True)
+
+
+# Seconds between two reads of a trace that is being followed, and number
+# of consecutive snapshots the projection must stay within --converge.
+FOLLOW_POLL = 1.0
+STABLE_SNAPSHOTS = 3
+
+# metric: (parser, first line prefix of a valid trace, trace description)
+METRICS = {
+    'rdtsc': (ParseRDTSC, '0 GPU_Init', 'RDTSC trace file: '),
+    'hwicount': (ParseHWicount, 'GPU_Init', 'CPU XPU-Perf trace file: '),
+    'gpuicount': (ParseGPUicount, '0 GPU_Init', 'GPU XPU-Perf trace file: '),
+}
+
+
+def PrintAndExit(msg):
+    sys.stderr.write(msg)
+    sys.stderr.write("\n")
+    sys.exit(-1)
+
+
+def IsInt(s):
+    try:
+        int(s)
+        return True
+    except ValueError:
+        return False
+
+
+def IsFloat(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def OpenFile(fl, type_str, check=None):
+    """
+    Open a file, exiting with an error if it does not exist or if its first
+    line does not pass 'check'.
+
+    @return file object
+    """
+    try:
+        fp = open(fl, 'r', encoding='utf-8')
+    except IOError:
+        PrintAndExit('File does not exist: %s' % fl)
+    if check:
+        line = fp.readline()
+        if not check(line):
+            PrintAndExit("Invalid " + type_str + fl)
+        fp.seek(0, 0)
+    return fp
+
+
+def ReadMetric(metric, trace_file, gpu_only=False):
+    parser, prefix, type_str = METRICS[metric]
+    with OpenFile(trace_file, type_str,
+                  lambda l: l.startswith(prefix)) as fp:
+        try:
+            if metric == 'rdtsc':
+                return parser(fp, gpu_only)
+            return parser(fp)
+        except ValueError as e:
+            PrintAndExit(str(e))
+
+
+def ReadLabels(lbl_file):
+    """
+    Read a t.labels file: 'cluster distance_from_centroid' per slice.
+
+    @return NumPy array mapping slice number to cluster
+    """
+    with OpenFile(lbl_file, 'Slice label file: ',
+                  lambda l: l.split() and IsInt(l.split()[0])) as fp:
+        return np.array([int(l.split(' ')[0]) for l in fp if l.strip()],
+                        dtype=np.int64)
+
+
+def ReadSimpoints(sp_file):
+    """
+    Read a t.simpoints file: 'slice cluster' per region, regions are
+    numbered from 1 in file order.
+
+    @return (slice, cluster, region) NumPy arrays
+    """
+    rows = []
+    with OpenFile(sp_file, 'simpoints file: ',
+                  lambda l: l.split() and IsInt(l.split()[0])) as fp:
+        for line in fp:
+            field = re.match(r'(\d+)\s(\d+)', line)
+            if field:
+                rows.append((int(field.group(1)), int(field.group(2))))
+    # A slice listed twice keeps its last cluster and region.
+    last = {s: (c, i + 1) for i, (s, c) in enumerate(rows)}
+    slices = np.array(sorted(last), dtype=np.int64)
+    clusters = np.array([last[s][0] for s in slices], dtype=np.int64)
+    regions = np.array([last[s][1] for s in slices], dtype=np.int64)
+    return slices, clusters, regions
+
+
+def ReadWeights(wt_file):
+    """
+    Read a t.weights file: 'weight cluster' per cluster.
+
+    @return dict mapping cluster to weight
+    """
+    # A weight in fixed point or scientific notation, white space and the
+    # cluster number; a lone '1' is the weight of a single cluster.
+    pattern = r'(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?)\s(\d+)'
+    weight_dict = {}
+    with OpenFile(wt_file, 'weights file: ',
+                  lambda l: l.split() and IsFloat(l.split()[0])) as fp:
+        for line in fp:
+            field = re.match(pattern, line)
+            if not field:
+                field = re.match(r'(\d)\s(\d)', line)
+            if field:
+                weight_dict[int(field.group(2))] = float(field.group(1))
+    return weight_dict
+
+
+def JoinColumns(metrics, labels, simpoints, weight_dict):
+    """
+    Join the metrics with the labels, simpoints and weights.
+
+    @return dict of NumPy arrays: 'slice', 'cluster', 'region' (-1 for
+            slices that are not representative), 'weight' (NaN likewise),
+            one array per metric name (0 past the end of its trace),
+            'metrics', 'valid' (one row per metric, False past the end of
+            its trace), 'whole' (whole-program value per metric) and
+            'truncated' (True if a strict metric stopped the table early)
+    """
+    sp_slices, sp_clusters, sp_regions = simpoints
+    nslices = max(len(m.values) for m in metrics)
+    idx = np.arange(nslices)
+    is_sp = np.isin(idx, sp_slices)
+    keep = is_sp | (idx < len(labels))
+
+    stop = nslices
+    if all(m.strict for m in metrics) and not keep.all():
+        stop = int(np.nonzero(~keep)[0][0])
+    rows = idx[:stop][keep[:stop]]
+
+    # Per-row cluster, and region/weight for the representative slices.
+    sp_pos = np.searchsorted(sp_slices, rows)
+    sp_pos[sp_pos >= len(sp_slices)] = 0
+    row_sp = is_sp[rows]
+    cluster = np.where(row_sp, sp_clusters[sp_pos] if len(sp_slices) else 0,
+                       labels[np.minimum(rows, max(len(labels) - 1, 0))]
+                       if len(labels) else 0)
+    region = np.where(row_sp, sp_regions[sp_pos] if len(sp_slices) else 0, -1)
+    weight = np.array([weight_dict[int(c)] if r else np.nan
+                       for c, r in zip(cluster.tolist(), row_sp.tolist())],
+                      dtype=np.float64)
+
+    cols = {
+        'slice': rows,
+        'cluster': cluster.astype(np.int64),
+        'region': region.astype(np.int64),
+        'weight': weight,
+        'metrics': np.array([m.name for m in metrics]),
+        'truncated': np.bool_(stop < nslices),
+    }
+    whole = []
+    valid = np.zeros((len(metrics), len(rows)), dtype=bool)
+    for i, m in enumerate(metrics):
+        vals = np.zeros(len(rows), dtype=np.int64)
+        inside = rows < len(m.values)
+        vals[inside] = m.values[rows[inside]]
+        cols[m.name] = vals
+        valid[i] = inside
+        if m.whole is not None:
+            whole.append(m.whole)
+        else:
+            whole.append(int(m.values[:stop + 1].sum()))
+    cols['valid'] = valid
+    cols['whole'] = np.array(whole, dtype=np.int64)
+    return cols
+
+
+def GenTable(cols):
+    """
+    Format the joined columns as the lines of the text report.
+
+    @return (list of output lines, list of whole-program values)
+    """
+    names = cols['metrics'].tolist()
+    columns = [cols[n].tolist() for n in names]
+    valid = cols['valid'].tolist()
+    region = cols['region'].tolist()
+    weight = cols['weight'].tolist()
+    lines = []
+    for i, (s, c) in enumerate(zip(cols['slice'].tolist(),
+                                   cols['cluster'].tolist())):
+        fields = [str(s)] + [str(col[i]) if ok[i] else ''
+                             for col, ok in zip(columns, valid)]
+        fields.append(str(c))
+        if region[i] >= 0:
+            fields.append(str(region[i]))
+            fields.append(str(weight[i]))
+        lines.append(' , '.join(fields))
+
+    if cols['truncated']:
+        stop = int(cols['slice'][-1]) + 1 if len(cols['slice']) else 0
+        lines.append('%d NOT in sliceCluster[]' % stop)
+    return lines, cols['whole'].tolist()
+
+
+def WriteReport(out, metrics, labels, simpoints, weight_dict, npz_file=None):
+    cols = JoinColumns(metrics, labels, simpoints, weight_dict)
+    lines, whole = GenTable(cols)
+    out.write('Slice, ' + ', '.join(m.name for m in metrics) +
+              ', ClusterNumber, RegionNumber, Weight\n')
+    if lines:
+        out.write('\n'.join(lines))
+        out.write('\n')
+    out.write('WholeProgram, ' + ', '.join(str(w) for w in whole) + '\n')
+    out.flush()
+    if npz_file:
+        WriteColumns(npz_file, cols)
+
+
+def WriteColumns(npz_file, cols):
+    """
+    Write the joined columns to a NumPy .npz file next to the text report,
+    for readers that need the table rather than its text.
+    """
+    with open(npz_file, 'wb') as f:
+        np.savez(f, **cols)
+
+
+def ReadColumns(npz_file):
+    """
+    Read a table written by WriteColumns().
+
+    @return dict of NumPy arrays, see JoinColumns()
+    """
+    with np.load(npz_file) as data:
+        return {k: data[k] for k in data.files}
+
+
+def Projection(cols, metric, nslices):
+    """
+    Project the whole-program value of 'metric' from the representative
+    slices reported so far, assuming the regions not reached yet behave like
+    the ones that were: sum(w * nslices * value) / sum(w).
+
+    @return (projected value or None, number of regions, weight coverage)
+    """
+    valid = cols['valid'][cols['metrics'].tolist().index(metric)]
+    rep = (cols['region'] >= 0) & valid
+    weight = cols['weight'][rep]
+    if not rep.any() or weight.sum() <= 0:
+        return None, 0, 0.0
+    proj = (weight * nslices * cols[metric][rep]).sum() / weight.sum()
+    return float(proj), int(rep.sum()), float(weight.sum())
+
+
+def WriteSnapshot(snapshot_file, metric, labels, simpoints, weight_dict):
+    tmp = snapshot_file + '.tmp'
+    with open(tmp, 'w') as out:
+        WriteReport(out, [metric], labels, simpoints, weight_dict)
+    os.replace(tmp, snapshot_file)
+
+
+def Follow(args, out=sys.stdout):
+    """
+    Tail an RDTSC trace that XPU-Timer is still writing, keeping the
+    per-slice deltas and the projected whole-program RDTSC up to date.
+
+    Every --interval seconds the report so far is written to
+    --snapshot_file and a progress line to stderr.  Following stops at
+    GPU_Fini, on Ctrl-C, or once the projection moved less than --converge
+    percent over STABLE_SNAPSHOTS snapshots that each read new slices; the
+    report is then written to 'out' as without --follow.
+    """
+    labels = ReadLabels(args.label_file)
+    simpoints = ReadSimpoints(args.region_file)
+    weight_dict = ReadWeights(args.weights_file)
+    nslices = len(labels)
+    parser = RDTSCParser(args.gpu_only)
+
+    try:
+        while not os.path.exists(args.rdtsc_file):
+            time.sleep(FOLLOW_POLL)
+    except KeyboardInterrupt:
+        # Stopped before XPU-Timer wrote anything: there is no report.
+        sys.exit(1)
+    fp = open(args.rdtsc_file, 'r', encoding='utf-8')
+
+    buf = ''
+    last = None
+    stable = 0
+    progress = None
+    next_snapshot = time.time() + args.interval
+    try:
+        while not parser.finished:
+            data = fp.read()
+            if data:
+                lines = (buf + data).split('\n')
+                buf = lines.pop()
+                for line in lines:
+                    if not parser.values and not parser.pending \
+                            and not line.startswith('0 GPU_Init'):
+                        PrintAndExit("Invalid RDTSC trace file: " +
+                                     args.rdtsc_file)
+                    parser.Feed(line + '\n')
+                    if parser.finished:
+                        break
+            if parser.finished:
+                break
+            if time.time() < next_snapshot:
+                time.sleep(FOLLOW_POLL)
+                continue
+            next_snapshot += args.interval
+
+            metric = parser.Metric()
+            metric.whole = parser.Elapsed()
+            if args.snapshot_file:
+                WriteSnapshot(args.snapshot_file, metric, labels, simpoints,
+                              weight_dict)
+            cols = JoinColumns([metric], labels, simpoints, weight_dict)
+            proj, nregions, coverage = Projection(cols, 'RDTSC', nslices)
+            change = None
+            if proj is not None and last:
+                change = abs(proj - last) / abs(last) * 100
+            sys.stderr.write(
+                'slices %d/%d, regions %d/%d (weight %.3f), elapsed %d, '
+                'projected %s%s\n' % (
+                    len(parser.values), nslices, nregions,
+                    len(simpoints[0]), coverage, metric.whole,
+                    '-' if proj is None else '%d' % proj,
+                    '' if change is None else ' (%.3f%%)' % change))
+            sys.stderr.flush()
+            # A stalled trace does not move the projection, and is not
+            # converging either.
+            moved = (len(parser.values), nregions) != progress
+            progress = (len(parser.values), nregions)
+            if args.converge is not None and change is not None \
+                    and nregions and moved:
+                stable = stable + 1 if change <= args.converge else 0
+                if stable >= STABLE_SNAPSHOTS:
+                    sys.stderr.write('Projection within %.3f%% for %d '
+                                     'snapshots, stopping\n' % (
+                                         args.converge, STABLE_SNAPSHOTS))
+                    break
+            last = proj
+    except KeyboardInterrupt:
+        pass
+    except ValueError as e:
+        PrintAndExit(str(e))
+    finally:
+        fp.close()
+
+    if parser.finished:
+        parser.Finish()
+        metric = parser.Metric()
+    else:
+        metric = parser.Metric()
+        metric.whole = parser.Elapsed()
+    if args.snapshot_file:
+        WriteSnapshot(args.snapshot_file, metric, labels, simpoints,
+                      weight_dict)
+    WriteReport(out, [metric], labels, simpoints, weight_dict,
+                getattr(args, 'npz_file', None))
+
+
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
+def AddArguments(parser, metrics):
+    for metric in metrics:
+        parser.add_argument("--%s_file" % metric,
+                            help="%s trace file" % metric.upper())
+    parser.add_argument("--region_file", help="files showing simpoint regions", required=True)
+    parser.add_argument("--label_file", help="files showing per slice clusters", required=True)
+    parser.add_argument("--weights_file", help="files showing weights for simpoint regions", required=True)
+    if 'rdtsc' in metrics:
+        parser.add_argument("--gpu_only", type=str2bool, nargs='?',
+                            const=True, default=False,
+                            help="Get kernel rdtsc values (OnComplete - OnRun)")
+        parser.add_argument("--follow", action='store_true',
+                            help="follow an RDTSC trace that is still being written")
+        parser.add_argument("--interval", type=float, default=60,
+                            help="seconds between snapshots with --follow (default: 60)")
+        parser.add_argument("--snapshot_file",
+                            help="report file rewritten at every snapshot with --follow")
+        parser.add_argument("--converge", type=float, metavar='PCT',
+                            help="with --follow, stop once the projected RDTSC "
+                            "changes by at most PCT%% per snapshot")
+    parser.add_argument("--npz_file",
+                        help="also write the table as NumPy arrays to this file")
+
+
+def Report(args, metrics, out=sys.stdout):
+    """
+    Read the traces of 'metrics' given in 'args' and write the report.
+    """
+    metrics = [m for m in metrics if getattr(args, m + '_file', None)]
+    if not metrics:
+        PrintAndExit('No metric trace file given')
+    labels = ReadLabels(args.label_file)
+    simpoints = ReadSimpoints(args.region_file)
+    weight_dict = ReadWeights(args.weights_file)
+    gpu_only = getattr(args, 'gpu_only', False)
+    parsed = [ReadMetric(m, getattr(args, m + '_file'), gpu_only)
+              for m in metrics]
+    WriteReport(out, parsed, labels, simpoints, weight_dict,
+                getattr(args, 'npz_file', None))
+
+
+def main(metrics=tuple(METRICS), required=False):
+    parser = argparse.ArgumentParser()
+    AddArguments(parser, metrics)
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    if required and not getattr(args, metrics[0] + '_file'):
+        parser.error('the following arguments are required: --%s_file'
+                     % metrics[0])
+    profiling.enable(os.path.splitext(os.path.basename(sys.argv[0]))[0],
+                     args.profile, os.path.dirname(args.npz_file or '') or '.')
+    if getattr(args, 'follow', False):
+        if not args.rdtsc_file or any(getattr(args, m + '_file', None)
+                                      for m in metrics if m != 'rdtsc'):
+            parser.error('--follow needs --rdtsc_file and no other trace')
+        Follow(args)
+    else:
+        Report(args, metrics)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import contextlib
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import profiling
+from stage_metrics import StageRecorder
+
+STATE_FILE = '.xpupoint-stages.json'
+
+
+class Stage:
+
+  def __init__(self, name, func, inputs=None, outputs=None, params=None,
+               deps=None):
+    self.name = name
+    self.func = func
+    self.inputs = [Path(p) for p in (inputs or [])]
+    self.outputs = [Path(p) for p in (outputs or [])]
+    self.params = params or {}
+    self.deps = list(deps or [])
+
+  def fingerprint(self):
+    blob = json.dumps(self.params, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+class StageGraph:
+  """
+  Run a set of stages, each declaring its input and output files.
+
+  A stage is skipped when all of its outputs exist, are not older than any of
+  its inputs, its parameter fingerprint matches the one recorded by the
+  previous run and none of its dependencies were rerun.  Stages whose
+  dependencies are satisfied run concurrently.
+
+  The outputs of the stages which run are registered in 'catalog', an
+  artifact_catalog.Catalog, when one is given.  With a 'profile' mode, each
+  stage which runs is profiled into 'profile_dir' under its own name.
+  """
+
+  def __init__(self, statedir, jobs=1, force=False, catalog=None,
+               profile=None, profile_dir=None):
+    self.stages = {}
+    self.order = []
+    self.statefile = Path(statedir) / STATE_FILE
+    self.jobs = max(1, jobs)
+    self.force = force
+    self.catalog = catalog
+    self.profile = profile
+    self.profile_dir = profile_dir
+    self.frozen = set()
+    self.ran = set()
+    self.metrics = {}
+    self.log = logging.getLogger(__name__)
+    self.state = self._load_state()
+
+  def add(self, stage):
+    if stage.name in self.stages:
+      raise ValueError(f"Duplicate stage: {stage.name}")
+    for d in stage.deps:
+      if d not in self.stages:
+        raise ValueError(f"Stage {stage.name} depends on unknown stage {d}")
+    self.stages[stage.name] = stage
+    self.order.append(stage.name)
+    return stage
+
+  def freeze(self, *names):
+    """Never run these stages; their outputs are taken as they are."""
+    self.frozen.update(names)
+
+  def _load_state(self):
+    try:
+      with open(self.statefile, 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+
+  def _save_state(self):
+    tmp = self.statefile.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+      json.dump(self.state, f, indent=2, sort_keys=True)
+    os.replace(tmp, self.statefile)
+
+  def is_current(self, stage):
+    if self.force or not stage.outputs:
+      return False
+    if any(d in self.ran for d in stage.deps):
+      return False
+    if self.state.get(stage.name) != stage.fingerprint():
+      return False
+    try:
+      oldest_out = min(p.stat().st_mtime_ns for p in stage.outputs)
+    except FileNotFoundError:
+      return False
+    for p in stage.inputs:
+      try:
+        if p.stat().st_mtime_ns > oldest_out:
+          return False
+      except FileNotFoundError:
+        return False
+    return True
+
+  def _run_stage(self, stage):
+    self.log.info(f"Running stage: {stage.name}")
+    rec = StageRecorder(stage.name, stage.inputs, stage.outputs)
+    self.metrics[stage.name] = rec.m
+    prof = contextlib.nullcontext()
+    if self.profile:
+      prof = profiling.Profiler(stage.name, self.profile, self.profile_dir)
+    with rec, prof:
+      counts = stage.func()
+      if isinstance(counts, dict):
+        rec.m['counts'].update(counts)
+    missing = [str(p) for p in stage.outputs if not p.exists()]
+    if missing:
+      raise RuntimeError(
+          f"Stage {stage.name} did not create: {', '.join(missing)}")
+    if self.catalog:
+      summary = dict(rec.m['counts'], wall=round(rec.m['wall'], 3))
+      for p in stage.outputs:
+        self.catalog.register(p, stage=stage.name, params=stage.params,
+                              summary=summary)
+
+  def run(self):
+    done = set()
+    pending = list(self.order)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+      while pending or running:
+        for name in list(pending):
+          stage = self.stages[name]
+          if not all(d in done for d in stage.deps):
+            continue
+          pending.remove(name)
+          if name in self.frozen:
+            self.log.info(f"Skipping stage: {name} (frozen)")
+            self.metrics[name] = {'stage': name, 'status': 'skipped'}
+            done.add(name)
+          elif self.is_current(stage):
+            self.log.info(f"Skipping stage: {name} (up to date)")
+            self.metrics[name] = {'stage': name, 'status': 'skipped'}
+            done.add(name)
+          else:
+            running[pool.submit(self._run_stage, stage)] = name
+
+        if not running:
+          if pending:
+            raise RuntimeError(
+                f"Unable to schedule stages: {', '.join(pending)}")
+          break
+
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for fut in finished:
+          name = running.pop(fut)
+          try:
+            fut.result()
+          except Exception:
+            for f in running:
+              f.cancel()
+            raise
+          self.ran.add(name)
+          done.add(name)
+          self.state[name] = self.stages[name].fingerprint()
+          self._save_state()
+
+    return self.ran
+
+  def get_metrics(self):
+    """Per-stage metrics, in the order the stages were added."""
+    return [self.metrics[n] for n in self.order if n in self.metrics]
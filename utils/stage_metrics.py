@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import resource
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+from pathlib import Path
+
+METRICS_FILE = 'analysis-metrics.json'
+
+_current = threading.local()
+
+
+def _thread_io():
+  """Return (rchar, wchar) for the calling thread, or None if unavailable."""
+  try:
+    with open('/proc/thread-self/io', 'r') as f:
+      io = dict(line.split(':', 1) for line in f)
+    return int(io['rchar']), int(io['wchar'])
+  except (OSError, KeyError, ValueError):
+    return None
+
+
+def _file_bytes(paths):
+  total = 0
+  for p in paths:
+    try:
+      total += os.path.getsize(p)
+    except OSError:
+      pass
+  return total
+
+
+class StageRecorder:
+  """
+  Record wall/CPU time, peak memory and I/O of one stage.
+
+  CPU time is the time of the calling thread plus the rusage of every
+  subprocess started through run_cmd() while the recorder is active, so
+  stages running concurrently in other threads are not mixed in.
+  """
+
+  def __init__(self, name, inputs=(), outputs=()):
+    self.name = name
+    self.inputs = list(inputs)
+    self.outputs = list(outputs)
+    self.m = {
+        'stage': name,
+        'status': 'running',
+        'children': [],
+        'counts': {},
+    }
+
+  def add_child(self, cmd, ru):
+    self.m['children'].append({
+        'cmd': os.path.basename(str(cmd[0])) if cmd else '',
+        'utime': ru.ru_utime,
+        'stime': ru.ru_stime,
+        'maxrss_kb': ru.ru_maxrss,
+        'inblock': ru.ru_inblock,
+        'oublock': ru.ru_oublock,
+    })
+
+  def __enter__(self):
+    self.prev = getattr(_current, 'recorder', None)
+    _current.recorder = self
+    self.t0 = time.perf_counter()
+    self.c0 = time.thread_time()
+    self.io0 = _thread_io()
+    if tracemalloc.is_tracing():
+      tracemalloc.reset_peak()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    _current.recorder = self.prev
+    m = self.m
+    m['status'] = 'failed' if exc_type else 'ran'
+    m['wall'] = time.perf_counter() - self.t0
+    m['cpu'] = time.thread_time() - self.c0
+    m['child_cpu'] = sum(c['utime'] + c['stime'] for c in m['children'])
+    m['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    m['child_maxrss_kb'] = max([c['maxrss_kb'] for c in m['children']] or [0])
+    if tracemalloc.is_tracing():
+      m['py_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    io1 = _thread_io()
+    if self.io0 and io1:
+      m['rchar'] = io1[0] - self.io0[0]
+      m['wchar'] = io1[1] - self.io0[1]
+    m['input_bytes'] = _file_bytes(self.inputs)
+    m['output_bytes'] = _file_bytes(self.outputs)
+    return False
+
+
+def add_counts(**counts):
+  """Attach slice/block counts to the stage running in this thread."""
+  rec = getattr(_current, 'recorder', None)
+  if rec:
+    rec.m['counts'].update(counts)
+
+
+def bind(func):
+  """
+  Wrap 'func' so that it records into the stage active in the calling thread,
+  for work a stage hands to its own thread pool.
+  """
+  rec = getattr(_current, 'recorder', None)
+
+  def wrapper(*args, **kwargs):
+    prev = getattr(_current, 'recorder', None)
+    _current.recorder = rec
+    try:
+      return func(*args, **kwargs)
+    finally:
+      _current.recorder = prev
+
+  return wrapper
+
+
+def charge_children(cmd, ru0):
+  """
+  Charge the growth of RUSAGE_CHILDREN since 'ru0' to the active stage.
+
+  Used for worker pools whose processes are reaped by the library rather
+  than by run_cmd().  Subprocesses reaped concurrently by other threads in
+  the same window are included as well.
+  """
+  rec = getattr(_current, 'recorder', None)
+  if not rec:
+    return
+  ru1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+  rec.m['children'].append({
+      'cmd': cmd,
+      'utime': ru1.ru_utime - ru0.ru_utime,
+      'stime': ru1.ru_stime - ru0.ru_stime,
+      'maxrss_kb': ru1.ru_maxrss,
+      'inblock': ru1.ru_inblock - ru0.ru_inblock,
+      'oublock': ru1.ru_oublock - ru0.ru_oublock,
+  })
+
+
+def run_cmd(cmd, stdout=None, stderr=None):
+  """
+  Run a command to completion and reap it with os.wait4() so its rusage can
+  be charged to the active stage.
+
+  'stdout'/'stderr' may be file objects; when None the output is captured.
+
+  @return CompletedProcess with text stdout/stderr for captured streams
+  """
+  out = stdout if stdout is not None else tempfile.TemporaryFile('w+')
+  err = stderr if stderr is not None else tempfile.TemporaryFile('w+')
+  try:
+    p = subprocess.Popen(cmd, stdout=out, stderr=err, text=True)
+    try:
+      _, status, ru = os.wait4(p.pid, 0)
+    except ChildProcessError:
+      p.wait()
+      ru = None
+    else:
+      p.returncode = os.waitstatus_to_exitcode(status)
+
+    rec = getattr(_current, 'recorder', None)
+    if rec and ru:
+      rec.add_child(cmd, ru)
+
+    res_out = res_err = None
+    if stdout is None:
+      out.seek(0)
+      res_out = out.read()
+    if stderr is None:
+      err.seek(0)
+      res_err = err.read()
+  finally:
+    if stdout is None:
+      out.close()
+    if stderr is None:
+      err.close()
+
+  if p.returncode != 0:
+    raise subprocess.CalledProcessError(p.returncode, cmd, res_out, res_err)
+  return subprocess.CompletedProcess(cmd, p.returncode, res_out, res_err)
+
+
+def write_metrics(outdir, metrics):
+  path = Path(outdir) / METRICS_FILE
+  with open(path, 'w') as f:
+    json.dump({'stages': metrics}, f, indent=2)
+  return path
+
+
+def summary_table(metrics):
+  lines = []
+  hdr = '%-16s %-8s %9s %9s %9s %10s %10s %10s' % (
+      'stage', 'status', 'wall(s)', 'cpu(s)', 'child(s)', 'rss(MB)',
+      'in(MB)', 'out(MB)')
+  lines.append(hdr)
+  lines.append('-' * len(hdr))
+  for m in metrics:
+    if m['status'] == 'skipped':
+      lines.append('%-16s %-8s' % (m['stage'], m['status']))
+      continue
+    lines.append('%-16s %-8s %9.2f %9.2f %9.2f %10.1f %10.1f %10.1f' % (
+        m['stage'], m['status'], m['wall'], m['cpu'], m['child_cpu'],
+        max(m['maxrss_kb'], m['child_maxrss_kb']) / 1024.0,
+        m['input_bytes'] / 1e6, m['output_bytes'] / 1e6))
+  return lines
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Usage: startup-time.py [-n RUNS] [--budget MODULE=RATIO ...]
+#
+# Import time of the modules every utility loads, from python -X importtime:
+# the median over several fresh interpreters of the cumulative time of each
+# module, checked against a budget.  Exits 1 if a module is over budget.
+#
+# Budgets are multiples of the import time of REFERENCE, measured in the
+# same runs, so that the check does not depend on the speed of the machine.
+#
+# 're' is imported before the module: every utility needs it anyway, so its
+# cost is not charged to the first module which happens to import it.
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+UTILS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Standard module every option parsing utility imports anyway.
+REFERENCE = 'optparse'
+
+# Cumulative import time budget of each module, as a multiple of the import
+# time of REFERENCE.  Before imports were deferred, msg, config and util
+# took 2 to 2.5, about 6, and 7 to 10 times as long as optparse.
+BUDGET = {
+  'msg': 0.25,
+  'cmd_options': 1.5,
+  'config': 0.5,
+  'util': 2.0,
+}
+
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+# Compiled modules must be up to date, or the time to compile them is what
+# gets measured.
+ENV = {k: v for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE'}
+
+
+def run_import(module, *opts):
+  return subprocess.run([sys.executable] + list(opts) +
+                        ['-c', f'import re; import {module}'],
+                        cwd=UTILS_DIR, env=ENV, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE, text=True, check=True)
+
+
+def import_time(module):
+  """@return cumulative import time of 'module' in ms, in a fresh interpreter"""
+  res = run_import(module, '-X', 'importtime')
+  for line in res.stderr.splitlines():
+    m = IMPORTTIME_RE.match(line)
+    if m and m.group(4) == module and len(m.group(3)) == 1:
+      return int(m.group(2)) / 1000.0
+  raise RuntimeError(f'No import time reported for {module}')
+
+
+def parse_budget(specs):
+  budget = dict(BUDGET)
+  for spec in specs:
+    module, _, ratio = spec.partition('=')
+    try:
+      budget[module] = float(ratio)
+    except ValueError:
+      raise argparse.ArgumentTypeError(f'Invalid budget: {spec}')
+  return budget
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Check the import time of the utils modules')
+  parser.add_argument('-n', '--runs', type=int, default=11,
+                      help='interpreters started per module (default: 11)')
+  parser.add_argument('--budget', action='append', default=[],
+                      metavar='MODULE=RATIO',
+                      help=f'budget of a module as a multiple of the import '
+                           f'time of {REFERENCE}, may be repeated')
+  args = parser.parse_args()
+  budget = parse_budget(args.budget)
+
+  over = []
+  print('%-12s %9s %9s %9s %7s %7s' % ('module', 'median', 'min',
+                                       REFERENCE, 'ratio', 'budget'))
+  for module, limit in budget.items():
+    run_import(module)
+    run_import(REFERENCE)
+    # Alternate the two, so both see the same load on the machine.
+    times = []
+    ref_times = []
+    for _ in range(max(1, args.runs)):
+      times.append(import_time(module))
+      ref_times.append(import_time(REFERENCE))
+    med = statistics.median(times)
+    ref = statistics.median(ref_times)
+    ratio = med / ref if ref else 0.0
+    status = '' if ratio <= limit else '  OVER'
+    print('%-12s %8.1fms %8.1fms %8.1fms %7.2f %7.2f%s' % (
+        module, med, min(times), ref, ratio, limit, status))
+    if ratio > limit:
+      over.append(module)
+  return 1 if over else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+# Usage: synth_profile.py OUTDIR [--scale 10] [--cpu-threads 8]
+#                         [--gpu-threads 32] [--kernels 30] [--phases 8] ...
+#        synth_profile.py OUTDIR --perf-dir DIR --regions-csv xpuregions.csv
+#                         [--repeats 3]
+#
+# Write a synthetic XPU profile in the formats the XPU-Profiler and XPU-Timer
+# tools write, so the post-processing pipeline can be run and timed without
+# a GPU:
+#
+#   OUTDIR/BasicBlocksCPU/T.<n>.bb          per-thread CPU BBVs
+#   OUTDIR/BasicBlocks.<pid>/thread.bbv     GPU BBV with 'tid<N>:' lines
+#   OUTDIR/BasicBlocks.<pid>/global.bbv     GPU BBV summed over the threads
+#   OUTDIR/KOIPerf.<pid>/gpu.onkernelperf.out   per-slice timer trace
+#
+# The program runs through phases: each phase has its own kernels, hot basic
+# blocks and cost per slice, so clustering finds them again.  --scale
+# multiplies the number of slices; the default of 2000 slices, 8 CPU threads
+# and 32 GPU threads stands for one GROMACS run.
+#
+# Once the pipeline has written the region CSV, the second form writes the
+# perf.r<id>.txt and perf.wp.txt timer files of the regions for
+# extrapolate.py, from the same model (the parameters are read back from
+# OUTDIR/synth-profile.json).
+
+import os
+import sys
+import json
+import argparse
+import logging
+
+import numpy as np
+
+PARAMS_FILE = 'synth-profile.json'
+
+DEFAULTS = {
+    'cpu_threads': 8,
+    'gpu_threads': 32,
+    'kernels': 30,
+    'phases': 8,
+    'slices': 2000,
+    'scale': 1.0,
+    'phase_length': 25,
+    'cpu_blocks': 30000,
+    'gpu_blocks': 6000,
+    'cpu_blocks_per_slice': 60,
+    'gpu_blocks_per_slice': 16,
+    'gpu_active': 0.5,
+    'noise': 0.05,
+    'pid': 1,
+    'seed': 1,
+}
+
+# Each phase draws the blocks of a slice from HOT_FACTOR times as many hot
+# blocks as a slice has.
+HOT_FACTOR = 4
+
+# Slices generated at a time, to bound memory at large scales.
+CHUNK = 1024
+
+INIT_TSC = 1343417934170000
+
+# Share of a slice spent on the CPU before its kernel runs.
+CPU_SHARE = 0.3
+
+OUTPUT_BUFFER = 1 << 20
+
+
+class Model:
+  """
+  Phase structure, kernels and per-slice cost of a synthetic run, all drawn
+  from 'seed' so the profile and the timer files agree.
+  """
+
+  def __init__(self, p):
+    self.p = p
+    rng = np.random.default_rng([p['seed'], 0])
+    n = max(1, int(round(p['slices'] * p['scale'])))
+    self.num_slices = n
+
+    # Phases are visited in runs of about 'phase_length' slices, some
+    # phases more often than others.
+    nphases = p['phases']
+    freq = rng.dirichlet(np.ones(nphases))
+    phase = []
+    pos = []
+    while len(phase) < n:
+      length = 1 + rng.poisson(max(0, p['phase_length'] - 1))
+      phase += [rng.choice(nphases, p=freq)] * length
+      pos += range(length)
+    self.phase = np.array(phase[:n])
+
+    # Each phase runs a cycle of a few kernels.
+    cycles = [rng.choice(p['kernels'], replace=False,
+                         size=rng.integers(1, min(p['kernels'], 6) + 1))
+              for _ in range(nphases)]
+    lens = np.array([len(c) for c in cycles])
+    step = np.array(pos[:n]) % lens[self.phase]
+    self.kernel = np.array([cycles[ph][s] for ph, s in
+                            zip(self.phase.tolist(), step.tolist())])
+    self.call = np.zeros(n, dtype=np.int64)
+    for k in np.unique(self.kernel):
+      mask = self.kernel == k
+      self.call[mask] = np.arange(1, mask.sum() + 1)
+
+    self.phase_cost = rng.lognormal(np.log(2e6), 0.8, size=nphases)
+    self.cost = self.costs(np.random.default_rng([p['seed'], 1]))
+
+    self.cpu_hot = self._hot(rng, p['cpu_blocks'], p['cpu_blocks_per_slice'])
+    self.gpu_hot = self._hot(rng, p['gpu_blocks'], p['gpu_blocks_per_slice'])
+
+  def costs(self, rng):
+    """@return TSC cycles of every slice, with run to run noise from 'rng'"""
+    noise = 1 + self.p['noise'] * rng.standard_normal(self.num_slices)
+    return np.maximum(1, (self.phase_cost[self.phase] *
+                          np.clip(noise, 0.2, None)).astype(np.int64))
+
+  def _hot(self, rng, num_blocks, per_slice):
+    """@return (block ids, mean counts), one row per phase"""
+    nhot = min(num_blocks, HOT_FACTOR * per_slice)
+    ids = np.array([rng.choice(num_blocks, size=nhot, replace=False) + 1
+                    for _ in range(self.p['phases'])])
+    counts = 1000.0 / (1 + np.arange(nhot)) ** 1.1
+    counts = np.array([rng.permutation(counts) for _ in range(self.p['phases'])])
+    return ids, counts
+
+  def kernel_name(self, s):
+    return 'kernel_%d' % self.kernel[s]
+
+  def blocks(self, rng, hot, lo, hi, threads, per_slice):
+    """
+    Draw the blocks of slices [lo, hi) for 'threads' threads: a window of
+    the hot blocks of the phase of each slice.
+
+    @return (ids, counts), arrays of shape (slices, threads, per_slice) with
+            the ids of a row sorted
+    """
+    hot_ids, hot_counts = hot
+    nhot = hot_ids.shape[1]
+    per_slice = min(per_slice, nhot)
+    ph = self.phase[lo:hi, None, None]
+    start = rng.integers(nhot, size=(hi - lo, threads, 1))
+    idx = (start + np.arange(per_slice)) % nhot
+    ids = hot_ids[ph, idx]
+    scale = self.cost[lo:hi, None, None] / self.phase_cost[ph]
+    noise = rng.lognormal(0, 0.1, size=ids.shape)
+    counts = np.maximum(1, hot_counts[ph, idx] * scale * noise).astype(np.int64)
+    order = np.argsort(ids, axis=2)
+    return (np.take_along_axis(ids, order, axis=2),
+            np.take_along_axis(counts, order, axis=2))
+
+
+def _vector(ids, counts):
+  return ''.join([':%d:%d ' % x for x in zip(ids.tolist(), counts.tolist())])
+
+
+def write_cpu(model, outdir):
+  p = model.p
+  os.makedirs(outdir, exist_ok=True)
+  rng = np.random.default_rng([p['seed'], 2])
+  files = [open(os.path.join(outdir, 'T.%d.bb' % t), 'w',
+                buffering=OUTPUT_BUFFER) for t in range(p['cpu_threads'])]
+  try:
+    for t, f in enumerate(files):
+      f.write('I: 0\nP: %d\nC: sum:dummy Command:synth_profile.py\n'
+              '# Program Start\n' % t)
+    for lo in range(0, model.num_slices, CHUNK):
+      hi = min(model.num_slices, lo + CHUNK)
+      ids, counts = model.blocks(rng, model.cpu_hot, lo, hi, p['cpu_threads'],
+                                 p['cpu_blocks_per_slice'])
+      for s in range(lo, hi):
+        marker = '# Slice ending at kernel: %s call: %d\n' % (
+            model.kernel_name(s), model.call[s])
+        for t, f in enumerate(files):
+          f.write(marker + 'T' + _vector(ids[s - lo, t], counts[s - lo, t]) +
+                  '\n')
+  finally:
+    for f in files:
+      f.close()
+
+
+def write_gpu(model, outdir):
+  p = model.p
+  os.makedirs(outdir, exist_ok=True)
+  rng = np.random.default_rng([p['seed'], 3])
+  nthreads = p['gpu_threads']
+  with open(os.path.join(outdir, 'thread.bbv'), 'w',
+            buffering=OUTPUT_BUFFER) as tf, \
+       open(os.path.join(outdir, 'global.bbv'), 'w',
+            buffering=OUTPUT_BUFFER) as gf:
+    for lo in range(0, model.num_slices, CHUNK):
+      hi = min(model.num_slices, lo + CHUNK)
+      ids, counts = model.blocks(rng, model.gpu_hot, lo, hi, nthreads,
+                                 p['gpu_blocks_per_slice'])
+      # Warps with no work in a slice have no line; the first warp always
+      # runs, and every warp runs in the first slice so the thread count
+      # can be read from the file.
+      active = rng.random((hi - lo, nthreads)) < p['gpu_active']
+      active[:, 0] = True
+      if lo == 0:
+        active[0, :] = True
+      for s in range(lo, hi):
+        marker = '# Slice ending at kernel: %s call: %d\n' % (
+            model.kernel_name(s), model.call[s])
+        end = 'M: %s %d\n' % (model.kernel_name(s), model.call[s])
+        warps = np.nonzero(active[s - lo])[0]
+        tf.write(marker)
+        for w in warps.tolist():
+          tf.write('tid%d: T%s\n' % (w, _vector(ids[s - lo, w],
+                                                counts[s - lo, w])))
+        tf.write(end)
+        uniq, inv = np.unique(ids[s - lo, warps], return_inverse=True)
+        total = np.bincount(inv.ravel(), weights=counts[s - lo, warps].ravel())
+        gf.write(marker + 'T' + _vector(uniq, total.astype(np.int64)) + '\n' +
+                 end)
+
+
+def write_timer(model, outdir):
+  """Write the slice mode XPU-Timer trace: OnRun/OnComplete per slice."""
+  os.makedirs(outdir, exist_ok=True)
+  tsc = INIT_TSC
+  with open(os.path.join(outdir, 'gpu.onkernelperf.out'), 'w',
+            buffering=OUTPUT_BUFFER) as f:
+    f.write('0 GPU_Init : TSC %d\n' % tsc)
+    cpu = (model.cost * CPU_SHARE).astype(np.int64)
+    for s, (c, k) in enumerate(zip(model.cost.tolist(), cpu.tolist())):
+      name = model.kernel_name(s)
+      f.write('%d OnRun %s TSC %d\n' % (s, name, tsc + k))
+      tsc += c
+      f.write('%d OnComplete %s TSC %d\n' % (s, name, tsc))
+    tsc += int(model.phase_cost.min())
+    f.write('%d GPU_Fini : TSC %d\n' % (model.num_slices, tsc))
+
+
+def read_region_slices(csv_file):
+  """@return dict {region id: slice} of a regions CSV file"""
+  regions = {}
+  with open(csv_file) as f:
+    for line in f:
+      if line.startswith('cluster'):
+        fields = line.split(',')
+        regions[int(fields[2])] = int(fields[0].split()[-1])
+  return regions
+
+
+def write_perf(model, csv_file, outdir, repeats):
+  """
+  Write perf.r<id>.txt for the regions of 'csv_file' and perf.wp.txt, once
+  per repeat (with a '.<n>' suffix when there is more than one), each
+  repeat with its own timing noise.
+  """
+  os.makedirs(outdir, exist_ok=True)
+  regions = read_region_slices(csv_file)
+  warmup = int(model.phase_cost.mean())
+  for r in range(repeats):
+    suffix = '.%d' % r if repeats > 1 else ''
+    cost = model.costs(np.random.default_rng([model.p['seed'], 4, r]))
+    for region, s in sorted(regions.items()):
+      begin = INIT_TSC + warmup
+      end = begin + int(cost[s])
+      with open(os.path.join(outdir, 'perf.r%d.txt%s' % (region, suffix)),
+                'w') as f:
+        f.write('GPU_Init : TSC %d\nWarmup end: TSC %d\n'
+                'Simulation end: TSC %d\nGPU_Fini : TSC %d\n' % (
+                    INIT_TSC, begin, end, end + warmup))
+    with open(os.path.join(outdir, 'perf.wp.txt%s' % suffix), 'w') as f:
+      f.write('GPU_Init : TSC %d\nGPU_Fini : TSC %d\n' % (
+          INIT_TSC, INIT_TSC + int(cost.sum())))
+  return len(regions)
+
+
+def write_clusters(model, outdir):
+  """
+  Write t.simpoints, t.weights and t.labels in SimPoint's formats with the
+  phases of the model as clusters, for running the later stages without a
+  SimPoint binary.
+  """
+  phases, labels = np.unique(model.phase, return_inverse=True)
+  counts = np.bincount(labels)
+  dist = np.abs(model.cost / model.phase_cost[model.phase] - 1)
+  with open(os.path.join(outdir, 't.simpoints'), 'w') as sp, \
+       open(os.path.join(outdir, 't.weights'), 'w') as wt:
+    for c in range(len(phases)):
+      members = np.nonzero(labels == c)[0]
+      rep = members[np.argmin(dist[members])]
+      sp.write('%d %d\n' % (rep, c))
+      wt.write('%.8f %d\n' % (counts[c] / model.num_slices, c))
+  with open(os.path.join(outdir, 't.labels'), 'w',
+            buffering=OUTPUT_BUFFER) as f:
+    f.writelines('%d %.6f\n' % x for x in zip(labels.tolist(), dist.tolist()))
+
+
+def generate(outdir, params):
+  """
+  Write a synthetic profile of 'params' (DEFAULTS where missing) to 'outdir'.
+
+  @return the Model
+  """
+  p = dict(DEFAULTS, **params)
+  model = Model(p)
+  os.makedirs(outdir, exist_ok=True)
+  write_cpu(model, os.path.join(outdir, 'BasicBlocksCPU'))
+  write_gpu(model, os.path.join(outdir, 'BasicBlocks.%d' % p['pid']))
+  write_timer(model, os.path.join(outdir, 'KOIPerf.%d' % p['pid']))
+  with open(os.path.join(outdir, PARAMS_FILE), 'w') as f:
+    json.dump(p, f, indent=2, sort_keys=True)
+  return model
+
+
+def load_model(outdir, **params):
+  """@return the Model of the profile in 'outdir', with 'params' overridden"""
+  with open(os.path.join(outdir, PARAMS_FILE)) as f:
+    p = json.load(f)
+  p.update(params)
+  return Model(p)
+
+
+def get_args():
+  parser = argparse.ArgumentParser(
+      description='Write a synthetic XPU profile for scale testing')
+  parser.add_argument('outdir', help='directory of the synthetic testcase')
+  g = parser.add_argument_group('Profile shape')
+  for name, value in DEFAULTS.items():
+    g.add_argument('--' + name.replace('_', '-'), type=type(value),
+                   default=None, help=f'default: {value}')
+  g = parser.add_argument_group('Region timer files')
+  g.add_argument('--regions-csv',
+                 help='regions CSV written by the pipeline; write the timer '
+                      'files of its regions instead of a profile')
+  g.add_argument('--perf-dir', help='where to write them (default: OUTDIR/perf)')
+  g.add_argument('--repeats', type=int, default=1,
+                 help='timer runs per region (default: 1)')
+  return parser.parse_args()
+
+
+def main():
+  logging.basicConfig(level=logging.INFO,
+                      format='%(asctime)s - %(levelname)s - %(message)s')
+  log = logging.getLogger(__name__)
+  args = get_args()
+  given = {k: getattr(args, k) for k in DEFAULTS if getattr(args, k) is not None}
+
+  if args.regions_csv:
+    # Same model as the profile, unless overridden.
+    model = load_model(args.outdir, **given)
+    perf_dir = args.perf_dir or os.path.join(args.outdir, 'perf')
+    n = write_perf(model, args.regions_csv, perf_dir, max(1, args.repeats))
+    log.info(f'Timer files of {n} regions written to {perf_dir}')
+    return 0
+
+  p = dict(DEFAULTS, **given)
+  if min(p['cpu_threads'], p['gpu_threads'], p['kernels'], p['phases'],
+         p['cpu_blocks'], p['gpu_blocks']) < 1:
+    log.error('Thread, kernel, phase and block counts must be positive')
+    return 1
+  model = generate(args.outdir, p)
+  log.info(f'{model.num_slices} slices, {p["phases"]} phases, '
+           f'{p["cpu_threads"]} CPU and {p["gpu_threads"]} GPU threads '
+           f'written to {args.outdir}')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -6,6 +6,9 @@ import re
 import logging
 from pathlib import Path
 
+import profiling
+import stage_metrics
+
 
 def get_args():
   parser = argparse.ArgumentParser(description="Split GPU thread profiles")
@@ -24,6 +27,7 @@ def get_args():
                       "--verbose",
                       action='store_true',
                       help="Verbose output")
+  profiling.add_argument(parser)
   args = parser.parse_args()
   return args
 
@@ -117,6 +121,7 @@ def main(num_threads, gpu_basedir, out_basedir):
       if file_handle and not file_handle.closed:
         file_handle.close()
 
+  stage_metrics.add_counts(lines=line_count, threads=num_threads)
   log.info("Thread splitting completed successfully")
 
 
@@ -154,6 +159,7 @@ if __name__ == '__main__':
       num_threads = get_num_threads(gpu_basedir)
 
     out_basedir = os.path.join(gpu_basedir, args.outdir)
+    profiling.enable('threadsplit', args.profile, out_basedir)
 
     main(num_threads, gpu_basedir, out_basedir)
 
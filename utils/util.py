@@ -31,18 +31,13 @@
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #END_LEGAL
 
-import datetime
+import collections
 import glob
 import os
 import re
-import platform
-import subprocess
-import optparse
 import string
 import sys
 import time
-import types
-from pathlib import Path
 
 # Local modules
 #
@@ -64,18 +59,10 @@ Config = config.ConfigClass()
 #
 #######################################################################
 
-# Number of concurrent jobs running.
+# Scheduler for the jobs run in the background, created by the first
+# concurrent RunCmd().
 #
-jobs = 0
-
-# The list of PIDs for the running processes.
-#
-running_pid = []
-
-# The strings which are printed when each process is finished.  The strings in this
-# list are in the same order as the processes which are running.
-#
-end_str = []
+scheduler = None
 
 
 def Platform():
@@ -85,6 +72,8 @@ def Platform():
     @return config.LINUX/WIN_CYGWIN/WIN_NATIVE, None if unable to identify platform
     """
 
+    import platform
+
     name = os.name
     system = platform.system()
 
@@ -238,61 +227,43 @@ def JoinOptionsList(cmd):
     return new_cmd
 
 
-def GetJob(options):
+def GetScheduler(options):
     """
-    Wait for a job to complete. Then remove it from the lists.
+    Get the scheduler for background jobs, creating it on first use.
 
-    @return exit code from job
-    @return -1 if job not found
+    'config.num_cores' (or the number of cores in the system) bounds the
+    cores the running jobs may claim.
+
+    @return job_scheduler.Scheduler
     """
 
-    global jobs, running_pid, end_str
+    import job_scheduler
 
-    # Decode the tuple 'status' and get the corresponding end string.
-    # status is a 3-element tuple containing:
-    #   child's PID
-    #   exit status info
-    #   resource usage info
-    #
-    # os.wait3() only is available on Linux/Cygwin.  This code will NOT work
-    # on native Windows.  run with '--num_cores 1' in order to not
-    # invoke this code in native Windows.
-    #
-    status = os.wait3(0)  # Block and wait for a job to complete
-    pid = status[0]
-    result = status[1] >> 8
-    try:
-        num = running_pid.index(pid)
-        string = end_str[num]  # Get end_str for the PID
-    except ValueError:
-        msg.PrintMsgPlus(
-            'WARNING: util.GetJob() unable to find running PID: %d' % pid)
-        string = ''
-        result = -1
+    global scheduler
 
-    # If there is an end string, then print it.
-    #
-    # import pdb;  pdb.set_trace()
-    if string:
-        msg.PrintMsgPlus('Finished processing: ' + string)
-    if hasattr(options, 'verbose') and options.verbose:
-        msg.PrintMsg('Concurrent job finished, PID: ' + str(pid))
+    if config.num_cores > 0:
+        max_cores = config.num_cores
+    else:
+        max_cores = NumCores()
+    if scheduler is None:
+        verbose = hasattr(options, 'verbose') and options.verbose
+        scheduler = job_scheduler.Scheduler(max_cores, verbose=verbose)
+    scheduler.max_cores = max(1, max_cores)
+    return scheduler
 
-    # Remove values from the lists & decrement the number of
-    # running jobs.
-    #
-    # import pdb;  pdb.set_trace()
-    try:
-        running_pid.remove(pid)
-    except ValueError:
-        pass  # Do nothing. Warning already printed out
-    try:
-        end_str.remove(string)
-    except ValueError:
-        pass
-    jobs -= 1
 
-    return result
+def GetJob(options):
+    """
+    Wait for a job to complete. Then remove it from the lists.
+
+    @return exit code from job
+    @return -1 if no job is running
+    """
+
+    sched = GetScheduler(options)
+    if not sched.running:
+        return -1
+    return sched.WaitOne().returncode
 
 
 def WaitJobs(options, wait_all=True):
@@ -304,59 +275,20 @@ def WaitJobs(options, wait_all=True):
     @return non-zero on error
     """
 
-    global jobs, running_pid
-
+    sched = GetScheduler(options)
     if hasattr(options, 'verbose') and options.verbose:
-        msg.PrintMsgPlus('Waiting for background job(s) to finish: ' + str(jobs))
+        msg.PrintMsgPlus('Waiting for background job(s) to finish: ' +
+                         str(sched.NumJobs()))
+    return sched.Wait(wait_all)
 
-    if wait_all:
-
-        # While there are still jobs running, wait for all them to complete.
-        #
-        # import pdb;  pdb.set_trace()
-        result = 0
-        while jobs > 0:
-
-            # For each job left in the list of running jobs, see if it's finished.
-            #
-            # import pdb;  pdb.set_trace()
-            while running_pid != []:
-
-                # Wait for one of the running processes to finish. Then remove
-                # it from the list of running jobs.  If the job ended in an
-                # error, print a message and return an error.
-                #
-                # import pdb;  pdb.set_trace()
-                result = GetJob(options)
-                if result != 0:
-                    msg.PrintMsg(
-                        'WaitJobs() unexpected error occurred: non-zero exit code')
-                    return result
-
-            # Wait a while before checking again for finished jobs.
-            #
-            time.sleep(1)
 
-        # All jobs should have finished by this point. Check to make sure
-        # the number of jobs is indeed 0.
-        #
-        if jobs > 0:
-            msg.PrintAndExit(
-                'WaitJobs() unexpected error occurred: number of jobs runing > 0')
-    else:
-
-        # Only wait for one job to finish before returning. Remove it from the
-        # list of running jobs.  If the job ended in an error, print a message
-        # and return an error.
-        #
-        # import pdb;  pdb.set_trace()
-        result = GetJob(options)
-        if result != 0:
-            msg.PrintMsg(
-                'WaitJobs() unexpected error occurred: non-zero exit code')
-            return result
+def JobResults(options):
+    """
+    @return list of job_scheduler.JobResult for the background jobs that
+            have finished, in the order they finished
+    """
 
-    return result
+    return GetScheduler(options).results
 
 
 def FormatCmd(cmd, print_time=True):
@@ -390,53 +322,16 @@ def FormatCmd(cmd, print_time=True):
     return (cmd)
 
 
-def BackgroundRunCmd(cmd, print_time=True, print_cmd=True):
-    """
-    Run a job in the background using the appropriate process for the
-    current platform.
-
-    @param cmd command to run in the background
-    @param print_time if true, get time required to run the command
-    @param print_cmd if true, print the command before executing it
-
-    @return PID of running job
-    """
-
-    if print_cmd:
-        msg.PrintMsg(''.join(cmd))
-    cmd = FormatCmd(cmd, print_time)
-    platform = Platform()
-    if platform == config.WIN_NATIVE:
-        # Use os.spawnv() to run python to execute the script.
-        #
-        # First, must turn the string cmd into a list, consolidating
-        # all options between double quotes into one element in the
-        # list.  Then prepend the string 'python' to the list as this
-        # needs to be the first string passed to os.spawnv().
-        #
-        pid = os.spawnv(os.P_NOWAIT, sys.executable, cmd)
-    elif platform == config.LINUX or platform == config.WIN_CYGWIN:
-        # Add time to the command string.  os.spawnvp() uses bash to run
-        # the command 'time' which then executes the command.  It's assumed
-        # that all Linux machines have bash.
-        #
-        pid = os.spawnvp(os.P_NOWAIT, 'bash', cmd)
-
-    return pid
-
-
 def RunCmd(cmd, options, string, concurrent=False, print_time=True, print_cmd=True, \
-           f_stdout=None, f_stderr=None):
+           f_stdout=None, f_stderr=None, cores=1, mem_mb=0, priority=0, retries=0):
     """
     Execute a command and return the exit code.
 
-    If the job is to be run concurrently, check to see if there is an
-    unused core on which to run the job.  If there is a free core on
-    which to run a job, run it in the background. Return once the job
-    is started in the background.
-
-    If a core is not available, then wait until there is a core available
-    and then run the job in the background.
+    If the job is to be run concurrently, hand it to the scheduler and
+    return.  The scheduler runs it in the background as soon as the
+    cores and memory it needs are free, higher 'priority' jobs first,
+    and runs it again up to 'retries' times if it fails.  Use WaitJobs()
+    to wait for the jobs and JobResults() for how each of them ended.
 
     If not running concurrently, run the job and wait until it completes
     before returning.
@@ -449,13 +344,16 @@ def RunCmd(cmd, options, string, concurrent=False, print_time=True, print_cmd=Tr
     @param print_cmd if true, print the command before executing it
     @param f_stdout file pointer for standard output
     @param f_stderr file pointer for standard error
+    @param cores cores a concurrent job uses
+    @param mem_mb memory (MB) a concurrent job needs
+    @param priority concurrent jobs with a higher priority start first
+    @param retries times a failed concurrent job is run again
 
     @result 0 if successful
-    @result Non-zero if an error occurs,
+    @result Non-zero if an error occurs, for concurrent jobs the exit code
+            of a job that failed since the last call
     """
 
-    global jobs, running_pid, end_str
-
     # If just listing the command or debugging, then print it, but
     # don't execute it.
     #
@@ -477,50 +375,45 @@ def RunCmd(cmd, options, string, concurrent=False, print_time=True, print_cmd=Tr
         #
         # import pdb;  pdb.set_trace()
         if concurrent and max_cores > 1:
-            # If running concurrently, either run the job or wait
-            # until it can be run.
+            # Queue the job; the scheduler starts it once there are
+            # resources for it.
             #
-            if jobs >= max_cores:
-                if hasattr(options, 'verbose') and options.verbose:
-                    msg.PrintMsg('Calling WaitJobs() from RunCmd()')
-                result = WaitJobs(options, wait_all=False)
-
-            # There is a free core, so start the current job and add it to
-            # the list 'running_pid'.  Also add the string to list 'end_str'.
-            #
-            if hasattr(options, 'verbose') and options.verbose:
-                msg.PrintMsgPlus('Running job in background')
+            msg.PrintVerbose('Running job in background')
+            import job_scheduler
             if print_cmd:
                 msg.PrintMsgPlus('Processing: ' + string)
-            jobs += 1
-            end_str.append(string)
-            pid = BackgroundRunCmd(cmd, print_time, print_cmd)
-            running_pid.append(pid)
-            if hasattr(options, 'verbose') and options.verbose:
-                msg.PrintMsg('Job PID: %d' % pid)
+                msg.PrintMsg(''.join(cmd))
+            job = job_scheduler.Job(FormatCmd(cmd, print_time), name=string,
+                                    cores=cores, mem_mb=mem_mb,
+                                    priority=priority, retries=retries,
+                                    stdout=f_stdout, stderr=f_stderr)
+            for done in GetScheduler(options).Submit(job):
+                if done.returncode != 0 and result == 0:
+                    msg.PrintMsg(
+                        'RunCmd() unexpected error occurred: non-zero exit code')
+                    result = done.returncode
         else:
 
             # Run the process in the foreground.  The method communicate()
             # waits until the process completes.
             #
             # import pdb;  pdb.set_trace()
-            if hasattr(options, 'verbose') and options.verbose:
-                msg.PrintMsgNoCR('Starting serial job: ')
+            msg.PrintVerbose('Starting serial job: ', end='')
             if print_cmd:
                 msg.PrintMsg(cmd)
             cmd = FormatCmd(cmd, print_time)
+            import subprocess
+            msg.Flush()
             p = subprocess.Popen(cmd,
                                  stdout=f_stdout,
                                  stderr=f_stderr,
                                  shell=False)
-            if hasattr(options, 'verbose') and options.verbose:
-                msg.PrintMsg('Job PID: %d' % p.pid)
+            msg.PrintVerbose('Job PID: %d' % p.pid)
             p.communicate()
             if string:
                 msg.PrintMsgDate(string)
             result = p.returncode
-            if hasattr(options, 'verbose') and options.verbose:
-                msg.PrintMsg('Serial job finished, PID: %d ' % p.pid)
+            msg.PrintVerbose('Serial job finished, PID: %d ' % p.pid)
 
     return result
 
@@ -531,6 +424,118 @@ def RunCmd(cmd, options, string, concurrent=False, print_time=True, print_cmd=Tr
 #
 #################################################################
 
+# One pinball result file: the pinball name, the PID/TID from the file name
+# (None if the name doesn't follow the WP pinball convention) and the
+# 'key: value' pairs in the file, keys including the trailing ':'.
+#
+ResultFile = collections.namedtuple('ResultFile',
+                                    ['name', 'pinball', 'pid', 'tid', 'values'])
+
+result_name_re = re.compile('_([0-9]*)\.([0-9]*)\.result$')
+
+# Result file index of each directory scanned: the directory mtime, the
+# (size, mtime) and ResultFile of each file, and the index itself.
+#
+_result_index_cache = {}
+
+
+def ReadResultFile(path):
+    """
+    Get all the 'key: value' pairs in one result file.  If a key is given
+    more than once, the last value is kept.
+
+    @return ResultFile
+    """
+
+    name = os.path.basename(path)
+    m = result_name_re.search(name)
+    if m:
+        pinball, pid, tid = name[:m.start()], m.group(1), m.group(2)
+    else:
+        pinball, pid, tid = name[:-len('.result')], None, None
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                field = line.split()
+                if len(field) > 1 and field[0].endswith(':'):
+                    values[field[0]] = field[1]
+    except IOError:
+        msg.PrintAndExit(
+            'function util.ReadResultFile(), can\'t open file: ' + path)
+    return ResultFile(name, pinball, pid, tid, values)
+
+
+def ResultIndex(dirname):
+    """
+    Index the result files in a directory.  The files are read in parallel
+    the first time.  Later the directory is listed again only once it
+    changes, and a file is read again only once its size or mtime changes.
+
+    @return dictionary of ResultFile for each result file, keyed by
+            (pinball, pid, tid)
+    """
+
+    dirname = os.path.abspath(dirname or '.')
+    try:
+        mtime = os.stat(dirname).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _result_index_cache.get(dirname)
+    entries = cached[1] if cached else {}
+    if cached and cached[0] == mtime:
+        paths = list(entries)
+    else:
+        paths = [e.path for e in os.scandir(dirname)
+                 if e.name.endswith('.result') and e.is_file()]
+
+    # Files rewritten in place do not change the directory mtime.
+    #
+    keys = {}
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        keys[p] = (st.st_size, st.st_mtime_ns)
+    stale = [p for p in keys if p not in entries or entries[p][0] != keys[p]]
+    if cached and cached[0] == mtime and not stale and len(keys) == len(paths):
+        return cached[2]
+
+    if config.num_cores > 0:
+        max_workers = config.num_cores
+    else:
+        max_workers = NumCores()
+    if len(stale) > 1 and max_workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(stale))) as pool:
+            results = list(pool.map(ReadResultFile, stale))
+    else:
+        results = [ReadResultFile(p) for p in stale]
+    read = dict(zip(stale, results))
+
+    entries = {p: (keys[p], read[p] if p in read else entries[p][1])
+               for p in keys}
+    index = {(r.pinball, r.pid, r.tid): r for _, r in entries.values()}
+    _result_index_cache[dirname] = (mtime, entries, index)
+    return index
+
+
+def FindResultFiles(dirname, file_name):
+    """
+    Get the result files in 'dirname' which match the glob pattern
+    'file_name*.result', from the directory's result file index.
+
+    @return list of (path, ResultFile)
+    """
+
+    import fnmatch
+    pattern = os.path.basename(file_name) + '*.result'
+    dirname = os.path.join(dirname, os.path.dirname(file_name))
+    return [(os.path.join(dirname, r.name), r)
+            for r in ResultIndex(dirname).values()
+            if fnmatch.fnmatch(r.name, pattern)]
+
 
 def GetAllIcount(dirname, file_name):
     """
@@ -548,19 +553,16 @@ def GetAllIcount(dirname, file_name):
     file_name = ChangeExtension(file_name, '.result', '')
     file_name = RemoveTID(file_name)
 
-    # Get the result file(s) for the pinball and the icount for each thread.
+    # Get the result file(s) for the pinball from the directory's index and
+    # the icount for each thread.
     #
     #import pdb ; pdb.set_trace()
     all_icount = []
-    files = glob.glob(os.path.join(dirname, file_name + '*' + '.result'))
-    for pfile in files:
-        field = FindResultString(pfile, 'inscount:')
-        icount = field[0]
+    for pfile, result in FindResultFiles(dirname, file_name):
+        icount = result.values.get('inscount:')
         icountFound = (icount != None)
         if icountFound:
             icount = int(icount)
-            pid = field[1]
-            tid = field[2]
         else:
             icount = 0
         if icountFound:
@@ -597,17 +599,9 @@ def GetMaxIcount(dirname, file_name):
     #
     # import pdb ; pdb.set_trace()
     max_icount = 0
-    files = glob.glob(os.path.join(dirname, file_name + '*' + '.result'))
-    for pfile in files:
-        field = FindResultString(pfile, 'inscount:')
-        icount = field[0]
+    for pfile, result in FindResultFiles(dirname, file_name):
+        icount = result.values.get('inscount:')
         icountFound = (icount != None)
-        if icountFound:
-            icount = int(icount)
-            pid = field[1]
-            tid = field[2]
-        else:
-            icount = 0
         if icountFound:
             icount = int(icount)
         else:
@@ -641,14 +635,10 @@ def GetMinIcount(dirname, file_name):
     #
     # import pdb ; pdb.set_trace()
     min_icount = sys.maxsize
-    files = glob.glob(os.path.join(dirname, file_name + '*' + '.result'))
-    for pfile in files:
-        field = FindResultString(pfile, 'inscount:')
-        icount = field[0]
+    for pfile, result in FindResultFiles(dirname, file_name):
+        icount = result.values.get('inscount:')
         if icount:
             icount = int(icount)
-            pid = field[1]
-            tid = field[2]
         else:
             icount = 0
         if icount:
@@ -1275,6 +1265,7 @@ def AddCfgFile(options):
     string = ''
     if hasattr(options, 'config_file'):
         if options.config_file:
+            from pathlib import Path
             for c_file in options.config_file:
               c_file = Path(c_file).resolve(strict=True)
               string += f' --cfg {c_file} '  
@@ -1566,6 +1557,7 @@ def AddMethodcbsp(options):
     Add the cbsp() method to a object of type optparse.Values.
     """
 
+    import types
     options.cbsp = types.MethodType(cbsp, options)
 
     return options
@@ -1694,6 +1686,7 @@ def GetScriptDir():
     @return script directory
     """
 
+    from pathlib import Path
     return f'{Path(sys.argv[0]).parent.resolve(strict=True)}'
 
 
@@ -1769,6 +1762,8 @@ def PhaseBegin(options):
     @return no return
     """
 
+    import datetime
+
     global phase_start
     phase_start = datetime.datetime.now()
 
@@ -1783,6 +1778,8 @@ def IntermediatePhase(options):
     @return string with delta
     """
 
+    import datetime
+
     global phase_start
 
     # import pdb ; pdb.set_trace()
@@ -1802,6 +1799,8 @@ def PhaseEnd(options):
     @return string with delta
     """
 
+    import datetime
+
     global phase_start
 
     # import pdb ; pdb.set_trace()
@@ -1885,6 +1884,8 @@ def PrintModuleVersions():
 
     # Get all the Python files & sort them.
     #
+    import subprocess
+
     # import pdb;  pdb.set_trace()
     py_files = glob.glob('*.py')
     py_files += glob.glob('base/*.py')
@@ -2702,13 +2703,6 @@ def GetClusterInfo(file_name, param):
     @return dictionary containing cluster information
     """
 
-    # Assume the first field, which contains the cluster information, has the format:
-    #   cluster 0 from slice 88
-    #
-    cluster_pattern = '[Cc]luster\s(\d+)\sfrom slice\s(\d+)'
-    warmup_pattern = 'Warmup\sfor\sregionid\s(\d+)'
-    total_instr_pattern = '.*Total instructions in.*= (\d+)'
-
     # If file_name is not a CSV file, then need to get the CSV
     # file corresponding to file_name.
     #
@@ -2718,59 +2712,112 @@ def GetClusterInfo(file_name, param):
         file_name = region_file
         # self.region_CSV_file = region_file    # Save name of region CSV file in class attribute
 
+    if not os.path.isfile(file_name):
+        return {}, {}, 0
+    csv = ReadRegionCSV(file_name)
+
+    # Callers may modify the dictionaries, so don't hand out the cached ones.
+    #
+    return dict(csv.cluster_info), dict(csv.warmup_info), csv.total_instr
+
+
+# Region CSV files parsed by ReadRegionCSV().
+#
+RegionCSV = collections.namedtuple(
+    'RegionCSV', ['cluster_info', 'warmup_info', 'total_instr'])
+
+# Assume the first field, which contains the cluster information, has the format:
+#   cluster 0 from slice 88
+#
+cluster_re = re.compile('[Cc]luster\s(\d+)\sfrom slice\s(\d+)')
+warmup_re = re.compile('Warmup\sfor\sregionid\s(\d+)')
+total_instr_re = re.compile('Total instructions in.*= (\d+)')
+
+# Most recently read region CSV files, keyed by (path, mtime, size).
+#
+_region_csv_cache = collections.OrderedDict()
+REGION_CSV_CACHE_SIZE = 32
+
+
+def ReadRegionCSV(file_name):
+    """
+    Read a region CSV file in one pass.  The result is kept for as long as
+    the file is unchanged, so phases which look at the same file again
+    don't read it again.
+
+    @return RegionCSV with the cluster info and warmup info dictionaries
+            described in GetClusterInfo() and the total number of
+            instructions
+    """
+
+    try:
+        st = os.stat(file_name)
+    except OSError:
+        msg.PrintAndExit(
+            'method phases.GetClusterInfo() can\'t open file: ' + file_name)
+    key = (os.path.abspath(file_name), st.st_mtime_ns, st.st_size)
+    if key in _region_csv_cache:
+        _region_csv_cache.move_to_end(key)
+        return _region_csv_cache[key]
+
     cluster_info = {}
     warmup_info = {}
     total_instr = 0
-    # import pdb;  pdb.set_trace()
-    if os.path.isfile(file_name):
-        try:
-            f = open(file_name)
-        except IOError:
-            msg.PrintAndExit(
-                'method phases.GetClusterInfo() can\'t open file: ' + file_name)
+    try:
+        f = open(file_name)
+    except IOError:
+        msg.PrintAndExit(
+            'method phases.GetClusterInfo() can\'t open file: ' + file_name)
 
+    with f:
         numfields = 0
-        for string in f.readlines():
+        for string in f:
 
             # Look for the cluster information
             #
             line = string
             if '#' in string:
                 line = string.partition('#')[2]  # Remove any comments
-            # if '#' is found 
+            # if '#' is found
             #   patition() returns the part before '#', '#', part after '#'
             # else
             #   patition() returns string followed by two empty strings
-            fields = re.split(',', line)  # Find line with CSV fields
-            if 'comment' in  fields[0]:
-                numfields=len(fields)
+            fields = line.split(',')  # Find line with CSV fields
+            if 'comment' in fields[0]:
+                numfields = len(fields)
                 continue
-            if numfields == 0: 
+            if numfields == 0:
                 continue
             if len(fields) == numfields:
                 # Get cluster number from the first field
                 #
-                c = re.search(cluster_pattern, fields[0])
-                if c:
-                    num = int(c.group(1))
-                    cluster_info[num] = line
-                    warmup_info[num] = ''
-                    # may be modified later if warmup record exists
-                    # assumes simulation records are emitted before warmup
-                c = re.search(warmup_pattern, fields[0])
-                if c:
-                    regionid = int(c.group(1))
-                    warmup_info[regionid-1] = line
+                field = fields[0]
+                if 'luster' in field:
+                    c = cluster_re.search(field)
+                    if c:
+                        num = int(c.group(1))
+                        cluster_info[num] = line
+                        warmup_info[num] = ''
+                        # may be modified later if warmup record exists
+                        # assumes simulation records are emitted before warmup
+                if 'Warmup' in field:
+                    c = warmup_re.search(field)
+                    if c:
+                        regionid = int(c.group(1))
+                        warmup_info[regionid-1] = line
 
             # Look for total number of instructions
             #
-            c = re.search(total_instr_pattern, string)
-            if c:
-                total_instr = int(c.group(1))
-
-        f.close()
+            if 'Total instructions in' in string:
+                c = total_instr_re.search(string)
+                if c:
+                    total_instr = int(c.group(1))
 
-    return cluster_info, warmup_info, total_instr
+    csv = RegionCSV(cluster_info, warmup_info, total_instr)
+    _region_csv_cache[key] = csv
+    while len(_region_csv_cache) > REGION_CSV_CACHE_SIZE:
+        _region_csv_cache.popitem(last=False)
+    return csv
 
 
 def ParseClusterInfo(cluster_info):
@@ -2886,20 +2933,14 @@ def ParseClusterInfo(cluster_info):
     #
     # 16) Region type "warmup" of "simulation"
     #
-    cluster_iregion_pattern = '[Cc]luster\s(\d+)\sfrom slice\s[0-9]+,(\d+),(\d+),(\d+),(\d+),' \
-                      '(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?)'
-    cluster_pcregion_pattern = '[Cc]luster\s(\d+)\sfrom slice\s[0-9]+,(\d+),(\d+),' \
-                      '(0x[0-9a-f]+),([\S]+),(0x[0-9a-f]+),(\d+),' \
-                      '(0x[0-9a-f]+),([\S]+),(0x[0-9a-f]+),(\d+),(\d+),(\d+),' \
-                      '(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?),' \
-                      '(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?),' \
-                      '(warmup|simulation)'
-
+    # The patterns are compiled once, see cluster_iregion_re and
+    # cluster_pcregion_re below.
+    #
     # For each cluster, parse the information and record it.
     #
     cluster_list = []
     for cluster in list(cluster_info.values()):
-        c = re.search(cluster_iregion_pattern, cluster)
+        c = cluster_iregion_re.search(cluster)
         if c:
             cl_dir = {}
             cl_dir['cluster_num'] = int(c.group(1))
@@ -2910,7 +2951,7 @@ def ParseClusterInfo(cluster_info):
             cl_dir['weight'] = float(c.group(6))
             cluster_list.append(cl_dir)
         else:
-            c = re.search(cluster_pcregion_pattern, cluster)
+            c = cluster_pcregion_re.search(cluster)
             if c:
                 cl_dir = {}
                 cl_dir['cluster_num'] = int(c.group(1))
@@ -2934,6 +2975,18 @@ def ParseClusterInfo(cluster_info):
     return cluster_list
 
 
+cluster_iregion_re = re.compile(
+    '[Cc]luster\s(\d+)\sfrom slice\s[0-9]+,(\d+),(\d+),(\d+),(\d+),'
+    '(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?)')
+cluster_pcregion_re = re.compile(
+    '[Cc]luster\s(\d+)\sfrom slice\s[0-9]+,(\d+),(\d+),'
+    '(0x[0-9a-f]+),([\S]+),(0x[0-9a-f]+),(\d+),'
+    '(0x[0-9a-f]+),([\S]+),(0x[0-9a-f]+),(\d+),(\d+),(\d+),'
+    '(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?),'
+    '(-?\ *[0-9]+\.?[0-9]*(?:[Ee]\ *-?\ *[0-9]+)?),'
+    '(warmup|simulation)')
+
+
 def CountClusters(file_name, param):
     """
     Count the clusters in a region CSV file.
@@ -3034,21 +3087,18 @@ def OpenCompressFile(sim_file):
     #
     # import pdb ; pdb.set_trace()
     err_msg = lambda: msg.PrintMsg('Unable to open data file: ' + sim_file)
+    # Compressed files are decompressed ahead of the reader, in parallel
+    # when the file is made of independent blocks, and seek() restarts from
+    # the nearest access point instead of the start of the file.
+    #
     ftype = file_type(sim_file)
-    if ftype == 'gz':
-        import gzip
+    if ftype in ('gz', 'bz2'):
+        import compress_reader
         try:
-            f = gzip.open(sim_file, 'rb')
+            f = compress_reader.Open(sim_file, ftype)
         except IOError:
             err_msg
             return None
-    elif ftype == 'bz2':
-        import bz2
-        try:
-            f = bz2.BZ2File(sim_file, 'rb')
-        except:
-            err_msg
-            return None
     else:
         try:
             f = open(sim_file, 'rb')
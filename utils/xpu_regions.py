@@ -49,6 +49,7 @@ import sys
 
 import cmd_options
 import msg
+import profiling
 import util
 from msg import ensure_string
 
@@ -252,6 +253,25 @@ def GetOptions():
             "(project/normal for BBV, weight/normal for LDV). "
             "Must use --normal_bbv and --normal_ldv to define files to process.")
 
+    def focus_thread(parser, group):
+        """
+        IMPORTANT NOTE:
+        This is a local definition for the option which accepts a list of
+        threads instead of the single thread defined in cmd_options.py.
+
+        @return  No return value
+        """
+
+        method = cmd_options.GetMethod(parser, group)
+        method(
+            "-f", "--focus_thread",
+            dest="focus_thread",
+            default=-1,
+            help="Comma separated list of threads used when generating region CSV files. "
+            "Each element is either a TID or 'global'.  A regions CSV file is generated "
+            "for each thread from a single pass over the BBV file.  More than one thread "
+            "requires --csv_prefix.  Default: 0.")
+
     util.CheckNonPrintChar(sys.argv)
     parser = optparse.OptionParser(
         usage=us,
@@ -260,7 +280,7 @@ def GetOptions():
         formatter=cmd_options.BlankLinesIndentedHelpFormatter())
 
     cmd_options.dimensions(parser, '')
-    cmd_options.focus_thread(parser, '')
+    focus_thread(parser, '')
 
     # Options which define the actions the script to execute
     #
@@ -286,9 +306,15 @@ def GetOptions():
     cmd_options.vector_file(parser, file_group)
     cmd_options.weight_file(parser, file_group)
     cmd_options.label_file(parser, file_group)
+    cmd_options.csv_prefix(parser, file_group)
+    cmd_options.csv_file(parser, file_group)
 
     parser.add_option_group(file_group)
 
+    cmd_options.profile(parser, '')
+    cmd_options.quiet(parser, '')
+    cmd_options.verbose(parser)
+
     # Parse command line options and get any arguments.
     #
     (options, args) = parser.parse_args()
@@ -467,23 +493,15 @@ def PrintVectorFile(matrix):
     #
     # import pdb;  pdb.set_trace()
     num_row = len(matrix)
-    print('%d:w' % num_row)
+    with msg.OpenOutput() as out:
+        out.write('%d:w\n' % num_row)
 
-    # Print vectors
-    #
-    weight = 1 / float(num_row)
-    dim = len(matrix[0])
-    index = 0
-    while index < num_row:
-        dim = len(matrix[index])
-        print('%.23f %d:' % (weight, dim), end=' ')
-        vector = matrix[index]
-        # for block in vector:    print '%.19f' % block,
-        for block in vector:
-            print('%.20f' % block, end=' ')
-        print()
-        index += 1
-        # import pdb;  pdb.set_trace()
+        # Print vectors, one write per vector.
+        #
+        weight = 1 / float(num_row)
+        for vector in matrix:
+            out.write('%.23f %d: ' % (weight, len(vector)) +
+                      ''.join(['%.20f ' % block for block in vector]) + '\n')
 
 
 def ReadVectorFile(v_file):
@@ -851,6 +869,37 @@ def GetRegionBBV(fp, RegionToSlice, max_region_number, sliceCluster, weight_dict
     return cumulative_icount, all_bb, bb_freq, bb_num_instr, region_bbv, region_start_markers, region_end_markers, first_bb_marker, region_multiplier
 
 
+def GetRegionBBVMatrix(matrix, RegionToSlice, max_region_number, sliceCluster, weight_dict):
+    """
+    Get the data GetRegionBBV() reads from a BBV file from its BBV matrix
+    instead (see bbv_matrix.py).  The per-block statistics, which the CSV
+    does not use, are left empty.
+
+    @return same as GetRegionBBV()
+    """
+    num_regions = max_region_number + 1
+    region_start_markers = [None] * num_regions
+    region_end_markers = [None] * num_regions
+    region_multiplier = [0.0] * num_regions
+
+    # Slices without instructions take no part in the cumulative icount.
+    #
+    sums = matrix.row_sums()
+    cumulative_icount = sums[sums != 0].cumsum().tolist()
+
+    for slice_num in sorted(set(RegionToSlice.values())):
+        if slice_num >= matrix.num_slices:
+            continue
+        clusterid = sliceCluster[slice_num]
+        region_start_markers[clusterid] = matrix.marker(slice_num)
+        region_end_markers[clusterid] = matrix.marker(slice_num + 1)
+
+    total_num_slices = len(cumulative_icount)
+    for region in sorted(RegionToSlice.keys()):
+        region_multiplier[region] = weight_dict[region]*total_num_slices
+    return cumulative_icount, {}, {}, {}, [], region_start_markers, region_end_markers, matrix.marker(0), region_multiplier
+
+
 def CheckRegions(simp_dict, weight_dict):
     """
     Check to make sure the simpoint and weight files contain the same regions.
@@ -867,52 +916,67 @@ def CheckRegions(simp_dict, weight_dict):
 
     if len(simp_dict) != len(weight_dict) or \
        sorted(simp_dict.keys()) != sorted(weight_dict.keys()):
-        msg.PrintMsg('ERROR: ICount Regions in these two files are not identical')
-        msg.PrintMsg('   Simpoint regions: ' + str(sorted(simp_dict.keys())))
-        msg.PrintMsg('   Weight regions:   ' + str(sorted(weight_dict.keys())))
         cleanup()
-        sys.exit(-1)
+        msg.PrintAndExit(
+            'ICount Regions in these two files are not identical\n' +
+            '   Simpoint regions: ' + str(sorted(simp_dict.keys())) + '\n' +
+            '   Weight regions:   ' + str(sorted(weight_dict.keys())))
 
 
-def GenRegionCSV(options, fp_bbv, fp_simp, fp_weight, sliceCluster):
+def GetFocusThreads(options):
     """
-    Read in three files (BBV, weights, simpoints) and print to stdout
-    a regions CSV file which defines the representative regions.
+    Get the list of focus threads for which region CSV files are generated.
 
-    @return no return value
+    The option --focus_thread may contain a comma separated list of threads,
+    where each element is either a TID or the string 'global'.  A TID of -1
+    (the default) is mapped to thread 0.
+
+    @return list of focus threads, elements are either an int or 'global'
     """
 
-    # Read data from weights, simpoints and BBV files.
-    # Error check the regions.
+    tids = []
+    for tid in str(options.focus_thread).split(','):
+        tid = tid.strip()
+        if tid == '':
+            continue
+        if tid == 'global':
+            tids.append('global')
+        elif util.IsInt(tid):
+            tids.append(max(int(tid), 0))
+        else:
+            msg.PrintAndExit('Invalid focus thread: ' + tid)
+    if not tids:
+        tids = [0]
+
+    # Remove any duplicates, but keep the order given by the user.
     #
-    weight_dict = GetWeights(fp_weight)
-    simp_dict, max_region_number = GetSimpoints(fp_simp)
-    cumulative_icount, all_bb, bb_freq, bb_num_instr, region_bbv, region_start_markers, region_end_markers, first_bb_marker, region_multiplier = GetRegionBBV(
-        fp_bbv, simp_dict, max_region_number, sliceCluster, weight_dict)
-    CheckRegions(simp_dict, weight_dict)
+    return list(dict.fromkeys(tids))
+
+
+def PrintRegionCSV(out, tid, simp_dict, weight_dict, cumulative_icount,
+                   region_start_markers, region_end_markers, region_multiplier):
+    """
+    Print a regions CSV file for the focus thread 'tid' to the file object 'out'.
+
+    All the per-slice data is computed once by GetRegionBBV() and shared
+    between the focus threads.
+
+    @return no return value
+    """
 
     total_num_slices = len(cumulative_icount)
-    total_instr = cumulative_icount[len(cumulative_icount) - 1]
 
     # Print header information
     #
-    msg.PrintMsgNoCR('# Regions based on: ')
+    out.write('# Regions based on: ')
     for string in sys.argv:
-        msg.PrintMsgNoCR(string + ' '),
-    msg.PrintMsg('')
-    msg.PrintMsg(
-        '# comment,thread-id,region-id,region-start-icount,region-end-icount,start-marker,start-marker-count,end-marker,end-marker-count,region-weight,region-multiplier,region-type')
-    # msg.PrintMsg('')
+        out.write(string + ' ')
+    out.write('\n')
+    out.write(
+        '# comment,thread-id,region-id,region-start-icount,region-end-icount,start-marker,start-marker-count,end-marker,end-marker-count,region-weight,region-multiplier,region-type\n')
 
     # Print region information
     #
-    if options.focus_thread == 'global':
-      tid = 'global'
-    else:
-      if int(options.focus_thread) != -1:
-        tid = int(options.focus_thread)
-      else:
-        tid = 0
     total_icount = 0
     region_id = 1
     for region in sorted(simp_dict.keys()):
@@ -933,16 +997,62 @@ def GenRegionCSV(options, fp_bbv, fp_simp, fp_weight, sliceCluster):
         end_icount = cumulative_icount[slice_num]
         length = end_icount - start_icount + 1
         total_icount += length
-        msg.PrintMsg('# Region = %d Slice = %d Icount = %d Length = %d Start Marker = %s Start Marker Count = %d End Marker = %s End Marker Count = %d Weight = %.5f Multiplier = %.5f' % \
+        out.write('# Region = %d Slice = %d Icount = %d Length = %d Start Marker = %s Start Marker Count = %d End Marker = %s End Marker Count = %d Weight = %.5f Multiplier = %.5f\n' % \
             (region_id, slice_num, start_icount, length, start_marker['pc'], start_marker['count'], end_marker['pc'], end_marker['count'], weight, multiplier))
-        if tid == 'global':
-          msg.PrintMsg('cluster %d from slice %d,%s,%d,%d,%d,%s,%d,%s,%d,%.5f,%.5f,simulation\n' % \
-            (region, slice_num, tid, region_id, start_icount, end_icount, start_marker['pc'], start_marker['count'], end_marker['pc'], end_marker['count'], weight, multiplier))
-        else:
-          msg.PrintMsg('cluster %d from slice %d,%d,%d,%d,%d,%s,%d,%s,%d,%.5f,%.5f,simulation\n' % \
+        out.write('cluster %d from slice %d,%s,%d,%d,%d,%s,%d,%s,%d,%.5f,%.5f,simulation\n\n' % \
             (region, slice_num, tid, region_id, start_icount, end_icount, start_marker['pc'], start_marker['count'], end_marker['pc'], end_marker['count'], weight, multiplier))
         region_id += 1
 
+    out.write('# Total instructions in %d regions = %d\n' %
+              (len(simp_dict), total_icount))
+    out.write('# Total instructions in workload = %d\n' %
+              cumulative_icount[total_num_slices - 1])
+    out.write('# Total slices in workload = %d\n' % total_num_slices)
+
+
+def GenRegionCSV(options, fp_bbv, fp_simp, fp_weight, sliceCluster):
+    """
+    Read in three files (BBV, weights, simpoints) and generate a regions CSV
+    file, which defines the representative regions, for each focus thread.
+
+    The BBV file is only read once, no matter how many focus threads are given.
+    With a single focus thread, and no --csv_prefix, the CSV file is written to
+    --csv_file, or printed to stdout.  Otherwise one file 'CSV_PREFIX.<tid>.csv'
+    is written per thread.
+
+    @return no return value
+    """
+
+    # Read data from weights, simpoints and BBV files.
+    # Error check the regions.
+    #
+    weight_dict = GetWeights(fp_weight)
+    simp_dict, max_region_number = GetSimpoints(fp_simp)
+    import bbv_matrix
+    matrix = bbv_matrix.open_matrix(options.bbv_file)
+    if matrix is not None:
+        cumulative_icount, all_bb, bb_freq, bb_num_instr, region_bbv, region_start_markers, region_end_markers, first_bb_marker, region_multiplier = GetRegionBBVMatrix(
+            matrix, simp_dict, max_region_number, sliceCluster, weight_dict)
+    else:
+        cumulative_icount, all_bb, bb_freq, bb_num_instr, region_bbv, region_start_markers, region_end_markers, first_bb_marker, region_multiplier = GetRegionBBV(
+            fp_bbv, simp_dict, max_region_number, sliceCluster, weight_dict)
+    CheckRegions(simp_dict, weight_dict)
+
+    tids = GetFocusThreads(options)
+    if len(tids) > 1 and not options.csv_prefix:
+        msg.PrintAndExit('Must use option \'--csv_prefix\' when generating '
+                         'regions for more than one focus thread.')
+
+    for tid in tids:
+        if options.csv_prefix:
+            csv_file = '%s.%s.csv' % (options.csv_prefix, tid)
+        else:
+            csv_file = options.csv_file
+        with msg.OpenOutput(csv_file) as out:
+            PrintRegionCSV(out, tid, simp_dict, weight_dict,
+                           cumulative_icount, region_start_markers,
+                           region_end_markers, region_multiplier)
+
     # This code is a failed attempt to calculate the coverage of the traces.  It does NOT
     # work.  It's kept because this may be fixed at some future time.
     #
@@ -982,11 +1092,6 @@ def GenRegionCSV(options, fp_bbv, fp_simp, fp_weight, sliceCluster):
         # Print summary statistics
         #
         # import pdb;  pdb.set_trace()
-    msg.PrintMsg('# Total instructions in %d regions = %d' %
-                 (len(simp_dict), total_icount))
-    msg.PrintMsg('# Total instructions in workload = %d' %
-                 cumulative_icount[total_num_slices - 1])
-    msg.PrintMsg('# Total slices in workload = %d' % total_num_slices)
 
 ############################################################################
 #
@@ -1348,6 +1453,8 @@ def ScaleCombine(options):
 ############################################################################
 
 options, fp_bbv, fp_ldv, fp_simp, fp_weight, fp_lbl = GetOptions()
+profiling.enable('xpu_regions', options.profile,
+                 os.path.dirname(options.csv_file or '') or '.')
 
 if options.combine and options.combine >= 0.0:
     ScaleCombine(options)
@@ -1355,7 +1462,12 @@ elif options.csv_region:
     sliceCluster = ProcessLabelFile(fp_lbl)
     GenRegionCSV(options, fp_bbv, fp_simp, fp_weight, sliceCluster)
 elif options.project_bbv:
-    result_matrix = ProjectFVFile(fp_bbv, proj_dim=int(options.dimensions))
+    import bbv_matrix
+    matrix = bbv_matrix.open_matrix(options.bbv_file)
+    if matrix is not None:
+        result_matrix = matrix.project(int(options.dimensions)).tolist()
+    else:
+        result_matrix = ProjectFVFile(fp_bbv, proj_dim=int(options.dimensions))
     PrintVectorFile(result_matrix)
 elif options.weight_ldv:
     result_matrix = GetWeightedLDV(fp_ldv, num_dim=int(options.dimensions))